@@ -1,5 +1,7 @@
 import argparse
+import atexit
 from main import diplomat_server
+from backend.instrumentation import profiler
 import logging
 
 logger = logging.getLogger("myLogger")
@@ -47,6 +49,19 @@ def add_arguments(parser : argparse.ArgumentParser):
 		help="Avoid catching errors to let them show up on logs"
 	)
 
+	parser.add_argument(
+		"--profile", type=str, nargs="?", const="profiles", default=None, metavar="DIR",
+		help="Profile the requests and the indexing phases, and write the profiles of the slow ones in DIR"
+	)
+	parser.add_argument(
+		"--profile-threshold", type=float, default=100,
+		help="Only keep the profiles of the operations slower than this, in milliseconds"
+	)
+	parser.add_argument(
+		"--profile-aggregate", action="store_true",
+		help="Merge the profiles of each operation in a single file, written on exit, instead of one file per call"
+	)
+
 	parser.add_argument(
 		"--static-config", type=str, default=None,
 		help="Provide a static configuration. "
@@ -73,6 +88,9 @@ def main():
 		logging.root.setLevel(level)
 
 	diplomat_server.debug = args.debug
+	if args.profile is not None :
+		profiler.enable(args.profile, args.profile_threshold, args.profile_aggregate)
+		atexit.register(profiler.flush)
 	if args.static_config is not None :
 		diplomat_server.set_static_configuration(args.static_config,base64_encoded=True)
 
@@ -0,0 +1,162 @@
+import bisect
+import functools
+import os
+import threading
+import time
+import typing as T
+from contextlib import contextmanager
+
+from .Profiler import profiler
+
+import logging
+
+logger = logging.getLogger("myLogger")
+
+
+class Histogram:
+	"""
+	Distribution of durations, in seconds, over fixed buckets.
+	"""
+	BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+	def __init__(self):
+		# The last bucket holds everything above the last bound.
+		self.buckets = [0] * (len(self.BOUNDS) + 1)
+		self.count = 0
+		self.sum = 0.0
+		self.max = 0.0
+
+	def observe(self, duration : float):
+		self.buckets[bisect.bisect_left(self.BOUNDS, duration)] += 1
+		self.count += 1
+		self.sum += duration
+		self.max = max(self.max, duration)
+
+	def quantile(self, q : float) -> float:
+		"""
+		:param q: Quantile, between 0 and 1
+		:return: Upper bound of the bucket holding the quantile, the maximum for the last bucket
+		"""
+		rank = q * self.count
+		seen = 0
+		for bound, n in zip(self.BOUNDS, self.buckets) :
+			seen += n
+			if seen >= rank and n > 0 :
+				return min(bound, self.max)
+		return self.max
+
+	def summary(self) -> T.Dict[str,float]:
+		return {"count" : self.count, "total_s" : self.sum, "max_s" : self.max,
+				"p50_s" : self.quantile(0.5), "p99_s" : self.quantile(0.99)}
+
+
+class Metrics:
+	"""
+	Durations of the operations of the server, grouped by family (kind of operation) and name.
+	Recording is cheap enough to be always enabled.
+	The timed operations are also profiled when the profiler is enabled.
+	"""
+
+	def __init__(self):
+		self._histograms : T.Dict[str,T.Dict[str,Histogram]] = dict()
+		self._lock = threading.Lock()
+
+	def observe(self, family : str, name : str, duration : float):
+		"""
+		:param family: Kind of operation, such as lsp_request or sql_query
+		:param name: Name of the operation
+		:param duration: Duration of the operation, in seconds
+		"""
+		with self._lock :
+			histograms = self._histograms.setdefault(family, dict())
+			histogram = histograms.get(name)
+			if histogram is None :
+				histogram = histograms[name] = Histogram()
+			histogram.observe(duration)
+
+	@contextmanager
+	def timer(self, family : str, name : str):
+		"""
+		Time the enclosed block, even if it raises.
+		"""
+		if profiler.is_profiled(family) :
+			with profiler.profile(family, name) :
+				start = time.perf_counter()
+				try :
+					yield
+				finally :
+					self.observe(family, name, time.perf_counter() - start)
+			return
+		start = time.perf_counter()
+		try :
+			yield
+		finally :
+			self.observe(family, name, time.perf_counter() - start)
+
+	def timed(self, family : str, name : T.Optional[str] = None) -> T.Callable:
+		"""
+		Decorator timing each call of a function.
+		:param family: Kind of operation
+		:param name: Name of the operation, the name of the function by default
+		"""
+		def decorator(f):
+			label = f.__name__ if name is None else name
+
+			@functools.wraps(f)
+			def wrapper(*args, **kwargs):
+				if profiler.is_profiled(family) :
+					with self.timer(family, label) :
+						return f(*args, **kwargs)
+				start = time.perf_counter()
+				try :
+					return f(*args, **kwargs)
+				finally :
+					self.observe(family, label, time.perf_counter() - start)
+			return wrapper
+		return decorator
+
+	def snapshot(self) -> T.Dict[str,T.Dict[str,T.Dict[str,float]]]:
+		"""
+		:return: Summary of each operation, by family and name
+		"""
+		with self._lock :
+			return {family : {name : h.summary() for name, h in sorted(histograms.items())}
+					for family, histograms in sorted(self._histograms.items())}
+
+	def reset(self):
+		with self._lock :
+			self._histograms.clear()
+
+	def to_prometheus(self) -> str:
+		"""
+		:return: All the histograms, in the Prometheus text exposition format
+		"""
+		lines = list()
+		with self._lock :
+			for family, histograms in sorted(self._histograms.items()) :
+				metric = f"diplomat_{family}_seconds"
+				lines.append(f"# TYPE {metric} histogram")
+				for name, h in sorted(histograms.items()) :
+					label = name.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+					cumulated = 0
+					for bound, n in zip(Histogram.BOUNDS + (float("inf"),), h.buckets) :
+						cumulated += n
+						le = "+Inf" if bound == float("inf") else repr(bound)
+						lines.append(f"{metric}_bucket{{name=\"{label}\",le=\"{le}\"}} {cumulated}")
+					lines.append(f"{metric}_sum{{name=\"{label}\"}} {h.sum}")
+					lines.append(f"{metric}_count{{name=\"{label}\"}} {h.count}")
+		return "\n".join(lines) + "\n"
+
+	def write_prometheus(self, path : str):
+		"""
+		Write the histograms to a file, replaced at once so that a collector never reads a partial file.
+		:param path: Path to the output file
+		"""
+		tmp_path = f"{path}.tmp"
+		with open(tmp_path, "w") as out :
+			out.write(self.to_prometheus())
+		os.replace(tmp_path, path)
+
+
+# Shared by the whole server.
+metrics = Metrics()
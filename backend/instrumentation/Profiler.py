@@ -0,0 +1,125 @@
+import os
+import re
+import threading
+import time
+import typing as T
+from contextlib import contextmanager
+
+if T.TYPE_CHECKING :
+	import cProfile
+	import pstats
+
+import logging
+
+logger = logging.getLogger("myLogger")
+
+
+class Profiler:
+	"""
+	Profile the instrumented operations with cProfile, and keep the profiles of the slow ones.
+
+	Each slow operation is either written to its own file, or merged into one profile per operation
+	written by flush. Operations nested in a profiled one are part of its profile.
+	"""
+	# Families of operations profiled, see Metrics.
+	FAMILIES = {"lsp_request", "lsp_command", "indexing", "syntax_check"}
+
+	def __init__(self):
+		self.enabled = False
+		self.output_dir = "profiles"
+		# Operations faster than this are not kept, in milliseconds.
+		self.threshold_ms = 100.0
+		self.aggregate = False
+		self._aggregated : T.Dict[T.Tuple[str,str],"pstats.Stats"] = dict()
+		self._lock = threading.Lock()
+		self._local = threading.local()
+
+	def enable(self, output_dir : T.Optional[str] = None, threshold_ms : T.Optional[float] = None,
+			   aggregate : T.Optional[bool] = None):
+		"""
+		:param output_dir: Directory of the profile files
+		:param threshold_ms: Minimum duration of the operations to keep, in milliseconds
+		:param aggregate: Merge the profiles of each operation instead of writing one file per call
+		"""
+		self.output_dir = self.output_dir if output_dir is None else output_dir
+		self.threshold_ms = self.threshold_ms if threshold_ms is None else threshold_ms
+		self.aggregate = self.aggregate if aggregate is None else aggregate
+		os.makedirs(self.output_dir, exist_ok=True)
+		self.enabled = True
+		logger.info(f"Profile operations slower than {self.threshold_ms} ms into {os.path.abspath(self.output_dir)}")
+
+	def disable(self):
+		self.enabled = False
+		self.flush()
+
+	def is_profiled(self, family : str) -> bool:
+		return self.enabled and family in self.FAMILIES
+
+	@contextmanager
+	def profile(self, family : str, name : str):
+		"""
+		Profile the enclosed block, unless an enclosing block of the same thread already is.
+		"""
+		if getattr(self._local, "active", False) :
+			yield
+			return
+		# Not loaded at startup, as profiling is seldom enabled.
+		import cProfile
+		self._local.active = True
+		profile = cProfile.Profile()
+		start = time.perf_counter()
+		try :
+			profile.enable()
+		except ValueError :
+			# Another profiling tool is active on this thread.
+			self._local.active = False
+			yield
+			return
+		try :
+			yield
+		finally :
+			profile.disable()
+			self._local.active = False
+			self._keep(family, name, profile, (time.perf_counter() - start) * 1000)
+
+	def _keep(self, family : str, name : str, profile : "cProfile.Profile", duration_ms : float):
+		if duration_ms < self.threshold_ms :
+			return
+		label = re.sub(r"[^\w.-]+", "_", f"{family}_{name}")
+		try :
+			if self.aggregate :
+				import pstats
+				with self._lock :
+					stats = self._aggregated.get((family, name))
+					if stats is None :
+						self._aggregated[(family, name)] = pstats.Stats(profile)
+					else :
+						stats.add(profile)
+			else :
+				path = os.path.join(self.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{label}_{int(duration_ms)}ms.prof")
+				profile.dump_stats(path)
+				logger.info(f"Profile of {family} {name} ({duration_ms:.0f} ms) written to {path}")
+		except Exception :
+			logger.exception(f"Unable to keep the profile of {family} {name}")
+
+	def flush(self):
+		"""
+		Write the merged profiles, one file per operation.
+		"""
+		with self._lock :
+			for (family, name), stats in self._aggregated.items() :
+				label = re.sub(r"[^\w.-]+", "_", f"{family}_{name}")
+				path = os.path.join(self.output_dir, f"{label}.prof")
+				try :
+					stats.dump_stats(path)
+				except OSError :
+					logger.exception(f"Unable to write the profile {path}")
+
+	@property
+	def status(self) -> T.Dict[str,T.Any]:
+		return {"enabled" : self.enabled, "output_dir" : os.path.abspath(self.output_dir),
+				"threshold_ms" : self.threshold_ms, "aggregate" : self.aggregate}
+
+
+# Shared by the whole server.
+profiler = Profiler()
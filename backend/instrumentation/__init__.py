@@ -0,0 +1,2 @@
+from .Metrics import Metrics, Histogram, metrics
+from .Profiler import Profiler, profiler
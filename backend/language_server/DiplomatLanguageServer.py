@@ -1,19 +1,30 @@
 import base64
+import hashlib
+import itertools
 import json
 import logging
 import os
+import threading
 import typing as T
 import uuid
 
 from pygls import uris
 from pygls.lsp.types import (ConfigurationItem, ConfigurationParams, Range, Location, Position,
 							 Unregistration, UnregistrationParams,
-							 MessageType)
+							 MessageType, WorkDoneProgressBegin, WorkDoneProgressEnd,
+							 SymbolInformation, SymbolKind, Diagnostic, WorkspaceEdit,
+							 CallHierarchyItem, CallHierarchyIncomingCall, CallHierarchyOutgoingCall)
 from pygls.server import LanguageServer
 
-from backend.sql_index_manager import SQLAnchor, SQLSymbol
-from frontend import VeribleIndexer
-from frontend import VeribleSyntaxChecker
+from backend.sql_index_manager import SQLAnchor, SQLSymbol, SQLIndexManager
+from backend.instrumentation import metrics
+from frontend import IndexingError, IndexingCancelled
+from .IndexingScheduler import IndexingScheduler
+from .DocumentCheckScheduler import DocumentCheckScheduler
+from .ResultCache import ResultCache
+
+if T.TYPE_CHECKING :
+	from frontend import VeribleIndexer, VeribleSyntaxChecker
 
 logger = logging.getLogger("myLogger")
 
@@ -25,9 +36,29 @@ class DiplomatLanguageServer(LanguageServer):
 	CMD_TST_PROGRESS_STRT = 'diplomat-server.test.start-progress'
 	CMD_TST_PROGRESS_STOP = 'diplomat-server.test.stop-progress'
 	CMD_DBG_DUMP_INDEX_DB = 'diplomat-server.dbg.dump-index'
+	CMD_DBG_RESULT_CACHE_STATS = 'diplomat-server.dbg.result-cache-stats'
+	CMD_DBG_METRICS = 'diplomat-server.dbg.metrics'
+	CMD_DBG_PROFILE = 'diplomat-server.dbg.profile'
 
 	CONFIGURATION_SECTION = 'diplomatServer'
 
+	# Period of the writes of the metrics file, in seconds.
+	METRICS_EXPORT_PERIOD = 15
+
+	# Kythe kind (or subkind) of the symbols to LSP symbol kind. Other kinds are reported as variables.
+	SYMBOL_KINDS = {
+		"module" : SymbolKind.Module,
+		"package" : SymbolKind.Package,
+		"interface" : SymbolKind.Interface,
+		"class" : SymbolKind.Class,
+		"function" : SymbolKind.Function,
+		"task" : SymbolKind.Method,
+		"constant" : SymbolKind.Constant,
+		"macro" : SymbolKind.Constant,
+		"enum" : SymbolKind.Enum,
+		"field" : SymbolKind.Field,
+	}
+
 	def __init__(self):
 		super().__init__()
 		self.index_path = ""
@@ -35,12 +66,67 @@ class DiplomatLanguageServer(LanguageServer):
 		self.skip_index = False
 		self.indexed = False
 		self.configured = False
-		self.svindexer = VeribleIndexer(None)
-		self.syntaxchecker = VeribleSyntaxChecker()
+		# The frontend is created on first use, which is not before the initialize request is answered.
+		self._svindexer : T.Optional["VeribleIndexer"] = None
+		self._syntaxchecker : T.Optional["VeribleSyntaxChecker"] = None
+		self._frontend_lock = threading.Lock()
+		self.indexing_scheduler = IndexingScheduler(self.run_indexing_job, lambda : self.svindexer.cancel(),
+													lambda : self.svindexer.reset_cancel())
+		self.result_cache = ResultCache()
+		self._result_cache_generation = 0
+		# URI -> content of the documents edited by a rename, and lineage of the index already up to date with it.
+		self._renamed_contents : T.Dict[str,T.Tuple[str,int]] = dict()
+		self.workspace_symbol_limit = 100
+		self.completion_limit = 200
+		# URI -> diagnostics last published for it, for the files with diagnostics only.
+		self._published_diagnostics : T.Dict[str,T.List[Diagnostic]] = dict()
+		self._publish_lock = threading.Lock()
+		self.document_check_scheduler = DocumentCheckScheduler(self.check_document_content,
+															   lambda uri : self.syntaxchecker.cancel_content_check(uris.to_fs_path(uri)))
 		self.progress_uuid = None
 		self.debug = False
 		self.check_syntax = False
 		self.config = None
+		self.metrics_path : T.Optional[str] = None
+		self._metrics_timer : T.Optional[threading.Timer] = None
+
+	@property
+	def svindexer(self) -> "VeribleIndexer":
+		"""
+		Indexer of the workspace.
+		"""
+		if self._svindexer is None :
+			with self._frontend_lock :
+				if self._svindexer is None :
+					from frontend import VeribleIndexer
+					self._svindexer = VeribleIndexer(None)
+		return self._svindexer
+
+	@property
+	def syntaxchecker(self) -> "VeribleSyntaxChecker":
+		"""
+		Syntax checker of the workspace files and of the edited documents.
+		"""
+		if self._syntaxchecker is None :
+			with self._frontend_lock :
+				if self._syntaxchecker is None :
+					from frontend import VeribleSyntaxChecker
+					self._syntaxchecker = VeribleSyntaxChecker()
+		return self._syntaxchecker
+
+	def feature(self, feature_name : str, options : T.Any = None) -> T.Callable:
+		"""
+		Register an LSP feature, recording the duration of each request.
+		"""
+		register = super().feature(feature_name, options)
+		return lambda f : register(metrics.timed("lsp_request", feature_name)(f))
+
+	def command(self, command_name : str) -> T.Callable:
+		"""
+		Register a command, recording the duration of each call.
+		"""
+		register = super().command(command_name)
+		return lambda f : register(metrics.timed("lsp_command", command_name)(f))
 
 	def set_static_configuration(self,config : str ,base64_encoded = False):
 		"""
@@ -65,11 +151,26 @@ class DiplomatLanguageServer(LanguageServer):
 
 		verible_root += "/" if verible_root != "" and verible_root[-1] not in ["\\", "/"] else ""
 		self.svindexer.exec_root = verible_root
+		workers = int(config["backend"].get("indexerWorkers", 1))
+		self.svindexer.workers = workers if workers > 0 else os.cpu_count()
+		self.indexing_scheduler.delay = float(config["backend"].get("indexDebounceDelay", 300)) / 1000
+		self.result_cache.maxsize = int(config["backend"].get("resultCacheSize", 4096))
+		self.workspace_symbol_limit = int(config["backend"].get("workspaceSymbolLimit", 100))
+		self.completion_limit = int(config["backend"].get("completionLimit", 200))
 		self.syntaxchecker.executable = f"{verible_root}verible-verilog-syntax"
+		workers = int(config["backend"].get("syntaxCheckerWorkers", 1))
+		self.syntaxchecker.workers = workers if workers > 0 else os.cpu_count()
+		self.document_check_scheduler.delay = float(config["backend"].get("syntaxCheckDelay", 200)) / 1000
+		metrics_path = config["backend"].get("metricsFile", "")
+		self.metrics_path = os.path.expanduser(os.path.expandvars(metrics_path)) if metrics_path != "" else None
+		self.export_metrics()
 
 		if not os.path.isabs(os.path.realpath(self.flist_path)):
 			self.flist_path = os.path.normpath(os.path.join(self.workspace.root_path, self.flist_path))
 		self.svindexer.workspace_root = os.path.dirname(os.path.abspath(self.flist_path))
+		if config["backend"].get("persistentIndex", False) :
+			cache_dir = config["backend"].get("indexCachePath", "~/.cache/diplomat")
+			self.svindexer.open_index(self.get_index_cache_path(os.path.expanduser(os.path.expandvars(cache_dir))))
 		self.skip_index = config["usePrebuiltIndex"]
 		logger.info(f"Use prebuilt index : {'True' if self.skip_index else 'False'}")
 		if not os.path.isabs(self.flist_path):
@@ -80,6 +181,103 @@ class DiplomatLanguageServer(LanguageServer):
 		logger.info(f"WS root path : {self.svindexer.workspace_root}")
 		self.configured = True
 
+	def export_metrics(self):
+		"""
+		Write the metrics in the Prometheus text format to the configured file, then every METRICS_EXPORT_PERIOD.
+		Nothing is written if no file is configured.
+		"""
+		if self._metrics_timer is not None :
+			self._metrics_timer.cancel()
+			self._metrics_timer = None
+		if self.metrics_path is None :
+			return
+		try :
+			metrics.write_prometheus(self.metrics_path)
+		except OSError :
+			logger.exception(f"Unable to write the metrics to {self.metrics_path}")
+		self._metrics_timer = threading.Timer(self.METRICS_EXPORT_PERIOD, self.export_metrics)
+		self._metrics_timer.daemon = True
+		self._metrics_timer.start()
+
+	def get_index_cache_path(self, cache_dir : str) -> str:
+		"""
+		Path of the persistent index of the current project within the cache directory.
+		Each file list gets its own index.
+		"""
+		os.makedirs(cache_dir, exist_ok=True)
+		key = hashlib.sha1(os.path.abspath(self.flist_path).encode("utf-8")).hexdigest()[:16]
+		return os.path.join(cache_dir, f"index_{key}.db")
+
+	def run_indexing_job(self, files : T.Optional[T.List[str]]):
+		"""
+		Indexing job run by the indexing scheduler.
+		:param files: Files to reindex, or None to rebuild the whole index
+		"""
+		title = "Indexing" if files is None else f"Indexing {len(files)} files"
+		progress_token = self._begin_progress(title)
+		message = "Done"
+		try :
+			if files is None :
+				self._run_full_index()
+			else :
+				self.show_message_log(f"Reindex {len(files)} files.")
+				self.svindexer.reindex_files(files)
+		except IndexingCancelled :
+			message = "Cancelled"
+			raise
+		except IndexingError :
+			message = "Failed"
+			self.show_message_log(f"  Reindex failed")
+			if files is None :
+				self.syntax_check()
+			self.indexed = False
+		else :
+			if files is None :
+				self.indexed = True
+			self.show_message_log("  Indexing done")
+		finally :
+			self._end_progress(progress_token, message)
+
+	def _run_full_index(self):
+		# The index itself is cleared by the indexer, unless it can be updated in place.
+		self.show_message_log(f"  Clear file list.")
+		self.svindexer.filelist.clear()
+		self.show_message_log(f"  Clear diagnostics.")
+		self.clear_diagnostics()
+		# Queries keep being answered by the current index until the new one is ready.
+		if not self.skip_index :
+			self.show_message_log(f"  Reindex using file {os.path.abspath(self.flist_path)}")
+			self.svindexer.read_file_list(self.flist_path)
+			self.show_message_log(f"  Running indexer")
+			self.svindexer.run_indexer()
+		else :
+			self.show_message_log(f"  Reindex using file {os.path.abspath(self.index_path)}")
+			if SQLIndexManager.is_index_artifact(self.index_path) :
+				self.svindexer.open_artifact(self.index_path)
+			else :
+				self.svindexer.read_index_file(self.index_path)
+
+	def _begin_progress(self, title : str) -> T.Optional[str]:
+		"""
+		Show a progress notification on the client, if supported.
+		:return: The progress token, None if no progress is shown
+		"""
+		window = self.client_capabilities.window if self.client_capabilities is not None else None
+		if window is None or not window.work_done_progress :
+			return None
+		token = str(uuid.uuid4())
+		try :
+			self.progress.create(token).result(2)
+		except Exception :
+			logger.warning("Client did not accept the progress token")
+			return None
+		self.progress.begin(token, WorkDoneProgressBegin(kind="begin", title=title, cancellable=False))
+		return token
+
+	def _end_progress(self, token : T.Optional[str], message : str):
+		if token is not None :
+			self.progress.end(token, WorkDoneProgressEnd(kind="end", message=message))
+
 	@property
 	def have_syntax_error(self):
 		return self.syntaxchecker.nberrors > 0
@@ -87,50 +285,259 @@ class DiplomatLanguageServer(LanguageServer):
 	def syntax_check(self,file : str = None):
 		if file is not None :
 			f = uris.to_fs_path(file)
-			self.syntaxchecker.run_incremental([f])
+			with metrics.timer("syntax_check", "file") :
+				self.syntaxchecker.run_incremental([f])
 		else :
-			self.syntaxchecker.filelist = self.svindexer.filelist
-			self.syntaxchecker.run()
+			self.syntaxchecker.filelist = self.svindexer.resolved_filelist
+			with metrics.timer("syntax_check", "workspace") :
+				self.syntaxchecker.run()
 
-		for file,diaglist in self.syntaxchecker.diagnostic_content.items() :
-			self.publish_diagnostics(file,diaglist)
+		self.publish_diagnostics_changes()
+
+	def rename_symbol(self, symbol : SQLSymbol, new_name : str, index : T.Optional[SQLIndexManager] = None) -> WorkspaceEdit:
+		"""
+		Rename a symbol in the index, and build the matching edits of the sources.
+		:param symbol: Symbol to rename
+		:param new_name: New name of the symbol
+		:param index: Index to rename the symbol in, held through svindexer.private_index.
+			By default, the current one is held during the rename.
+		:return: Edits of all the declaration and references of the symbol
+		"""
+		if index is None :
+			with self.svindexer.private_index() as index :
+				return self.rename_symbol(symbol, new_name, index)
+		anchors, contents = index.rename_symbol(symbol, new_name)
+		# Anchors come sorted by file, so each file is resolved once and its edits are contiguous.
+		# Edits are given in their JSON form : building tens of thousands of TextEdit models takes seconds.
+		edits : T.Dict[str,T.List[T.Dict[str,T.Any]]] = dict()
+		for fid, file_anchors in itertools.groupby(anchors, key=lambda a : a.file) :
+			edits[uris.from_fs_path(index.get_file_path(fid))] = [
+				{"range" : {"start" : {"line" : a.start_line, "character" : a.start_char - 1},
+							"end" : {"line" : a.end_line, "character" : a.end_char - 1}},
+				 "newText" : new_name}
+				for a in file_anchors]
+		# Documents which are not opened never get the matching didChange, their entry is dropped with the lineage.
+		lineage = self.svindexer.lineage
+		self._renamed_contents = {uri : renamed for uri, renamed in self._renamed_contents.items() if renamed[1] == lineage}
+		for fid, content in contents.items() :
+			self._renamed_contents[uris.from_fs_path(index.get_file_path(fid))] = (content, lineage)
+		self.result_cache.invalidate_files(edits.keys())
+		return WorkspaceEdit.construct(changes=edits)
+
+	def shift_document_anchors(self, uri : str, changes : T.List, content : str):
+		"""
+		Keep the index of an edited document in line with its unsaved content, until it is saved and reindexed.
+		:param uri: URI of the document
+		:param changes: Content changes of the document, in the order they were applied
+		:param content: Content of the document once changed
+		"""
+		renamed = self._renamed_contents.pop(uri, None)
+		if renamed is not None and renamed == (content, self.svindexer.lineage) :
+			# Edit of a rename, already applied to the index. If the index was rebuilt from scratch since,
+			# the rename is lost and the edit is applied as any other.
+			return
+		index = self.svindexer.index
+		path = uris.to_fs_path(uri)
+		fid = index.get_file_id(path)
+		if fid is None or index.read_only :
+			# Artifacts are only copied outside of the event loop, by the next reindexing or rename.
+			return
+		if index.is_persistent and self.svindexer.is_building :
+			# The database is locked by the update. As with a snapshot, the edits are taken into account
+			# when the document is saved and reindexed.
+			return
+		edits = list()
+		for change in changes :
+			if getattr(change, "range", None) is None :
+				# The whole content was replaced, the anchors cannot be followed anymore.
+				logger.debug("Full content change of %s, anchors are kept until the next indexing", uri)
+				edits.clear()
+				break
+			edits.append(((change.range.start.line, change.range.start.character),
+						  (change.range.end.line, change.range.end.character), change.text))
+		index.shift_anchors(fid, edits, content)
+		self.result_cache.invalidate_files([uri])
+
+	def check_document_content(self, uri : str, content : str):
+		"""
+		Syntax check of the unsaved content of a document, run by the document check scheduler.
+		:param uri: URI of the document
+		:param content: Content of the document
+		"""
+		path = uris.to_fs_path(uri)
+		with metrics.timer("syntax_check", "document") :
+			checked = self.syntaxchecker.check_content(path, content)
+		if checked :
+			self.publish_diagnostics_changes([uris.from_fs_path(path)])
 
 	def clear_diagnostics(self):
 		self.syntaxchecker.clear()
-		for file,diaglist in self.syntaxchecker.diagnostic_content.items() :
-			self.publish_diagnostics(file,diaglist)
+		self.publish_diagnostics_changes()
 
+	def publish_diagnostics_changes(self, files : T.Optional[T.Iterable[str]] = None):
+		"""
+		Publish the diagnostics of the syntax checker, only for the files whose diagnostics changed
+		since they were last published.
+		:param files: URIs of the files to look at, all of them by default
+		"""
+		content = self.syntaxchecker.diagnostic_content
+		with self._publish_lock :
+			if files is None :
+				files = set(self._published_diagnostics) | set(content)
+			for uri in files :
+				diagnostics = list(content.get(uri, list()))
+				if diagnostics == self._published_diagnostics.get(uri, list()) :
+					continue
+				self.publish_diagnostics(uri, diagnostics)
+				if len(diagnostics) > 0 :
+					self._published_diagnostics[uri] = diagnostics
+				else :
+					del self._published_diagnostics[uri]
 
-	def anchor_to_location(self,anchor : SQLAnchor) -> Location:
-		file_path = self.svindexer.index.get_file_by_id(anchor.file).path
 
+	def anchor_to_location(self,anchor : SQLAnchor, index : T.Optional[SQLIndexManager] = None) -> Location:
+		"""
+		:param anchor: Anchor to convert
+		:param index: Index the anchor comes from, the current one by default
+		"""
+		return self.anchors_to_locations([anchor], index)[0]
+
+	def anchors_to_locations(self, anchors : T.Iterable[SQLAnchor], index : T.Optional[SQLIndexManager] = None) -> T.List[Location]:
+		"""
+		Convert a list of anchors at once, resolving each file only once.
+		:param anchors: Anchors to convert
+		:param index: Index the anchors come from, the current one by default
+		"""
+		index = self.svindexer.index if index is None else index
+		file_uris : T.Dict[int,str] = dict()
+		ret = list()
+		for anchor in anchors :
+			if anchor.file not in file_uris :
+				file_uris[anchor.file] = uris.from_fs_path(index.get_file_path(anchor.file))
+			ret.append(self._anchor_location(anchor, file_uris[anchor.file]))
+		return ret
+
+	@staticmethod
+	def _anchor_location(anchor : SQLAnchor, uri : str) -> Location:
 		begin_line = anchor.start_line
 		begin_char = anchor.start_char
 		end_line = anchor.end_line
 		end_char = anchor.end_char
 
-		return Location( uri=uris.from_fs_path(file_path),
+		return Location( uri=uri,
 						 range=Range(
 			start=Position(line=begin_line, character=begin_char -1),
 			end=Position(line=end_line,character=end_char - 1)))
 
-	def get_symbol_from_location(self, selected_loc : Location) -> SQLSymbol:
-		logger.debug(f"Query symbol for location {selected_loc}")
+	def cached_request(self, kind : str, selected_loc : Location, index : SQLIndexManager,
+					   compute : T.Callable[[],T.Union[None,Location,T.List[Location]]]) -> T.Union[None,Location,T.List[Location]]:
+		"""
+		Answer a position-based request from the result cache, or compute the result and cache it.
+		Results are only valid for the index generation they were computed on.
+		:param kind: Kind of request
+		:param selected_loc: Position of the request
+		:param index: Index the result is computed on
+		:param compute: Function computing the result
+		:return: The result
+		"""
+		if index.generation > self._result_cache_generation :
+			# Results from older generations cannot be hit anymore.
+			self.result_cache.clear()
+			self._result_cache_generation = index.generation
+		key = (kind, selected_loc.uri, selected_loc.range.start.line, selected_loc.range.start.character, index.generation)
+		ret = self.result_cache.get(key)
+		if ret is ResultCache.MISSING :
+			ret = compute()
+			locations = ret if isinstance(ret, list) else [] if ret is None else [ret]
+			self.result_cache.put(key, ret, {selected_loc.uri} | {l.uri for l in locations})
+		return ret
+
+	def get_workspace_symbols(self, query : str, offset : int = 0) -> T.List[SymbolInformation]:
+		"""
+		Search the symbols matching a partial name.
+		:param query: Partial name
+		:param offset: Number of best matches to skip
+		:return: At most workspace_symbol_limit symbols, best matches first
+		"""
+		index = self.svindexer.index
+		symbols = index.search_symbols(query, self.workspace_symbol_limit, offset)
+		locations = self.anchors_to_locations([s.declaration_anchor for s in symbols], index)
+		return [SymbolInformation(name=s.name, kind=self.SYMBOL_KINDS.get(s.type, SymbolKind.Variable), location=l)
+				for s, l in zip(symbols, locations)]
+
+	def get_symbol_from_location(self, selected_loc : Location, index : T.Optional[SQLIndexManager] = None) -> SQLSymbol:
+		"""
+		:param selected_loc: Location to look for
+		:param index: Index to query, the current one by default
+		"""
+		logger.debug("Query symbol for location %s", selected_loc)
+		index = self.svindexer.index if index is None else index
 		#wsdoc = self.workspace.get_document(selected_loc.uri)
-		db_file = self.svindexer.index.get_file_by_path(uris.to_fs_path(selected_loc.uri))
-		if db_file is None :
-			return None
-		anchors_by_pos : T.List[SQLAnchor] = self.svindexer.index.get_anchor_by_position(db_file.id,selected_loc.range.start.line,selected_loc.range.start.character)
-		logger.debug(f"    Anchor found {anchors_by_pos}")
-		if len(anchors_by_pos) == 0 :
+		file_id = index.get_file_id(uris.to_fs_path(selected_loc.uri))
+		if file_id is None :
 			return None
-		selected_anchor = min(anchors_by_pos,key=lambda x : len(x))
+		# LSP characters start at 0, anchor ones at 1.
+		selected_anchor = index.get_anchor_at_position(file_id,selected_loc.range.start.line,selected_loc.range.start.character + 1)
+		logger.debug("    Anchor found %s", selected_anchor)
 		if selected_anchor is not None :
-			symbol = self.svindexer.index.get_definition_by_anchor(selected_anchor)
+			symbol = index.get_definition_by_anchor(selected_anchor)
 			return symbol
 		else:
 			return None
 
+	def get_hierarchy_module(self, selected_loc : Location, index : SQLIndexManager) -> T.Optional[SQLSymbol]:
+		"""
+		:param selected_loc: Location of a module or of one of its instances
+		:param index: Index to query
+		:return: The module, None if there is none at this location
+		"""
+		symbol = self.get_symbol_from_location(selected_loc, index)
+		if symbol is None or symbol.type in index.INSTANTIABLE_TYPES :
+			return symbol
+		return index.get_instance_module(symbol)
+
+	def symbols_to_hierarchy_items(self, symbols : T.List[SQLSymbol], index : SQLIndexManager) -> T.List[CallHierarchyItem]:
+		"""
+		Convert symbols to call hierarchy items, located at their declaration.
+		The items are resolved back from their location, see get_hierarchy_module.
+		"""
+		locations = self.anchors_to_locations([s.declaration_anchor for s in symbols], index)
+		return [CallHierarchyItem(name=s.name, kind=self.SYMBOL_KINDS.get(s.type, SymbolKind.Variable), detail=s.type,
+								  uri=l.uri, range=l.range, selection_range=l.range)
+				for s, l in zip(symbols, locations)]
+
+	def get_incoming_instances(self, item : CallHierarchyItem, index : SQLIndexManager) -> T.List[CallHierarchyIncomingCall]:
+		"""
+		Find the modules instantiating the module of a call hierarchy item.
+		:return: One call per parent module, ranging over the instances it declares
+		"""
+		module = self.get_hierarchy_module(Location(uri=item.uri, range=item.selection_range), index)
+		if module is None :
+			return list()
+		instances : T.Dict[int,T.Tuple[SQLSymbol,T.List[SQLSymbol]]] = dict()
+		for parent, instance in index.get_instantiating_modules(module) :
+			instances.setdefault(parent.id, (parent, list()))[1].append(instance)
+		parents = self.symbols_to_hierarchy_items([p for p, _ in instances.values()], index)
+		return [CallHierarchyIncomingCall(from_=parent, from_ranges=[l.range for l in self.anchors_to_locations(
+					[i.declaration_anchor for i in inst], index)])
+				for parent, (_, inst) in zip(parents, instances.values())]
+
+	def get_outgoing_instances(self, item : CallHierarchyItem, index : SQLIndexManager) -> T.List[CallHierarchyOutgoingCall]:
+		"""
+		Find the modules instantiated by the module of a call hierarchy item.
+		:return: One call per instantiated module, ranging over its instances
+		"""
+		module = self.get_hierarchy_module(Location(uri=item.uri, range=item.selection_range), index)
+		if module is None :
+			return list()
+		instances : T.Dict[int,T.Tuple[SQLSymbol,T.List[SQLSymbol]]] = dict()
+		for instance, child in index.get_module_instances(module) :
+			instances.setdefault(child.id, (child, list()))[1].append(instance)
+		children = self.symbols_to_hierarchy_items([c for c, _ in instances.values()], index)
+		return [CallHierarchyOutgoingCall(to=child, from_ranges=[l.range for l in self.anchors_to_locations(
+					[i.declaration_anchor for i in inst], index)])
+				for child, (_, inst) in zip(children, instances.values())]
+
 	def disable_update_config(self):
 		self.show_message_log("   Removing dynamic configuration capabilities.")
 		params = UnregistrationParams(unregistrations=[
@@ -159,48 +566,25 @@ class DiplomatLanguageServer(LanguageServer):
 		self.show_message_log("Got client configuration.")
 		return config
 
-	def get_completion(self, document, position):
-		ret = list()
-		current_word = document.word_at_position(position)
-		logger.debug(f"  Current word is {current_word}")
-		word_start = Position(line=position.line, character=position.character - len(current_word))
-		if word_start.character > 0:
-			prev_char_offset = document.offset_at_position(word_start) - 1
-			previous_char = document.source[prev_char_offset]
-			logger.debug(f"  Previous char is {previous_char}")
-			if previous_char == ".":
-				# We need the parent and to find children
-				parent_start = Position(line=word_start.line, character=word_start.character - 2)
-				parent_name =document.word_at_position(parent_start)
-				logger.debug(f"  Parent is {parent_name}")
-				parent_symbol_list = self.svindexer.index.get_symbols_by_name( parent_name)
-				logger.debug(f"   Found {parent_symbol_list}")
-				children = list()
-				for parent_symbol in parent_symbol_list :
-					children.extend(self.svindexer.index.get_symbol_childs(parent_symbol))
-				return [x.name for x in children if x.name.startswith(current_word)]
-
-		return ret
-
-	def get_completion(self, document, position):
+	def get_completion(self, document, position) -> T.Tuple[T.List[str],bool]:
+		"""
+		Complete the member names after a dot.
+		:return: Candidate names, and whether the list was cut to completion_limit names
+		"""
+		index = self.svindexer.index
 		ret = list()
 		current_word = document.word_at_position(position)
-		logger.debug(f"  Current word is {current_word}")
+		logger.debug("  Current word is %s", current_word)
 		word_start = Position(line=position.line, character=position.character - len(current_word))
 		if word_start.character > 0:
 			prev_char_offset = document.offset_at_position(word_start) - 1
 			previous_char = document.source[prev_char_offset]
-			logger.debug(f"  Previous char is {previous_char}")
+			logger.debug("  Previous char is %s", previous_char)
 			if previous_char == ".":
 				# We need the parent and to find children
 				parent_start = Position(line=word_start.line, character=word_start.character - 2)
 				parent_name =document.word_at_position(parent_start)
-				logger.debug(f"  Parent is {parent_name}")
-				parent_symbol_list = self.svindexer.index.get_symbols_by_name( parent_name)
-				logger.debug(f"   Found {parent_symbol_list}")
-				children = list()
-				for parent_symbol in parent_symbol_list :
-					children.extend(self.svindexer.index.get_symbol_childs(parent_symbol))
-				return [x.name for x in children if x.name.startswith(current_word)]
+				logger.debug("  Parent is %s", parent_name)
+				return index.get_member_names(parent_name, current_word, self.completion_limit)
 
-		return ret
+		return ret, False
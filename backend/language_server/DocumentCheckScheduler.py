@@ -0,0 +1,94 @@
+import threading
+import time
+import typing as T
+
+import logging
+
+logger = logging.getLogger("myLogger")
+
+
+class DocumentCheckScheduler:
+	"""
+	Check the content of unsaved documents in a background thread, one document at a time.
+
+	Requests are debounced per document : a document is only checked once it was left unchanged
+	for a while, and only its latest content is checked. A check in progress is cancelled when
+	a newer content of the same document arrives.
+	"""
+
+	def __init__(self, run_check : T.Callable[[str,str],None], cancel_check : T.Callable[[str],None],
+				 delay : float = 0.2):
+		"""
+		:param run_check: Function checking a document, given its URI and content
+		:param cancel_check: Function cancelling the check in progress of a document, called from any thread
+		:param delay: Time to wait after the last change of a document before checking it, in seconds
+		"""
+		self._run_check = run_check
+		self._cancel_check = cancel_check
+		self.delay = delay
+
+		self._condition = threading.Condition()
+		# URI -> (time at which the check may start, content to check)
+		self._pending : T.Dict[str,T.Tuple[float,str]] = dict()
+		self._running : T.Optional[str] = None
+		self._thread : T.Optional[threading.Thread] = None
+
+	def request(self, uri : str, content : str, delay : T.Optional[float] = None):
+		"""
+		Ask for a document to be checked, replacing any pending request for it.
+		:param uri: URI of the document
+		:param content: Current content of the document
+		:param delay: Debounce delay to use instead of the default one
+		"""
+		delay = self.delay if delay is None else delay
+		with self._condition :
+			self._pending[uri] = (time.monotonic() + delay, content)
+			if self._running == uri :
+				self._cancel_check(uri)
+			if self._thread is None or not self._thread.is_alive() :
+				self._thread = threading.Thread(target=self._worker, name="document-check-scheduler", daemon=True)
+				self._thread.start()
+			self._condition.notify_all()
+
+	def discard(self, uri : str):
+		"""
+		Drop the pending and running checks of a document.
+		"""
+		with self._condition :
+			self._pending.pop(uri, None)
+			if self._running == uri :
+				self._cancel_check(uri)
+
+	def wait(self, timeout : T.Optional[float] = None) -> bool:
+		"""
+		Wait for all the pending and running checks to be done.
+		:param timeout: Maximum time to wait, in seconds
+		:return: False if the timeout expired
+		"""
+		with self._condition :
+			return self._condition.wait_for(lambda : len(self._pending) == 0 and self._running is None, timeout)
+
+	def _next_ready(self) -> T.Optional[str]:
+		now = time.monotonic()
+		ready = [(deadline, uri) for uri, (deadline, _) in self._pending.items() if deadline <= now]
+		return min(ready)[1] if len(ready) > 0 else None
+
+	def _worker(self):
+		while True :
+			with self._condition :
+				uri = self._next_ready()
+				while uri is None :
+					deadline = min((d for d, _ in self._pending.values()), default=None)
+					self._condition.wait(None if deadline is None else deadline - time.monotonic())
+					uri = self._next_ready()
+				_, content = self._pending.pop(uri)
+				self._running = uri
+
+			try :
+				self._run_check(uri, content)
+			except Exception :
+				logger.exception(f"Check of {uri} failed")
+			finally :
+				with self._condition :
+					self._running = None
+					self._condition.notify_all()
@@ -0,0 +1,111 @@
+import threading
+import time
+import typing as T
+
+import logging
+
+from frontend import IndexingCancelled
+
+logger = logging.getLogger("myLogger")
+
+
+class IndexingScheduler:
+	"""
+	Run the indexing jobs one at a time, in a background thread.
+
+	Requests are debounced : a job only starts once no new request came for a while,
+	and all the requests received meanwhile are coalesced into a single job.
+	A request arriving while a job runs cancels it, and the files of the cancelled job
+	are indexed along with the new ones.
+	"""
+
+	def __init__(self, run_job : T.Callable[[T.Optional[T.List[str]]],None], cancel_job : T.Callable[[],None],
+				 reset_job : T.Callable[[],None], delay : float = 0.3):
+		"""
+		:param run_job: Function running a job, given the files to reindex or None for a full reindex.
+			Shall raise IndexingCancelled when cancelled.
+		:param cancel_job: Function cancelling the job in progress, called from any thread
+		:param reset_job: Function forgetting the cancellations of the previous jobs, called from any thread.
+			It is called as a job is dequeued, so that a cancellation landing before the job starts is kept.
+		:param delay: Time to wait after the last request before starting a job, in seconds
+		"""
+		self._run_job = run_job
+		self._cancel_job = cancel_job
+		self._reset_job = reset_job
+		self.delay = delay
+
+		self._condition = threading.Condition()
+		self._full = False
+		self._files : T.Set[str] = set()
+		# Time at which the pending job may start, None if nothing is pending.
+		self._deadline : T.Optional[float] = None
+		self._running = False
+		self._thread : T.Optional[threading.Thread] = None
+
+	@property
+	def is_busy(self) -> bool:
+		with self._condition :
+			return self._deadline is not None or self._running
+
+	def request(self, files : T.Optional[T.Iterable[str]] = None, delay : T.Optional[float] = None):
+		"""
+		Ask for the given files to be reindexed.
+		:param files: Files to reindex, None for a full reindex
+		:param delay: Debounce delay to use instead of the default one
+		"""
+		delay = self.delay if delay is None else delay
+		with self._condition :
+			self._merge(files)
+			self._deadline = time.monotonic() + delay
+			if self._running :
+				logger.info("New indexing request, cancel the job in progress")
+				self._cancel_job()
+			if self._thread is None or not self._thread.is_alive() :
+				self._thread = threading.Thread(target=self._worker, name="indexing-scheduler", daemon=True)
+				self._thread.start()
+			self._condition.notify_all()
+
+	def wait(self, timeout : T.Optional[float] = None) -> bool:
+		"""
+		Wait for all the pending and running jobs to be done.
+		:param timeout: Maximum time to wait, in seconds
+		:return: False if the timeout expired
+		"""
+		with self._condition :
+			return self._condition.wait_for(lambda : self._deadline is None and not self._running, timeout)
+
+	def _merge(self, files : T.Optional[T.Iterable[str]]):
+		if files is None :
+			self._full = True
+			self._files.clear()
+		elif not self._full :
+			self._files.update(files)
+
+	def _worker(self):
+		while True :
+			with self._condition :
+				while self._deadline is None or time.monotonic() < self._deadline :
+					self._condition.wait(None if self._deadline is None else self._deadline - time.monotonic())
+				files = None if self._full else sorted(self._files)
+				self._full = False
+				self._files.clear()
+				self._deadline = None
+				self._running = True
+				# Under the same lock as the cancellations, which from now on are for this job.
+				self._reset_job()
+
+			try :
+				logger.info(f"Start indexing job ({'full' if files is None else f'{len(files)} files'})")
+				self._run_job(files)
+			except IndexingCancelled :
+				logger.info("Indexing job cancelled")
+				with self._condition :
+					self._merge(files)
+					if self._deadline is None :
+						self._deadline = time.monotonic()
+			except Exception :
+				logger.exception("Indexing job failed")
+			finally :
+				with self._condition :
+					self._running = False
+					self._condition.notify_all()
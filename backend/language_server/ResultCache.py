@@ -0,0 +1,92 @@
+import threading
+import typing as T
+from collections import OrderedDict
+
+import logging
+
+logger = logging.getLogger("myLogger")
+
+
+class ResultCache:
+	"""
+	Bounded LRU cache of request results.
+
+	Each entry records the files it depends on, so that the entries made stale by an in-place
+	change of the index (such as a rename) can be dropped without clearing the whole cache.
+	Changes of index generation are handled by the callers, by putting the generation in the key.
+	"""
+	MISSING = object()
+
+	def __init__(self, maxsize : int = 4096):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries : T.OrderedDict[T.Hashable,T.Tuple[T.Any,T.FrozenSet[str]]] = OrderedDict()
+		self._by_file : T.Dict[str,T.Set[T.Hashable]] = dict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._entries)
+
+	def get(self, key : T.Hashable) -> T.Any:
+		"""
+		:param key: Key of the entry
+		:return: The cached value, ResultCache.MISSING if there is none
+		"""
+		with self._lock :
+			entry = self._entries.get(key)
+			if entry is None :
+				self.misses += 1
+				return self.MISSING
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry[0]
+
+	def put(self, key : T.Hashable, value : T.Any, files : T.Iterable[str]):
+		"""
+		:param key: Key of the entry
+		:param value: Value to cache, may be None
+		:param files: Files the value depends on
+		"""
+		if self.maxsize <= 0 :
+			return
+		files = frozenset(files)
+		with self._lock :
+			self._remove(key)
+			self._entries[key] = (value, files)
+			for f in files :
+				self._by_file.setdefault(f,set()).add(key)
+			while len(self._entries) > self.maxsize :
+				self._remove(next(iter(self._entries)))
+				self.evictions += 1
+
+	def invalidate_files(self, files : T.Iterable[str]):
+		"""
+		Drop the entries depending on any of the given files.
+		"""
+		with self._lock :
+			for f in files :
+				for key in list(self._by_file.get(f,())) :
+					self._remove(key)
+
+	def clear(self):
+		with self._lock :
+			self._entries.clear()
+			self._by_file.clear()
+
+	def _remove(self, key : T.Hashable):
+		entry = self._entries.pop(key,None)
+		if entry is None :
+			return
+		for f in entry[1] :
+			keys = self._by_file.get(f)
+			keys.discard(key)
+			if len(keys) == 0 :
+				del self._by_file[f]
+
+	@property
+	def stats(self) -> T.Dict[str,int]:
+		with self._lock :
+			return {"size" : len(self._entries), "maxsize" : self.maxsize,
+					"hits" : self.hits, "misses" : self.misses, "evictions" : self.evictions}
@@ -0,0 +1,193 @@
+import typing as T
+import os
+import re
+
+from .SQLDataTypes import JSONRecord, SQLAnchor, SQLAnchorIntervals, SQLFile
+
+import logging
+
+if T.TYPE_CHECKING :
+	from .SQLIndexManager import SQLIndexManager
+
+logger = logging.getLogger("myLogger")
+
+
+class SQLBulkLoader:
+	"""
+	Buffer the Kythe nodes and edges of a whole index in memory, then write them at once.
+	Rows are inserted with executemany in a single transaction and the edges are resolved
+	by a set-based SQL pass over staging tables instead of one lookup per edge.
+
+	Nodes are identified by their Kythe signature and path, so the same node read twice
+	(for instance a header shared by several extractor runs) is only stored once.
+	"""
+	INCLUDE_PATTERN = re.compile(r'`include\s+"([^"]+)"')
+
+	def __init__(self, manager : "SQLIndexManager", mtimes : T.Optional[T.Dict[str,float]] = None):
+		"""
+		:param manager: Index to load into
+		:param mtimes: Modification time of the files, read before their content. Files missing from it get no time.
+			None to read the time of each file as it is loaded.
+		"""
+		self.manager = manager
+		self.db = manager.db
+		self._mtimes = mtimes
+
+		self._files : T.List[T.Tuple[int,str,str,str,T.Optional[float]]] = list()
+		self._includes : T.List[T.Tuple[int,str]] = list()
+		self._anchors : T.List[T.List] = list()
+		self._anchors_text : T.List[T.Tuple[int,str]] = list()
+		self._symbols : T.List[T.Tuple[int,str,str,str,str]] = list()
+		# Ordered and deduplicated, as shared files are seen once per extractor run.
+		self._edges : T.Dict[T.Tuple[str,str,str,str,str],None] = dict()
+		# (signature, path) -> (id, is anchor, already in the index)
+		self._nodes : T.Dict[T.Tuple[str,str],T.Tuple[int,bool,bool]] = dict()
+
+		# Building the secondary indexes once at the end is much faster than updating them on each row.
+		# Not worth it for small loads on top of an existing index.
+		self._rebuild_indexes = manager.is_empty
+		# When loading on top of an existing index, files already indexed are left untouched.
+		self._partial = not self._rebuild_indexes
+		self._loaded_paths : T.Set[str] = set()
+
+		self._next_file_id = self._next_id("files")
+		self._next_anchor_id = self._next_id("anchors")
+		self._next_symbol_id = self._next_id("symbols")
+
+	def _next_id(self, table : str) -> int:
+		return self.db.execute(f"SELECT coalesce(max(id),0) + 1 FROM {table}").fetchone()[0]
+
+	def add_node(self, node : JSONRecord):
+		"""
+		Stage a Kythe record.
+		:param node: Fully read JSON record
+		"""
+		source = node.source
+		if source.signature == "" and source.path == "":
+			return
+
+		if node.is_file :
+			if source.path in self.manager._file_id_mapping :
+				return
+			fid = self._next_file_id
+			self._next_file_id += 1
+			content = node.file_content
+			if self._mtimes is not None :
+				# The file may have been saved since its content was read, in which case it is seen as outdated.
+				mtime = self._mtimes.get(source.path)
+			else :
+				mtime = os.path.getmtime(source.path) if os.path.exists(source.path) else None
+			self._files.append((fid,source.path,content,SQLFile.hash_content(content.encode("utf-8")),mtime))
+			self._loaded_paths.add(source.path)
+			self._includes.extend((fid,os.path.basename(m.group(1))) for m in self.INCLUDE_PATTERN.finditer(content))
+			self.manager._file_id_mapping[source.path] = fid
+			self.manager._ingested_files[fid] = SQLFile(fid,source.path,content)
+			return
+
+		key = (source.signature,source.path)
+		if node.is_anchor :
+			if key in self._nodes :
+				return
+			if source.path in self.manager._file_id_mapping and source.path not in self._loaded_paths :
+				return
+			if source.path not in self.manager._file_id_mapping :
+				logger.warning(f"Anchor {source.signature} refers to unknown file {source.path}, ignored.")
+				return
+			file = self.manager._ingested_files[self.manager._file_id_mapping[source.path]]
+			anchor = SQLAnchor.from_json_record(node,file)
+			anchor.id = self._next_anchor_id
+			self._next_anchor_id += 1
+			self._anchors.append(anchor.db_record)
+			self._anchors_text.append((anchor.id,file.content[node.anchor_start:node.anchor_end]))
+			self._nodes[key] = (anchor.id,True,False)
+			return
+
+		if node.is_symbol :
+			if key in self._nodes :
+				return
+			if self._partial :
+				r = self.db.execute("SELECT id FROM symbols WHERE signature_path == ? AND signature == ?",
+									[source.path, source.signature]).fetchone()
+				if r is not None :
+					# Symbols of the files being loaded are bound again, the others are left as they are.
+					self._nodes[key] = (r[0],False,source.path not in self._loaded_paths)
+					return
+			sid = self._next_symbol_id
+			self._next_symbol_id += 1
+			# As in row-by-row loading, the name is the signature until the symbol binding is resolved.
+			self._symbols.append((sid,source.signature,node.symbol_type,source.signature,source.path))
+			self._nodes[key] = (sid,False,False)
+			return
+
+		if node.is_edge :
+			if node.edge_kind in ["/defines/binding", "/ref", "/childof"]:
+				self._edges.setdefault((node.edge_kind,
+										source.signature, source.path,
+										node.target.signature, node.target.path))
+
+	def commit(self):
+		"""
+		Write all staged data and resolve the edges, within a single transaction.
+		"""
+		logger.info(f"Bulk load of {len(self._files)} files, {len(self._anchors)} anchors, "
+					f"{len(self._symbols)} symbols and {len(self._edges)} edges")
+		loaded_paths = list(self._loaded_paths)
+		self.manager._run_sql_script(f"{self.manager.SQL_ROOT_PATH}/create_staging_db.sql")
+		if self._rebuild_indexes :
+			self.manager.drop_query_indexes()
+		try :
+			with self.db :
+				self.db.executemany("INSERT INTO files(id,path,content,hash,mtime) VALUES (?,?,?,?,?)",self._files)
+				self.db.executemany("INSERT INTO includes(file,name) VALUES (?,?)",self._includes)
+				self.db.executemany("INSERT INTO anchors VALUES (?,?,?,?,?,?)",self._anchors)
+				self.db.executemany("INSERT INTO symbols(id,name,type,declaration_anchor,signature,signature_path) "
+									"VALUES (?,?,?,NULL,?,?)",self._symbols)
+				self.db.executemany("INSERT INTO staging_anchors(id,text) VALUES (?,?)",self._anchors_text)
+				self.db.executemany("INSERT INTO staging_nodes(signature,path,id,is_anchor,existing) VALUES (?,?,?,?,?)",
+									[(sig,path,*node) for (sig,path),node in self._nodes.items()])
+				self.db.executemany("INSERT INTO staging_edges(kind,source_signature,source_path,target_signature,target_path) "
+									"VALUES (?,?,?,?,?)",self._edges.keys())
+				if self._partial :
+					for statement in self.manager._iter_sql_script(f"{self.manager.SQL_ROOT_PATH}/seed_staging_db.sql"):
+						self.db.execute(statement)
+				for statement in self.manager._iter_sql_script(f"{self.manager.SQL_ROOT_PATH}/resolve_staging_db.sql"):
+					self.db.execute(statement)
+			self._build_anchor_intervals()
+		finally :
+			self.manager._run_sql_script(f"{self.manager.SQL_ROOT_PATH}/delete_staging_db.sql")
+			if self._rebuild_indexes :
+				self.manager.create_query_indexes()
+			# The content of the files was only kept in memory for the loading, the database has it.
+			self.manager._release_ingested_files(fid for fid, *_ in self._files)
+			self.clear()
+		# Done once the query indexes are back, as it relies on them.
+		self.manager.resolve_instances(loaded_paths)
+
+	def _build_anchor_intervals(self):
+		"""
+		Build the position lookup structures of the loaded files from the staged anchors.
+		"""
+		per_file : T.Dict[int,T.List[T.Tuple[int,int,int,int,int]]] = {fid : list() for fid, *_ in self._files}
+		for aid, fid, start_line, start_char, end_line, end_char in self._anchors :
+			per_file[fid].append((aid,start_line,start_char,end_line,end_char))
+		for fid, anchors in per_file.items() :
+			self.manager._anchor_intervals[fid] = SQLAnchorIntervals(fid,anchors)
+
+	def discard(self):
+		"""
+		Drop the staged data without writing anything.
+		"""
+		for fid, path, *_ in self._files :
+			self.manager._file_id_mapping.pop(path,None)
+			self.manager._ingested_files.pop(fid,None)
+		self.clear()
+
+	def clear(self):
+		self._files.clear()
+		self._includes.clear()
+		self._anchors.clear()
+		self._anchors_text.clear()
+		self._symbols.clear()
+		self._edges.clear()
+		self._nodes.clear()
+		self._loaded_paths.clear()
@@ -1,5 +1,9 @@
 import typing as T
 import base64
+import hashlib
+import re
+from array import array
+from bisect import bisect_left, bisect_right
 
 import logging
 logger = logging.getLogger("myLogger")
@@ -103,11 +107,43 @@ class JSONRecord:
 
 
 class SQLFile:
+	# Line breaks of LSP, which all the line numbers of the index follow.
+	LINE_BREAK_PATTERN = re.compile(r"\r\n|\r|\n")
+
 	def __init__(self, id : T.Optional[int] = None, path : T.Optional[str]= None, content : T.Optional[str] = None):
 		self.id = id
 		self.path = path
+		self._line_starts : T.Optional[array] = None
 		self.content = content
 
+	@property
+	def content(self) -> T.Optional[str]:
+		return self._content
+
+	@content.setter
+	def content(self, value : T.Optional[str]):
+		self._content = value
+		self._line_starts = None
+
+	@property
+	def line_starts(self) -> array:
+		"""
+		Offset of the first character of each line, built on first use and kept
+		until the content changes.
+		"""
+		if self._line_starts is None :
+			starts = array("q", [0])
+			if self._content and "\r" in self._content :
+				starts.extend(m.end() for m in self.LINE_BREAK_PATTERN.finditer(self._content))
+			elif self._content :
+				find = self._content.find
+				nl = find("\n")
+				while nl != -1 :
+					starts.append(nl + 1)
+					nl = find("\n", nl + 1)
+			self._line_starts = starts
+		return self._line_starts
+
 	def position_from_offset(self,offset : int) -> T.Tuple[int,int]:
 		"""
 		First line is 0
@@ -115,27 +151,31 @@ class SQLFile:
 		:param offset:
 		:return:
 		"""
-		line = max(0,self.content[:offset].count("\n"))
-		char = offset - self.content[:offset].rfind("\n")
+		line = max(0, bisect_right(self.line_starts, offset) - 1)
+		char = offset - self.line_starts[line] + 1
 		return (line,char)
 
 	def offset_from_position(self,line : int, char : int):
-		# Lets assume first line = 0
-
-		position = 0
-		line_start = self.content.find("\n")
-		if line == 0 :
-			line_start = 0
-		else :
-			for i in range(line-1) :
-				line_start = self.content.find("\n",line_start +1)
-				if line_start == -1 :
-					logger.warning(f"offset_from_position : offset not found for position {line}:{char} in file {self.path}")
-					return -1
-		position = line_start + char - (1 if line_start == 1 else 0)
+		"""
+		Reverse operation of position_from_offset.
+		First line is 0
+		First char is 1
+		:param line:
+		:param char:
+		:return: The offset or -1 if the line does not exist.
+		"""
+		if line < 0 or line >= len(self.line_starts) :
+			logger.warning(f"offset_from_position : offset not found for position {line}:{char} in file {self.path}")
+			return -1
+		return self.line_starts[line] + char - 1
 
-		logger.debug(f"Query offset for {line}:{char} got {position} on file {self.path}")
-		return position
+	@staticmethod
+	def hash_content(data : bytes) -> str:
+		"""
+		Hash used to tell if an indexed file changed on disk.
+		:param data: Raw file content
+		"""
+		return hashlib.sha1(data).hexdigest()
 
 
 class SQLAnchor:
@@ -163,6 +203,8 @@ class SQLAnchor:
 		"""
 		Generate an anchor object given a JSON record and the proper resolved file.
 		The ID field won't be set.
+		Positions are resolved through the line table of the file, so the same SQLFile object
+		should be reused for all anchors of a given file.
 		:param record: JSON record object
 		:param resolved_file: SQL File descriptor attached to the new anchor
 		:return:
@@ -186,6 +228,138 @@ class SQLAnchor:
 				   (row["start_line"],row["start_char"]),
 				  (row["stop_line"],row["stop_char"]))
 
+class SQLAnchorIntervals:
+	"""
+	Spans of all the anchors of a file, sorted by start position, to find the anchor at a position
+	with a binary search instead of a query.
+	Anchors are expected to be either nested or disjoint, which is the case of the extractor output.
+	The structure follows the changes made to the anchors of the file. When it is shared between
+	index snapshots, it is copied before being modified.
+	"""
+	def __init__(self, file : int, anchors : T.Iterable[T.Tuple[int,int,int,int,int]]):
+		"""
+		:param file: ID of the file
+		:param anchors: (id, start line, start char, end line, end char) of each anchor of the file
+		"""
+		self.file = file
+		# Set once the structure is used by several indexes.
+		self.shared = False
+		self._set_spans([(self._encode(sl,sc), -self._encode(el,ec), aid) for aid, sl, sc, el, ec in anchors])
+
+	@staticmethod
+	def _encode(line : int, char : int) -> int:
+		return (line << 32) | char
+
+	@staticmethod
+	def _decode(position : int) -> T.Tuple[int,int]:
+		return (position >> 32, position & 0xFFFFFFFF)
+
+	def __len__(self):
+		return len(self._ids)
+
+	def _set_spans(self, spans : T.List[T.Tuple[int,int,int]]):
+		"""
+		:param spans: (start, -end, id) of each anchor, with encoded positions
+		"""
+		# Outer anchors first when several start at the same position.
+		spans.sort()
+		self._starts = array("q", (s[0] for s in spans))
+		self._ends = array("q", (-s[1] for s in spans))
+		self._ids = array("q", (s[2] for s in spans))
+		self._link()
+
+	def _link(self):
+		# Index of the innermost anchor enclosing each anchor, -1 if none.
+		self._parents = array("q", bytes(8 * len(self._ids)))
+		stack : T.List[int] = list()
+		for i in range(len(self._ids)) :
+			while len(stack) > 0 and self._ends[stack[-1]] < self._ends[i] :
+				stack.pop()
+			self._parents[i] = stack[-1] if len(stack) > 0 else -1
+			stack.append(i)
+
+	def copy(self) -> "SQLAnchorIntervals":
+		ret = SQLAnchorIntervals(self.file, [])
+		ret._starts = array("q", self._starts)
+		ret._ends = array("q", self._ends)
+		ret._ids = array("q", self._ids)
+		ret._parents = array("q", self._parents)
+		return ret
+
+	def add(self, aid : int, start : T.Tuple[int,int], end : T.Tuple[int,int]):
+		"""
+		Insert an anchor at its place, without sorting the others again.
+		:param aid: ID of the anchor
+		:param start: (line, char) of the start of the anchor
+		:param end: (line, char) of the end of the anchor
+		"""
+		span = (self._encode(*start), -self._encode(*end), aid)
+		i = bisect_left(self._starts, span[0])
+		while i < len(self._ids) and (self._starts[i], -self._ends[i], self._ids[i]) < span :
+			i += 1
+		self._starts.insert(i, span[0])
+		self._ends.insert(i, -span[1])
+		self._ids.insert(i, aid)
+		self._link()
+
+	def move(self, positions : T.Dict[int,T.Tuple[T.Tuple[int,int],T.Tuple[int,int]]]):
+		"""
+		Change the positions of some anchors.
+		:param positions: New (start, end) positions, each a (line, char) pair, by anchor ID
+		"""
+		spans = list()
+		for start, end, aid in zip(self._starts, self._ends, self._ids) :
+			if aid in positions :
+				start, end = (self._encode(*p) for p in positions[aid])
+			spans.append((start, -end, aid))
+		self._set_spans(spans)
+
+	def shift(self, start : T.Tuple[int,int], end : T.Tuple[int,int], new_end : T.Tuple[int,int]):
+		"""
+		Move the anchors to follow an edit, as SQLIndexManager.shift_anchors does in the database.
+		:param start: (line, char) of the start of the edited text, both 0-based
+		:param end: (line, char) of the end of the edited text, both 0-based
+		:param new_end: (line, char) of the end of the text replacing it, both 0-based
+		"""
+		# Anchor characters start at 1.
+		edit_start = self._encode(start[0], start[1] + 1)
+		edit_end = self._encode(end[0], end[1] + 1)
+		end_line, end_char = end
+		new_end_line, new_end_char = new_end
+
+		def shifted(position : int) -> int:
+			line, char = self._decode(position)
+			if line == end_line :
+				return self._encode(new_end_line, char + new_end_char - end_char)
+			return self._encode(line + new_end_line - end_line, char)
+
+		spans = list()
+		for s, e, aid in zip(self._starts, self._ends, self._ids) :
+			if e > edit_start :
+				if s >= edit_end :
+					s = shifted(s)
+				elif s >= edit_start :
+					s = edit_start
+				e = self._encode(new_end_line, new_end_char + 1) if e < edit_end else shifted(e)
+			spans.append((s, -e, aid))
+		self._set_spans(spans)
+
+	def find(self, line : int, char : int) -> T.Optional[SQLAnchor]:
+		"""
+		Get the innermost anchor covering a position. The end of an anchor is considered within it.
+		First line is 0
+		First char is 1
+		:return: The anchor, None if there is no anchor at this position
+		"""
+		position = self._encode(line,char)
+		# Last anchor starting before the position. If it ends too soon, the covering anchor is one of its parents.
+		i = bisect_right(self._starts, position) - 1
+		while i >= 0 and self._ends[i] < position :
+			i = self._parents[i]
+		if i < 0 :
+			return None
+		return SQLAnchor(self._ids[i], self.file, self._decode(self._starts[i]), self._decode(self._ends[i]))
+
 class SQLSymbol :
 	def __init__(self, id : int = None , name : str = None, type : str = None , declaration_anchor : SQLAnchor = None):
 		self.id = id
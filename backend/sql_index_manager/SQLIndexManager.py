@@ -1,10 +1,18 @@
 
 import sqlite3
 import os
+import pathlib
+import threading
+import re
+import itertools
+from bisect import bisect_right
+from contextlib import contextmanager
 
 import typing as T
 from . import SQLAnchor, SQLSymbol, SQLFile
-from .SQLDataTypes import JSONRecord
+from .SQLDataTypes import JSONRecord, SQLAnchorIntervals
+from .SQLBulkLoader import SQLBulkLoader
+from backend.instrumentation import metrics
 import gc
 import json
 
@@ -13,21 +21,251 @@ import logging
 logger = logging.getLogger("myLogger")
 
 
+def split_sql_script(lines : T.Iterable[str]) -> T.Iterator[str]:
+	"""
+	Split a SQL script in single statements, to run them within an already opened transaction.
+	executescript always commits first, which is not suitable in this case.
+	:param lines: Lines of the script
+	:return: Iterator over the statements
+	"""
+	statement = ""
+	for line in lines :
+		if statement == "" and (line.strip() == "" or line.strip().startswith("--")) :
+			continue
+		statement += line
+		if sqlite3.complete_statement(statement):
+			yield statement
+			statement = ""
+	if statement.strip() != "" :
+		yield statement
+
+
+class IndexConnection(sqlite3.Connection):
+	"""
+	Connection able to group the changes of several blocks in a single transaction, see SQLIndexManager.transaction.
+	While grouped, leaving a `with` block commits nothing and scripts are run within the transaction.
+	"""
+	grouped = False
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if self.grouped :
+			return False
+		return super().__exit__(exc_type, exc_value, traceback)
+
+	def executescript(self, script):
+		if not self.grouped :
+			return super().executescript(script)
+		for statement in split_sql_script(script.splitlines(keepends=True)) :
+			self.execute(statement)
+
 
 class SQLIndexManager:
 	SQL_ROOT_PATH = os.path.join(os.path.dirname(__file__), "sql")
 	"""
 	This class provide a high level index manager using SQLite DB
 	"""
-	def __init__(self):
-		self.db = sqlite3.connect(":memory:",check_same_thread=False)
+
+	# Scripts applied in order on top of create_index_db.sql.
+	# The schema version is the number of migrations applied, so only append to this list.
+	MIGRATIONS : T.List[str] = [
+		"migrations/001_query_indexes.sql",
+		"migrations/002_file_metadata.sql",
+		"migrations/003_includes.sql",
+		"migrations/004_symbol_search.sql",
+		"migrations/005_instances.sql",
+	]
+
+	QUERY_SYMBOLS_BY_NAME = "SELECT * FROM fully_qualified_symbols WHERE name == ?"
+	QUERY_SYMBOL_CHILDS = ("SELECT * FROM fully_qualified_symbols WHERE sid IN "
+						   " ( SELECT child FROM relationships WHERE parent == ? )")
+	QUERY_SYMBOL_REFERENCES = ("SELECT anchors.*, refs.id as rid, anchor FROM refs "
+							   "INNER JOIN anchors ON anchors.id == refs.anchor WHERE refs.symbol == ?")
+	QUERY_ANCHOR_BY_POSITION = ("SELECT * FROM anchors "
+								"WHERE "
+								"	file == ? "
+								"	AND start_line <= ? "
+								"	AND stop_line >= ? "
+								"  AND start_char <= ? "
+								"  AND stop_char >= ? ")
+	# Move the anchors of a file following a replaced range. Positions are compared as LSP ones, whose
+	# characters are 0-based, with ?2 ?3 the start of the range, ?4 ?5 its end, and ?6 ?7 the end of the new text.
+	# Anchors starting in the range are clamped to its start, the ones ending in it to the end of the new text.
+	QUERY_SHIFT_ANCHORS = ("UPDATE anchors SET (start_line, start_char, stop_line, stop_char) = ( "
+						   "	CASE WHEN (start_line, start_char - 1) < (?2, ?3) THEN start_line "
+						   "		WHEN (start_line, start_char - 1) < (?4, ?5) THEN ?2 "
+						   "		WHEN start_line == ?4 THEN ?6 "
+						   "		ELSE start_line + ?6 - ?4 END, "
+						   "	CASE WHEN (start_line, start_char - 1) < (?2, ?3) THEN start_char "
+						   "		WHEN (start_line, start_char - 1) < (?4, ?5) THEN ?3 + 1 "
+						   "		WHEN start_line == ?4 THEN start_char + ?7 - ?5 "
+						   "		ELSE start_char END, "
+						   "	CASE WHEN (stop_line, stop_char - 1) < (?4, ?5) THEN ?6 "
+						   "		WHEN stop_line == ?4 THEN ?6 "
+						   "		ELSE stop_line + ?6 - ?4 END, "
+						   "	CASE WHEN (stop_line, stop_char - 1) < (?4, ?5) THEN ?7 + 1 "
+						   "		WHEN stop_line == ?4 THEN stop_char + ?7 - ?5 "
+						   "		ELSE stop_char END) "
+						   "WHERE file == ?1 AND (stop_line, stop_char - 1) > (?2, ?3)")
+	# Anchors of a symbol, its declaration included, grouped by file and line.
+	QUERY_SYMBOL_ANCHORS = ("SELECT id, file, start_line, start_char, stop_line, stop_char FROM anchors "
+							"WHERE id == (SELECT declaration_anchor FROM symbols WHERE id == ?1) "
+							"UNION SELECT anchors.id, file, start_line, start_char, stop_line, stop_char FROM refs "
+							"	INNER JOIN anchors ON anchors.id == refs.anchor WHERE refs.symbol == ?1 "
+							"ORDER BY file, start_line, start_char")
+	QUERY_LINES_ANCHORS = ("SELECT id, start_line, start_char, stop_line, stop_char FROM anchors "
+						   "WHERE file == ? AND start_line IN (SELECT value FROM json_each(?))")
+	QUERY_SYMBOL_BY_DECLARATION = "SELECT * FROM fully_qualified_symbols WHERE aid == ?"
+	QUERY_SYMBOL_BY_REFERENCE = ("SELECT * FROM fully_qualified_symbols "
+								 "	INNER JOIN refs ON refs.symbol == sid "
+								 "WHERE anchor == ?")
+	QUERY_MEMBER_NAMES = ("SELECT DISTINCT child.name FROM symbols AS parent "
+						  "	INNER JOIN relationships ON relationships.parent == parent.id "
+						  "	INNER JOIN symbols AS child ON child.id == relationships.child "
+						  "WHERE parent.name == ? AND child.name >= ? AND child.name < ? "
+						  "	AND parent.declaration_anchor IS NOT NULL AND child.declaration_anchor IS NOT NULL "
+						  "ORDER BY child.name LIMIT ?")
+	# Symbol search, from the best matches to the worst ones.
+	QUERY_SYMBOL_SEARCH_PREFIX = ("SELECT id FROM symbols "
+								  "WHERE name >= ? AND name < ? AND declaration_anchor IS NOT NULL "
+								  "ORDER BY name, id LIMIT ?")
+	QUERY_SYMBOL_SEARCH_SUBSTRING = "SELECT rowid FROM symbols_search WHERE symbols_search MATCH ? ORDER BY rowid LIMIT ?"
+	QUERY_SYMBOL_SEARCH_SUBSEQUENCE = ("SELECT id FROM symbols "
+									   "WHERE name LIKE ? ESCAPE '\\' AND declaration_anchor IS NOT NULL "
+									   "ORDER BY id LIMIT ?")
+	# Declarations and references to modules of a file, in order, to find the instances.
+	QUERY_INSTANCE_CANDIDATES = ("SELECT declared.id AS declared, declared.type AS declared_type, module.id AS module FROM anchors "
+								 "	LEFT JOIN symbols AS declared ON declared.declaration_anchor == anchors.id "
+								 "	LEFT JOIN refs ON refs.anchor == anchors.id "
+								 "	LEFT JOIN symbols AS module ON module.id == refs.symbol AND module.type IN ('module', 'interface') "
+								 "WHERE anchors.file == ? AND (declared.id IS NOT NULL OR module.id IS NOT NULL) "
+								 "ORDER BY anchors.start_line, anchors.start_char, anchors.id")
+	QUERY_INSTANCE_MODULE = ("SELECT fully_qualified_symbols.* FROM instances "
+							 "	INNER JOIN fully_qualified_symbols ON sid == instances.module "
+							 "WHERE instances.instance == ?")
+	QUERY_MODULE_INSTANCES = ("SELECT instances.instance, instances.module FROM relationships "
+							  "	INNER JOIN instances ON instances.instance == relationships.child "
+							  "WHERE relationships.parent == ?")
+	QUERY_INSTANTIATING_MODULES = ("SELECT relationships.parent, instances.instance FROM instances "
+								   "	INNER JOIN relationships ON relationships.child == instances.instance "
+								   "WHERE instances.module == ?")
+	# Whole hierarchy walks, each in a single recursive query.
+	QUERY_SYMBOL_ANCESTORS = ("WITH RECURSIVE ancestors(id, depth) AS ( "
+							  "	SELECT ?, 0 "
+							  "	UNION "
+							  "	SELECT relationships.parent, depth + 1 FROM ancestors "
+							  "		INNER JOIN relationships ON relationships.child == ancestors.id "
+							  "	WHERE depth < ? "
+							  ") "
+							  "SELECT fully_qualified_symbols.*, min(depth) AS depth FROM ancestors "
+							  "	INNER JOIN fully_qualified_symbols ON sid == ancestors.id "
+							  "WHERE depth > 0 GROUP BY sid ORDER BY depth")
+	# Rows reached through an instance are the module of the instance, which is not a descendant itself.
+	QUERY_SYMBOL_DESCENDANTS = ("WITH RECURSIVE descendants(id, depth, member) AS ( "
+								"	SELECT ?, 0, 0 "
+								"	UNION "
+								"	SELECT relationships.child, depth + 1, 1 FROM descendants "
+								"		INNER JOIN relationships ON relationships.parent == descendants.id "
+								"	WHERE depth < ? "
+								"	UNION "
+								"	SELECT instances.module, depth, 0 FROM descendants "
+								"		INNER JOIN instances ON instances.instance == descendants.id "
+								"	WHERE ? "
+								") "
+								"SELECT fully_qualified_symbols.*, min(depth) AS depth FROM descendants "
+								"	INNER JOIN fully_qualified_symbols ON sid == descendants.id "
+								"WHERE member GROUP BY sid ORDER BY depth, name")
+	QUERY_HIERARCHICAL_PATH = ("WITH RECURSIVE segments(idx, name) AS (SELECT key, value FROM json_each(?)), "
+							   "resolved(id, idx) AS ( "
+							   "	SELECT id, 0 FROM symbols "
+							   "	WHERE name == (SELECT name FROM segments WHERE idx == 0) AND declaration_anchor IS NOT NULL "
+							   "	UNION "
+							   "	SELECT relationships.child, resolved.idx + 1 FROM resolved "
+							   "		LEFT JOIN instances ON instances.instance == resolved.id "
+							   "		INNER JOIN relationships ON relationships.parent == coalesce(instances.module, resolved.id) "
+							   "		INNER JOIN symbols ON symbols.id == relationships.child "
+							   "		INNER JOIN segments ON segments.idx == resolved.idx + 1 AND segments.name == symbols.name "
+							   ") "
+							   "SELECT fully_qualified_symbols.* FROM resolved "
+							   "	INNER JOIN fully_qualified_symbols ON sid == resolved.id "
+							   "WHERE idx == (SELECT max(idx) FROM segments)")
+
+	# Symbol types which are instantiated, and which are never instances themselves.
+	INSTANTIABLE_TYPES = ("module", "interface")
+	NON_INSTANCE_TYPES = ("module", "interface", "package")
+	# Bound of the hierarchy walks, against cycles in broken designs.
+	MAX_HIERARCHY_DEPTH = 64
+
+	SCAN_PATTERN = re.compile(r"^SCAN (?:TABLE )?(\w+)")
+	# Objects defined by create_query_indexes.sql, dropped by drop_query_indexes.
+	QUERY_INDEX_PATTERN = re.compile(r"^CREATE (INDEX|TRIGGER) IF NOT EXISTS (\w+)", re.MULTILINE)
+
+	# Queries which must never fall back to a full table scan, with sample parameters.
+	HOT_QUERIES : T.Dict[str,T.Tuple[str,T.List]] = {
+		"get_symbols_by_name" : (QUERY_SYMBOLS_BY_NAME, ["name"]),
+		"get_symbol_childs" : (QUERY_SYMBOL_CHILDS, [1]),
+		"get_symbol_references" : (QUERY_SYMBOL_REFERENCES, [1]),
+		"rename_symbol (anchors)" : (QUERY_SYMBOL_ANCHORS, [1]),
+		"rename_symbol (lines)" : (QUERY_LINES_ANCHORS, [1, "[1, 2]"]),
+		"get_anchor_by_position" : (QUERY_ANCHOR_BY_POSITION, [1, 1, 1, 1, 1]),
+		"shift_anchors" : (QUERY_SHIFT_ANCHORS, [1, 1, 1, 1, 1, 1, 1]),
+		"get_definition_by_anchor (declaration)" : (QUERY_SYMBOL_BY_DECLARATION, [1]),
+		"get_definition_by_anchor (reference)" : (QUERY_SYMBOL_BY_REFERENCE, [1]),
+		"get_member_names" : (QUERY_MEMBER_NAMES, ["name", "a", "b", 1]),
+		"search_symbols (prefix)" : (QUERY_SYMBOL_SEARCH_PREFIX, ["a", "b", 1]),
+		"search_symbols (substring)" : (QUERY_SYMBOL_SEARCH_SUBSTRING, ['name : "abc"', 1]),
+		"resolve_instances" : (QUERY_INSTANCE_CANDIDATES, [1]),
+		"get_instance_module" : (QUERY_INSTANCE_MODULE, [1]),
+		"get_module_instances" : (QUERY_MODULE_INSTANCES, [1]),
+		"get_instantiating_modules" : (QUERY_INSTANTIATING_MODULES, [1]),
+		"get_symbol_ancestors" : (QUERY_SYMBOL_ANCESTORS, [1, 1]),
+		"get_symbol_descendants" : (QUERY_SYMBOL_DESCENDANTS, [1, 1, 1]),
+		"resolve_hierarchical_path" : (QUERY_HIERARCHICAL_PATH, ['["a", "b"]']),
+	}
+	def __init__(self, db_path : str = ":memory:", read_only : bool = False):
+		"""
+		:param db_path: Path to the database file. The index is kept across runs when not in memory.
+		:param read_only: Open a prebuilt index artifact, see export_artifact, without ever writing to it.
+		"""
+		self.db_path = db_path
+		self.read_only = read_only
+		if read_only :
+			self.db = sqlite3.connect(f"{pathlib.Path(db_path).absolute().as_uri()}?mode=ro", uri=True, check_same_thread=False,
+									  factory=IndexConnection)
+		else :
+			self.db = sqlite3.connect(db_path,check_same_thread=False,factory=IndexConnection)
 		self._signature_cache : T.Dict[str,int] = dict()
 		self._file_id_mapping : T.Dict[str,int] = dict()
+		self._ingested_files : T.Dict[int,SQLFile] = dict()
 		self._cached_file : SQLFile = None
+		# Path <-> ID of the indexed files, loaded on first use and dropped whenever the files change.
+		self._file_metadata : T.Optional[T.Tuple[T.Dict[str,int],T.Dict[int,str]]] = None
+		# Queries without any fuzzy match, valid as long as the database total_changes is the given one.
+		self._fuzzy_misses : T.Tuple[int,T.Set[str]] = (-1, set())
+		# Anchors of each file for position lookups, built at ingestion or on first use.
+		self._anchor_intervals : T.Dict[int,SQLAnchorIntervals] = dict()
+		self._bulk_loader : T.Optional[SQLBulkLoader] = None
+		self.bulk_load = True
+		self._ingest_lock = threading.Lock()
+		# Set on snapshots replaced by a newer one, whose files are not needed anymore.
+		self.discard_on_close = False
+		# Set by the owner of the index when it is put in use, to tell snapshots apart.
+		self.generation = 0
+		# Set when the instances table is added to an existing index, which then has to be scanned for them.
+		self._instances_pending = False
 		self._setup_db()
 
 	def __del__(self):
+		if not hasattr(self, "db") :
+			# The database could not be opened.
+			return
 		self.db.close()
+		# Artifacts are shared, only their users are discarded.
+		if self.discard_on_close and self.is_persistent and not self.read_only :
+			for suffix in ["", "-wal", "-shm"] :
+				try :
+					os.remove(f"{self.db_path}{suffix}")
+				except OSError :
+					pass
 
 	def _setup_db(self):
 		"""
@@ -35,15 +273,159 @@ class SQLIndexManager:
 		:return:
 		"""
 		self.db.row_factory = sqlite3.Row
-		self.clear()
+		if self.read_only :
+			# The whole artifact is mapped, so that the pages are shared with the other processes using it.
+			self.db.execute(f"PRAGMA mmap_size = {os.path.getsize(self.db_path)}")
+			if self.schema_version != len(self.MIGRATIONS) :
+				raise sqlite3.DatabaseError(f"Index artifact {self.db_path} is at version {self.schema_version}, "
+											f"version {len(self.MIGRATIONS)} is required")
+			self._load_file_id_mapping()
+		elif self.is_persistent :
+			self.db.execute("PRAGMA journal_mode = WAL")
+			self.db.execute("PRAGMA synchronous = NORMAL")
+			self._create_db()
+			self._load_file_id_mapping()
+			if self._instances_pending :
+				self.resolve_instances(list(self._file_id_mapping))
+				self._instances_pending = False
+		else :
+			self.clear()
+
+	def _load_file_id_mapping(self):
+		self._file_id_mapping.clear()
+		for r in self.db.execute("SELECT id, path FROM files").fetchall() :
+			self._file_id_mapping[r["path"]] = r["id"]
+		self._file_metadata = None
+
+	@metrics.timed("indexing", "clone")
+	def clone(self, db_path : str = ":memory:") -> "SQLIndexManager":
+		"""
+		Copy the whole index into a new and independent manager, which can be modified
+		while this one keeps answering queries.
+		:param db_path: Path to the database of the copy
+		:return: The new manager
+		"""
+		ret = SQLIndexManager(db_path)
+		# The ingestion lock keeps a concurrent load from being half copied.
+		with self._ingest_lock :
+			self.db.backup(ret.db)
+			for intervals in self._anchor_intervals.values() :
+				intervals.shared = True
+			ret._anchor_intervals.update(self._anchor_intervals)
+		ret._load_file_id_mapping()
+		return ret
+
+	@metrics.timed("indexing", "export_artifact")
+	def export_artifact(self, path : str):
+		"""
+		Write the index to a standalone database, to be opened read-only by the servers of a whole team.
+		The artifact is analyzed and compacted, and replaces any previous one at once.
+		:param path: Path to the artifact
+		"""
+		tmp_path = f"{path}.tmp"
+		if os.path.exists(tmp_path) :
+			os.remove(tmp_path)
+		with self._ingest_lock :
+			self.db.execute("ANALYZE")
+			artifact = sqlite3.connect(tmp_path)
+			try :
+				self.db.backup(artifact)
+				# Readers of a WAL database need to write its shared memory file, which a read-only share may forbid.
+				artifact.execute("PRAGMA journal_mode = DELETE")
+				artifact.execute("VACUUM")
+			finally :
+				artifact.close()
+		os.replace(tmp_path, path)
+
+	@staticmethod
+	def is_index_artifact(path : str) -> bool:
+		"""
+		:param path: Path to a prebuilt index
+		:return: True if the index is an SQLite database, False for a Kythe JSON index
+		"""
+		try :
+			with open(path, "rb") as f :
+				return f.read(16) == b"SQLite format 3\x00"
+		except OSError :
+			return False
+
+	@property
+	def is_persistent(self) -> bool:
+		return self.db_path != ":memory:"
 
 	def clear(self):
+		self._signature_cache.clear()
+		self._file_id_mapping.clear()
+		self._ingested_files.clear()
+		self._cached_file = None
+		self._file_metadata = None
+		self._anchor_intervals.clear()
+		self._bulk_loader = None
 		self._delete_db()
 		self._create_db()
 
 	def _create_db(self):
 		script_path = f"{self.SQL_ROOT_PATH}/create_index_db.sql"
 		self._run_sql_script(script_path)
+		self._migrate_db()
+
+	@property
+	def schema_version(self) -> int:
+		return self.db.execute("SELECT version FROM schema_version").fetchone()[0]
+
+	def _migrate_db(self):
+		"""
+		Apply the migrations not yet applied to the database.
+		"""
+		migrated = False
+		for version in range(self.schema_version, len(self.MIGRATIONS)) :
+			logger.info(f"Migrate index database to version {version + 1}")
+			self._run_sql_script(f"{self.SQL_ROOT_PATH}/{self.MIGRATIONS[version]}")
+			if self.MIGRATIONS[version] == "migrations/005_instances.sql" :
+				self._instances_pending = True
+			with self.db :
+				self.db.execute("UPDATE schema_version SET version = ?",[version + 1])
+			migrated = True
+		if migrated :
+			# The migrations only change the tables, the secondary indexes are all defined by create_query_indexes.sql.
+			# A new index is thus added there, along with a migration for the existing databases to get it.
+			self.create_query_indexes()
+
+	def drop_query_indexes(self):
+		"""
+		Remove the secondary indexes and the search triggers, to speed up large inserts.
+		They are found in create_query_indexes.sql, so that they are only listed there.
+		"""
+		with open(f"{self.SQL_ROOT_PATH}/create_query_indexes.sql", "r") as script :
+			statements = [f"DROP {kind} IF EXISTS {name};" for kind, name in self.QUERY_INDEX_PATTERN.findall(script.read())]
+		with self.db :
+			self.db.executescript("\n".join(statements))
+
+	def create_query_indexes(self):
+		"""
+		Build the secondary indexes back after drop_query_indexes.
+		"""
+		self._run_sql_script(f"{self.SQL_ROOT_PATH}/create_query_indexes.sql")
+
+	@property
+	def is_empty(self) -> bool:
+		return self.db.execute("SELECT NOT EXISTS (SELECT 1 FROM files)").fetchone()[0] == 1
+
+	def check_query_plans(self) -> T.Dict[str,T.List[str]]:
+		"""
+		Run EXPLAIN QUERY PLAN on the hot queries and report the ones which scan a whole table or index.
+		:return: Offending query name and the related query plan lines. Empty if everything is fine.
+		"""
+		ret = dict()
+		# Scans of the working tables of recursive queries and of table-valued functions are expected.
+		tables = {r[0] for r in self.db.execute("SELECT name FROM sqlite_master WHERE type == 'table'").fetchall()}
+		for name, (query, params) in self.HOT_QUERIES.items() :
+			plan = [r["detail"] for r in self.db.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
+			scanned = [self.SCAN_PATTERN.match(line) for line in plan]
+			# Full text lookups are reported as scans of the virtual table.
+			if any(m is not None and m.group(1) in tables and "VIRTUAL TABLE" not in m.string for m in scanned) :
+				ret[name] = plan
+		return ret
 
 	def _delete_db(self):
 		script_path = f"{self.SQL_ROOT_PATH}/delete_index_db.sql"
@@ -54,6 +436,78 @@ class SQLIndexManager:
 			with self.db :
 				self.db.executescript(script.read())
 
+	@staticmethod
+	def _iter_sql_script(script_path) -> T.Iterator[str]:
+		"""
+		Split a SQL script file in single statements, see split_sql_script.
+		:param script_path: Path to the SQL script
+		:return: Iterator over the statements
+		"""
+		with open(script_path, "r") as script:
+			yield from split_sql_script(script)
+
+	@contextmanager
+	def transaction(self):
+		"""
+		Make all the changes done within the block a single transaction, committed at its end
+		and rolled back if it fails. The other connections to the database keep reading its previous state until then.
+		Only meant for a connection used by a single task, as everything done through it meanwhile is part of the transaction.
+		"""
+		self.db.execute("BEGIN IMMEDIATE")
+		self.db.grouped = True
+		try :
+			yield self
+		except BaseException :
+			self.db.grouped = False
+			self.db.rollback()
+			# They may follow changes which were just rolled back.
+			self._anchor_intervals.clear()
+			raise
+		self.db.grouped = False
+		self.db.commit()
+
+	def reload(self):
+		"""
+		Drop everything cached from the database, after it was changed through another connection.
+		"""
+		self._signature_cache.clear()
+		self._ingested_files.clear()
+		self._cached_file = None
+		self._fuzzy_misses = (-1, set())
+		self._anchor_intervals.clear()
+		self._load_file_id_mapping()
+
+	def begin_bulk_load(self, mtimes : T.Optional[T.Dict[str,float]] = None):
+		"""
+		Start buffering the processed Kythe nodes instead of writing them one by one.
+		Nothing is written until end_bulk_load is called.
+		:param mtimes: Modification time of the files, read before running the extractor, see SQLBulkLoader
+		"""
+		if self._bulk_loader is None :
+			self._bulk_loader = SQLBulkLoader(self, mtimes)
+
+	@metrics.timed("indexing", "bulk_load")
+	def end_bulk_load(self):
+		"""
+		Write everything buffered since begin_bulk_load in a single transaction.
+		"""
+		loader = self._bulk_loader
+		self._bulk_loader = None
+		if loader is not None :
+			try :
+				loader.commit()
+			finally :
+				self._file_metadata = None
+
+	def abort_bulk_load(self):
+		"""
+		Drop everything buffered since begin_bulk_load.
+		"""
+		loader = self._bulk_loader
+		self._bulk_loader = None
+		if loader is not None :
+			loader.discard()
+
 	def dump_db(self, path : str):
 		dump = sqlite3.connect(path)
 		with dump :
@@ -67,6 +521,7 @@ class SQLIndexManager:
 		:param content:
 		:return: ID column of the given file
 		"""
+		self._file_metadata = None
 		with self.db :
 			return self.db.execute("INSERT INTO files(path,content) VALUES (?,?)",[file_path,content]).lastrowid
 
@@ -81,8 +536,13 @@ class SQLIndexManager:
 		:return: ID column of the created anchor.
 		"""
 		with self.db :
-			return self.db.execute("INSERT INTO anchors VALUES (NULL,?,?,?,?,?)",anchor.db_record[1:]).lastrowid
+			aid = self.db.execute("INSERT INTO anchors VALUES (NULL,?,?,?,?,?)",anchor.db_record[1:]).lastrowid
+		intervals = self._editable_anchor_intervals(anchor.file)
+		if intervals is not None :
+			intervals.add(aid, (anchor.start_line, anchor.start_char), (anchor.end_line, anchor.end_char))
+		return aid
 
+	@metrics.timed("sql_query")
 	def bulk_update_anchors(self,data : T.List[SQLAnchor]):
 		"""
 		This function will update all SQLRow specified by an anchor in data.
@@ -93,6 +553,34 @@ class SQLIndexManager:
 		dataset = [x.db_record[1:] + [x.db_record[0]] for x in data]
 		with self.db :
 			self.db.executemany("UPDATE anchors SET (file,start_line,start_char,stop_line,stop_char) = (?,?,?,?,?) WHERE id = ?",dataset)
+		for fid in {int(x.file) for x in data} :
+			self._anchor_intervals.pop(fid,None)
+
+	@metrics.timed("sql_query")
+	def shift_anchors(self, file : int, edits : T.List[T.Tuple[T.Tuple[int,int],T.Tuple[int,int],str]], content : str):
+		"""
+		Move the anchors of a file to follow edits of its content, without reindexing it.
+		Anchors before an edit are kept, the ones after it are moved by the lines and characters
+		it adds or removes, and the ones overlapping it are resized to cover it.
+		The file is then considered outdated, so that it is extracted again if the edits are never saved.
+		:param file: ID of the file
+		:param edits: (start, end, new text) of each edit, in the order they were applied.
+			Positions are LSP ones : (line, character), both 0-based.
+		:param content: Content of the file once edited
+		"""
+		dataset = list()
+		for (start_line, start_char), (end_line, end_char), text in edits :
+			new_lines = SQLFile.LINE_BREAK_PATTERN.split(text)
+			new_end_line = start_line + len(new_lines) - 1
+			new_end_char = (start_char if len(new_lines) == 1 else 0) + len(new_lines[-1])
+			dataset.append([file, start_line, start_char, end_line, end_char, new_end_line, new_end_char])
+		with self.db :
+			self.db.executemany(self.QUERY_SHIFT_ANCHORS, dataset)
+			self.db.execute("UPDATE files SET content = ?, hash = NULL, mtime = NULL WHERE id == ?", [content, file])
+		intervals = self._editable_anchor_intervals(file)
+		if intervals is not None :
+			for _, start_line, start_char, end_line, end_char, new_end_line, new_end_char in dataset :
+				intervals.shift((start_line, start_char), (end_line, end_char), (new_end_line, new_end_char))
 
 	def add_symbol(self,name : str, type : str, declaration_anchor_id : int) -> int:
 		"""
@@ -105,6 +593,75 @@ class SQLIndexManager:
 		with self.db :
 			return self.db.execute("INSERT INTO symbols(name,type,declaration_anchor) VALUES (?,?,?)",[name,type,declaration_anchor_id]).lastrowid
 
+	@metrics.timed("sql_query")
+	def rename_symbol(self, symbol : SQLSymbol, new_name : str) -> T.Tuple[T.List[SQLAnchor],T.Dict[int,str]]:
+		"""
+		Rename a symbol in the index as if its declaration and references were edited in the sources :
+		the symbol name, the anchors on the same lines and the content of the files are updated at once.
+		Anchors are expected to be on a single line, which is the case of identifiers.
+		:param symbol: Symbol to rename
+		:param new_name: New name of the symbol
+		:return: Anchors of the symbol, with their positions before the rename, sorted by file and position,
+			and the content of each renamed file once renamed.
+		"""
+		delta = len(new_name) - len(symbol.name)
+		renamed : T.List[SQLAnchor] = list()
+		contents : T.Dict[int,str] = dict()
+		moved = list()
+		# New positions of the moved anchors of each file.
+		moved_positions : T.Dict[int,T.Dict[int,T.Tuple[T.Tuple[int,int],T.Tuple[int,int]]]] = dict()
+		with self.db :
+			rows = self.db.execute(self.QUERY_SYMBOL_ANCHORS, [symbol.id]).fetchall()
+			for fid, file_rows in itertools.groupby(rows, key=lambda r : r[1]) :
+				# Old ends of the renamed anchors of each line, sorted. Anchors at the same position are edited once.
+				line_ends : T.Dict[int,T.List[int]] = dict()
+				file_anchors : T.List[SQLAnchor] = list()
+				previous_start = None
+				for aid, _, start_line, start_char, stop_line, stop_char in file_rows :
+					if (start_line, start_char) == previous_start :
+						continue
+					previous_start = (start_line, start_char)
+					file_anchors.append(SQLAnchor(aid, fid, (start_line, start_char), (stop_line, stop_char)))
+					line_ends.setdefault(start_line, list()).append(stop_char)
+				renamed.extend(file_anchors)
+
+				if delta != 0 :
+					# Each anchor of the lines moves by the number of renamed anchors ending before it.
+					lines_anchors = self.db.execute(self.QUERY_LINES_ANCHORS, [fid, json.dumps(list(line_ends))])
+					for aid, start_line, start_char, stop_line, stop_char in lines_anchors :
+						ends = line_ends[start_line]
+						start_shift = bisect_right(ends, start_char)
+						stop_shift = bisect_right(ends, stop_char) if stop_line == start_line else 0
+						if start_shift != 0 or stop_shift != 0 :
+							moved.append((start_char + delta * start_shift, stop_char + delta * stop_shift, aid))
+							moved_positions.setdefault(fid, dict())[aid] = ((start_line, start_char + delta * start_shift),
+																			(stop_line, stop_char + delta * stop_shift))
+
+				r = self.db.execute("SELECT content FROM files WHERE id == ?", [fid]).fetchone()
+				if r is not None and r["content"] is not None :
+					content = r["content"]
+					line_starts = SQLFile(fid, None, content).line_starts
+					if all(a.end_line < len(line_starts) for a in file_anchors) :
+						pieces = list()
+						previous = 0
+						for a in file_anchors :
+							pieces.append(content[previous:line_starts[a.start_line] + a.start_char - 1])
+							pieces.append(new_name)
+							previous = line_starts[a.end_line] + a.end_char - 1
+						pieces.append(content[previous:])
+						contents[fid] = "".join(pieces)
+
+			self.db.executemany("UPDATE anchors SET (start_char, stop_char) = (?,?) WHERE id == ?", moved)
+			self.db.execute("UPDATE symbols SET name = ? WHERE id = ?", [new_name, symbol.id])
+			# As with shift_anchors, the files count as outdated until they are saved and reindexed.
+			self.db.executemany("UPDATE files SET content = ?, hash = NULL, mtime = NULL WHERE id == ?",
+								[(c, fid) for fid, c in contents.items()])
+		for fid, positions in moved_positions.items() :
+			intervals = self._editable_anchor_intervals(fid)
+			if intervals is not None :
+				intervals.move(positions)
+		return renamed, contents
+
 	def update_symbol_name(self,id : int, new_name : str):
 		with self.db:
 			self.db.execute("UPDATE symbols SET name = ? WHERE id = ?",[new_name,id])
@@ -143,6 +700,7 @@ class SQLIndexManager:
 		with self.db:
 			self.db.execute("INSERT INTO relationships(parent,child) VALUES (?,?)", (parent_id, child_id))
 
+	@metrics.timed("sql_query")
 	def get_symbols_by_name(self,name : str) -> T.List[SQLSymbol]:
 		"""
 		Retrieve data and return according Symbols objects for a given name.
@@ -151,11 +709,87 @@ class SQLIndexManager:
 		"""
 		results_items : T.List[SQLSymbol] = list()
 		with self.db :
-			results = self.db.execute("SELECT * FROM fully_qualified_symbols WHERE name == ?", [name]).fetchall()
+			results = self.db.execute(self.QUERY_SYMBOLS_BY_NAME, [name]).fetchall()
 			results_items = [SQLSymbol.from_fully_qualified_sql_record(x) for x in results]
 
 		return results_items
 
+	@metrics.timed("sql_query")
+	def search_symbols(self, query : str, limit : int = 100, offset : int = 0) -> T.List[SQLSymbol]:
+		"""
+		Look up symbols matching a partial name, best matches first :
+		names starting with the query (exact matches first), then names containing it and finally,
+		as a fuzzy match, names containing all its characters in order.
+		The last two are case-insensitive.
+		:param query: Partial name to look for
+		:param limit: Maximum number of symbols to return
+		:param offset: Number of best matches to skip, for pagination
+		:return: Matching symbols having a declaration
+		"""
+		needed = offset + limit
+		found : T.Dict[int,None] = dict()
+
+		def collect(sql : str, params : T.List):
+			# Tiers overlap, so fetch enough rows to fill the page despite the symbols already found.
+			for r in self.db.execute(sql, params + [needed + len(found)]).fetchall() :
+				if len(found) >= needed :
+					break
+				found.setdefault(r[0])
+
+		with self.db :
+			collect(self.QUERY_SYMBOL_SEARCH_PREFIX, [query, query + "\U0010FFFF"])
+			# The trigram index only handles queries of at least 3 characters.
+			if len(found) < needed and len(query) >= 3 :
+				collect(self.QUERY_SYMBOL_SEARCH_SUBSTRING, [f'name : "{query.replace(chr(34), chr(34) * 2)}"'])
+			if len(found) < needed and len(query) > 0 and not self._is_fuzzy_miss(query) :
+				escaped = [c if c not in "\\%_" else f"\\{c}" for c in query]
+				before = len(found)
+				collect(self.QUERY_SYMBOL_SEARCH_SUBSEQUENCE, [f"%{'%'.join(escaped)}%"])
+				if len(found) == before == 0 :
+					self._add_fuzzy_miss(query)
+
+			selected = list(found)[offset:needed]
+			rows = self.db.execute(f"SELECT * FROM fully_qualified_symbols WHERE sid IN ({','.join('?' * len(selected))})",
+								   selected).fetchall()
+		symbols = {r["sid"] : SQLSymbol.from_fully_qualified_sql_record(r) for r in rows}
+		return [symbols[sid] for sid in selected if sid in symbols]
+
+	def _is_fuzzy_miss(self, query : str) -> bool:
+		"""
+		The fuzzy match is a full scan. When typing a name which does not exist, each keystroke extends
+		a query already known to have no match, and which is then a subsequence of the new one.
+		"""
+		changes, misses = self._fuzzy_misses
+		if changes != self.db.total_changes :
+			return False
+		for miss in misses :
+			remaining = iter(query.lower())
+			if all(c in remaining for c in miss) :
+				return True
+		return False
+
+	def _add_fuzzy_miss(self, query : str):
+		changes, misses = self._fuzzy_misses
+		if changes != self.db.total_changes or len(misses) >= 256 :
+			misses = set()
+		misses.add(query.lower())
+		self._fuzzy_misses = (self.db.total_changes, misses)
+
+	@metrics.timed("sql_query")
+	def get_member_names(self, parent_name : str, prefix : str = "", limit : int = 200) -> T.Tuple[T.List[str],bool]:
+		"""
+		Get the names of the children of all the symbols with the given name, in a single query.
+		:param parent_name: Name of the parent symbols
+		:param prefix: Start of the children names
+		:param limit: Maximum number of names to return
+		:return: Sorted names of the children, and whether there are more than limit of them
+		"""
+		with self.db :
+			rows = self.db.execute(self.QUERY_MEMBER_NAMES, [parent_name, prefix, prefix + "\U0010FFFF", limit + 1]).fetchall()
+		names = [r[0] for r in rows]
+		return names[:limit], len(names) > limit
+
+	@metrics.timed("sql_query")
 	def get_symbol_childs(self,parent : SQLSymbol) -> T.List[SQLSymbol]:
 		"""
 		Retrieve a list of all childrens for this symbol
@@ -164,11 +798,123 @@ class SQLIndexManager:
 		"""
 		ret = list()
 		with self.db :
-			results = self.db.execute("SELECT * FROM fully_qualified_symbols WHERE sid IN "
-									  " ( SELECT child FROM relationships WHERE parent == ? )",[parent.id]).fetchall()
+			results = self.db.execute(self.QUERY_SYMBOL_CHILDS,[parent.id]).fetchall()
 			ret = [SQLSymbol.from_fully_qualified_sql_record(x) for x in results]
 		return ret
 
+	@metrics.timed("sql_query")
+	def get_symbol_ancestors(self, symbol : SQLSymbol, max_depth : int = MAX_HIERARCHY_DEPTH) -> T.List[SQLSymbol]:
+		"""
+		Retrieve the parents of the symbol, their own parents and so on, in a single query.
+		:param symbol: Symbol to look ancestors up for
+		:param max_depth: Maximum number of levels to go up
+		:return: The ancestors, the closest first
+		"""
+		with self.db :
+			results = self.db.execute(self.QUERY_SYMBOL_ANCESTORS,[symbol.id, max_depth]).fetchall()
+		return [SQLSymbol.from_fully_qualified_sql_record(x) for x in results]
+
+	@metrics.timed("sql_query")
+	def get_symbol_descendants(self, symbol : SQLSymbol, max_depth : int = MAX_HIERARCHY_DEPTH,
+							   through_instances : bool = True) -> T.List[SQLSymbol]:
+		"""
+		Retrieve the children of the symbol, their own children and so on, in a single query.
+		Each symbol is only given once, even if several instances lead to it.
+		:param symbol: Symbol to look descendants up for
+		:param max_depth: Maximum number of levels to go down
+		:param through_instances: Also go down into the modules of the instances, to walk the design hierarchy
+		:return: The descendants, the closest first
+		"""
+		with self.db :
+			results = self.db.execute(self.QUERY_SYMBOL_DESCENDANTS,[symbol.id, max_depth, through_instances]).fetchall()
+		return [SQLSymbol.from_fully_qualified_sql_record(x) for x in results]
+
+	@metrics.timed("sql_query")
+	def resolve_hierarchical_path(self, path : str) -> T.List[SQLSymbol]:
+		"""
+		Find the symbols designated by a dotted hierarchical path such as top.u_core.u_alu.sig, in a single query.
+		The first name is looked up anywhere, each following one among the children of the previous symbol
+		or, for an instance, among the children of its module.
+		:param path: Dotted path
+		:return: The matching symbols, several if the path is ambiguous
+		"""
+		segments = [s.strip() for s in path.split(".")]
+		if "" in segments :
+			return list()
+		with self.db :
+			results = self.db.execute(self.QUERY_HIERARCHICAL_PATH,[json.dumps(segments)]).fetchall()
+		return [SQLSymbol.from_fully_qualified_sql_record(x) for x in results]
+
+	@metrics.timed("indexing", "resolve_instances")
+	def resolve_instances(self, paths : T.Iterable[str]):
+		"""
+		Find the module and interface instances declared in the given files.
+		The extractor does not give the type of the instances, but the type is referenced right before the
+		instance name : a symbol declared after a reference to a module, with no other declaration in between,
+		is taken as an instance of this module.
+		:param paths: Paths of the files to look into
+		"""
+		file_ids = [self._file_id_mapping[p] for p in paths if p in self._file_id_mapping]
+		instances = list()
+		with self.db :
+			for fid in file_ids :
+				module = None
+				for r in self.db.execute(self.QUERY_INSTANCE_CANDIDATES,[fid]) :
+					if r["declared"] is not None :
+						if module is not None and r["declared_type"] not in self.NON_INSTANCE_TYPES :
+							instances.append((r["declared"],module))
+						module = None
+					if r["module"] is not None :
+						module = r["module"]
+			self.db.executemany("DELETE FROM instances WHERE instance IN "
+								"	(SELECT symbols.id FROM symbols INNER JOIN anchors ON anchors.id == declaration_anchor "
+								"	WHERE anchors.file == ?)", [(fid,) for fid in file_ids])
+			self.db.executemany("INSERT OR REPLACE INTO instances(instance, module) VALUES (?,?)", instances)
+
+	def _get_symbols_by_ids(self, ids : T.Iterable[int]) -> T.Dict[int,SQLSymbol]:
+		ids = list(set(ids))
+		if len(ids) == 0 :
+			return dict()
+		with self.db :
+			results = self.db.execute(f"SELECT * FROM fully_qualified_symbols WHERE sid IN ({','.join('?' * len(ids))})",
+									  ids).fetchall()
+		return {x["sid"] : SQLSymbol.from_fully_qualified_sql_record(x) for x in results}
+
+	@metrics.timed("sql_query")
+	def get_instance_module(self, instance : SQLSymbol) -> T.Optional[SQLSymbol]:
+		"""
+		:param instance: Symbol of an instance
+		:return: The module (or interface) instantiated, None if the symbol is not a known instance
+		"""
+		with self.db :
+			r = self.db.execute(self.QUERY_INSTANCE_MODULE,[instance.id]).fetchone()
+		return None if r is None else SQLSymbol.from_fully_qualified_sql_record(r)
+
+	@metrics.timed("sql_query")
+	def get_module_instances(self, module : SQLSymbol) -> T.List[T.Tuple[SQLSymbol,SQLSymbol]]:
+		"""
+		Retrieve the instances declared within a module.
+		:param module: Symbol of the module
+		:return: Pairs of (instance, instantiated module)
+		"""
+		with self.db :
+			rows = self.db.execute(self.QUERY_MODULE_INSTANCES,[module.id]).fetchall()
+		symbols = self._get_symbols_by_ids([x for r in rows for x in r])
+		return [(symbols[r[0]],symbols[r[1]]) for r in rows if r[0] in symbols and r[1] in symbols]
+
+	@metrics.timed("sql_query")
+	def get_instantiating_modules(self, module : SQLSymbol) -> T.List[T.Tuple[SQLSymbol,SQLSymbol]]:
+		"""
+		Retrieve the instances of a module, with the modules they are declared in.
+		:param module: Symbol of the instantiated module
+		:return: Pairs of (parent module, instance)
+		"""
+		with self.db :
+			rows = self.db.execute(self.QUERY_INSTANTIATING_MODULES,[module.id]).fetchall()
+		symbols = self._get_symbols_by_ids([x for r in rows for x in r])
+		return [(symbols[r[0]],symbols[r[1]]) for r in rows if r[0] in symbols and r[1] in symbols]
+
+	@metrics.timed("sql_query")
 	def get_symbol_references(self, symbol : SQLSymbol) -> T.List[SQLAnchor]:
 		"""
 		Retrieve all references anchors for the given symbol object, based upon symbol ID
@@ -177,11 +923,12 @@ class SQLIndexManager:
 		"""
 
 		with self.db :
-			results = self.db.execute("SELECT anchors.*, refs.id as rid, anchor FROM refs INNER JOIN anchors ON anchors.id == refs.anchor WHERE refs.symbol == ?", [symbol.id]).fetchall()
+			results = self.db.execute(self.QUERY_SYMBOL_REFERENCES, [symbol.id]).fetchall()
 			results_items = [SQLAnchor(x["id"],x["file"],(x["start_line"],x["start_char"]), (x["stop_line"],x["stop_char"])) for x in results]
 
 		return results_items
 
+	@metrics.timed("sql_query")
 	def get_anchor_by_position(self, file : int, line : int, char : int) -> T.List[SQLAnchor]:
 		"""
 		Retrieve the anchor at the given position.
@@ -190,21 +937,55 @@ class SQLIndexManager:
 		:return: Anchors if any, None otherwise
 		"""
 		ret = list()
-		logger.debug(f"  Anchor by position target : {[file,line,line,char,char]}")
+		logger.debug("  Anchor by position target : %s", [file,line,line,char,char])
 		with self.db :
-			result = self.db.execute("SELECT * FROM anchors "
-									 "WHERE "
-									 "	file == ? "
-									 "	AND start_line <= ? "
-									 "	AND stop_line >= ? "
-									 "  AND start_char <= ? "
-									 "  AND stop_char >= ? ",
+			result = self.db.execute(self.QUERY_ANCHOR_BY_POSITION,
 									 [file,line,line,char,char]).fetchall()
 
 			ret = [SQLAnchor.from_sql_record(x) for x in result]
-			logger.debug(f"    Query results : {ret}")
+			logger.debug("    Query results : %s", ret)
 		return ret
 
+	def get_anchor_intervals(self, file : int) -> SQLAnchorIntervals:
+		"""
+		Get the position lookup structure of a file, building it if needed.
+		:param file: ID of the file
+		"""
+		file = int(file)
+		intervals = self._anchor_intervals.get(file)
+		if intervals is None :
+			with self.db :
+				rows = self.db.execute("SELECT id, start_line, start_char, stop_line, stop_char FROM anchors WHERE file == ?",
+									   [file]).fetchall()
+			intervals = SQLAnchorIntervals(file,rows)
+			self._anchor_intervals[file] = intervals
+		return intervals
+
+	def _editable_anchor_intervals(self, file : int) -> T.Optional[SQLAnchorIntervals]:
+		"""
+		Get the position lookup structure of a file to update it along with its anchors,
+		copying it first if it is shared with another index.
+		:param file: ID of the file
+		:return: The structure, None if it was not built yet
+		"""
+		file = int(file)
+		intervals = self._anchor_intervals.get(file)
+		if intervals is not None and intervals.shared :
+			intervals = self._anchor_intervals[file] = intervals.copy()
+		return intervals
+
+	@metrics.timed("memory_query")
+	def get_anchor_at_position(self, file : int, line : int, char : int) -> T.Optional[SQLAnchor]:
+		"""
+		Retrieve the innermost anchor at the given position, without querying the database once the file is known.
+		First line is 0
+		First char is 1
+		:param file: File to look into
+		:return: The anchor if any, None otherwise
+		"""
+		return self.get_anchor_intervals(file).find(line,char)
+
+	@metrics.timed("sql_query")
 	def get_anchor_by_id(self, aid : int) -> T.Optional[SQLAnchor]:
 		with self.db:
 			r = self.db.execute("SELECT * FROM anchors WHERE id = ?",[aid]).fetchone()
@@ -212,6 +993,7 @@ class SQLIndexManager:
 				return SQLAnchor.from_sql_record(r)
 		return None
 
+	@metrics.timed("sql_query")
 	def get_symbol_by_id(self, sid : int) -> T.Optional[SQLSymbol]:
 		"""
 		Return a symbol object when given its database ID
@@ -224,22 +1006,22 @@ class SQLIndexManager:
 			ret = SQLSymbol.from_fully_qualified_sql_record(r)
 		return ret
 
+	@metrics.timed("sql_query")
 	def get_definition_by_anchor(self,anchor : SQLAnchor) -> T.Optional[SQLSymbol] :
 		# First, try to get the symbol from the anchor.
 		with self.db :
-			r = self.db.execute("SELECT * FROM fully_qualified_symbols WHERE aid == ?",[anchor.id]).fetchone()
+			r = self.db.execute(self.QUERY_SYMBOL_BY_DECLARATION,[anchor.id]).fetchone()
 			if r is not None :
 				return SQLSymbol.from_fully_qualified_sql_record(r)
 
 			else :
 				# We have an actual reference.
-				r = self.db.execute("SELECT * FROM fully_qualified_symbols "
-									"	INNER JOIN refs ON refs.symbol == sid "
-									"WHERE anchor == ?",[anchor.id]).fetchone()
+				r = self.db.execute(self.QUERY_SYMBOL_BY_REFERENCE,[anchor.id]).fetchone()
 				if r is not None :
 					return SQLSymbol.from_fully_qualified_sql_record(r)
 		return None
 
+	@metrics.timed("sql_query")
 	def get_file_by_path(self, path : str):
 		with self.db :
 			r = self.db.execute("SELECT * FROM files WHERE path == ?",[path]).fetchone()
@@ -247,6 +1029,7 @@ class SQLIndexManager:
 				return SQLFile(r["id"],r["path"],r["content"])
 		return None
 
+	@metrics.timed("sql_query")
 	def get_file_by_id(self, fid : int):
 		with self.db :
 			r = self.db.execute("SELECT * FROM files WHERE id == ?",[fid]).fetchone()
@@ -254,10 +1037,150 @@ class SQLIndexManager:
 				return SQLFile(r["id"],r["path"],r["content"])
 		return None
 
+	def _get_file_metadata(self) -> T.Tuple[T.Dict[str,int],T.Dict[int,str]]:
+		metadata = self._file_metadata
+		if metadata is None :
+			with self.db :
+				rows = self.db.execute("SELECT id, path FROM files").fetchall()
+			metadata = ({r["path"] : r["id"] for r in rows}, {r["id"] : r["path"] for r in rows})
+			self._file_metadata = metadata
+		return metadata
+
+	def get_file_id(self, path : str) -> T.Optional[int]:
+		"""
+		Get the ID of a file without loading its content.
+		:param path: Path of the file
+		:return: The file ID, None if the file is not indexed
+		"""
+		return self._get_file_metadata()[0].get(path)
+
+	def get_file_path(self, fid : int) -> T.Optional[str]:
+		"""
+		Get the path of a file without loading its content.
+		:param fid: ID of the file
+		:return: The file path, None if the file is not indexed
+		"""
+		return self._get_file_metadata()[1].get(int(fid))
+
+	def get_files_metadata(self) -> T.Dict[str,T.Tuple[int,T.Optional[str],T.Optional[float]]]:
+		"""
+		Get the ID, content hash and modification time of all indexed files, without their content.
+		:return: Dictionary path -> (id, hash, mtime)
+		"""
+		with self.db :
+			rows = self.db.execute("SELECT id, path, hash, mtime FROM files").fetchall()
+		return {r["path"] : (r["id"], r["hash"], r["mtime"]) for r in rows}
+
+	@metrics.timed("sql_query")
+	def get_including_files(self, paths : T.Iterable[str]) -> T.List[str]:
+		"""
+		List the files which include one of the given files, directly or not.
+		Includes are matched on the file name only, which may report a few extra files.
+		:param paths: Included files
+		:return: Paths of the including files, not including the given files.
+		"""
+		found = set(paths)
+		names = {os.path.basename(p) for p in found}
+		ret = list()
+		while len(names) > 0 :
+			placeholders = ",".join("?" * len(names))
+			with self.db :
+				rows = self.db.execute("SELECT DISTINCT files.path FROM includes "
+									   "	INNER JOIN files ON files.id == includes.file "
+									   f"WHERE includes.name IN ({placeholders})", list(names)).fetchall()
+			new_paths = [r["path"] for r in rows if r["path"] not in found]
+			found.update(new_paths)
+			ret.extend(new_paths)
+			names = {os.path.basename(p) for p in new_paths}
+		return ret
+
+	@metrics.timed("sql_query")
+	def get_referenced_files(self, paths : T.Iterable[str]) -> T.List[str]:
+		"""
+		List the files declaring the symbols referenced from the given files.
+		:param paths: Files to look references up from
+		:return: Paths of the declaring files, not including the given files.
+		"""
+		paths = list(paths)
+		if len(paths) == 0 :
+			return list()
+		placeholders = ",".join("?" * len(paths))
+		with self.db :
+			rows = self.db.execute("SELECT DISTINCT decl_file.path FROM files "
+								   "	INNER JOIN anchors ON anchors.file == files.id "
+								   "	INNER JOIN refs ON refs.anchor == anchors.id "
+								   "	INNER JOIN symbols ON symbols.id == refs.symbol "
+								   "	INNER JOIN anchors AS decl ON decl.id == symbols.declaration_anchor "
+								   "	INNER JOIN files AS decl_file ON decl_file.id == decl.file "
+								   f"WHERE files.path IN ({placeholders})", paths).fetchall()
+		return [r["path"] for r in rows if r["path"] not in paths]
+
+	def get_included_names(self) -> T.Set[str]:
+		"""
+		:return: File names of all the files included by an indexed file.
+		"""
+		with self.db :
+			return {r["name"] for r in self.db.execute("SELECT DISTINCT name FROM includes").fetchall()}
+
+	def _run_on_files(self, script : str, paths : T.List[str]):
+		"""
+		Run a script working on a set of files, given in the temporary table selected_files.
+		"""
+		self.db.execute("CREATE TEMP TABLE IF NOT EXISTS selected_files (path TEXT PRIMARY KEY)")
+		try :
+			with self.db :
+				self.db.executemany("INSERT OR IGNORE INTO selected_files(path) VALUES (?)", [(p,) for p in paths])
+				for statement in self._iter_sql_script(f"{self.SQL_ROOT_PATH}/{script}"):
+					self.db.execute(statement)
+		finally :
+			self.db.execute("DROP TABLE IF EXISTS temp.selected_files")
+
+	def _forget_files(self, paths : T.List[str]):
+		for path in paths :
+			fid = self._file_id_mapping.pop(path,None)
+			self._ingested_files.pop(fid,None)
+			self._anchor_intervals.pop(fid,None)
+		self._cached_file = None
+		self._file_metadata = None
+
+	@metrics.timed("indexing", "remove_files")
+	def remove_files(self, paths : T.Iterable[str]):
+		"""
+		Remove files from the index, with their anchors, the symbols they declare and the related references.
+		:param paths: Paths of the files to remove
+		"""
+		paths = list(paths)
+		self._run_on_files("delete_files.sql", paths)
+		self._forget_files(paths)
+
+	@metrics.timed("indexing", "detach_files")
+	def detach_files(self, paths : T.Iterable[str]):
+		"""
+		Remove the content of files from the index before loading them again.
+		The symbols declared in those files are kept so that references from other files stay valid.
+		Once the files are loaded again, purge_unbound_symbols must be called with the same files.
+		:param paths: Paths of the files to detach
+		"""
+		paths = list(paths)
+		self._run_on_files("detach_files.sql", paths)
+		self._forget_files(paths)
+
+	@metrics.timed("indexing", "purge_unbound_symbols")
+	def purge_unbound_symbols(self, paths : T.Iterable[str]):
+		"""
+		Remove the symbols of detached files which were not declared again when loading them.
+		:param paths: Paths of the files previously detached
+		"""
+		self._run_on_files("purge_unbound_symbols.sql", list(paths))
+
 	def update_file_content(self,path, content):
+		"""
+		Replace the content of a file, which is then considered outdated as it does not match the file on disk anymore.
+		"""
 		with self.db:
-			self.db.execute("UPDATE files SET content = ? WHERE path = ?",[content,path])
+			self.db.execute("UPDATE files SET content = ?, hash = NULL, mtime = NULL WHERE path = ?",[content,path])
 
+	@metrics.timed("indexing", "read_kythe_index")
 	def read_kythe_index(self,index_path : str):
 		"""
 		Read the .json output of a kythe index run.
@@ -265,26 +1188,56 @@ class SQLIndexManager:
 		:param path: Path to the JSON file
 		:return: None
 		"""
-		current_node = JSONRecord()
+		if self.bulk_load :
+			self.begin_bulk_load()
 		with open(index_path, "r") as f:
-			gc.disable()
-			i = 0
-			for line in f:
+			self.read_kythe_stream(f)
+		if self.bulk_load :
+			self.end_bulk_load()
+		else :
+			self._release_ingested_files(list(self._ingested_files))
+			self.resolve_instances(list(self._file_id_mapping))
+
+	def read_kythe_stream(self, lines : T.Iterable[str]):
+		"""
+		Process Kythe JSON records as they are read, one record per line.
+		The records may come from a file or directly from the extractor output.
+		When a bulk load is in progress, records are only buffered.
+		Several streams can be read at once from different threads.
+		:param lines: Iterable over the lines of the Kythe JSON output
+		:return: None
+		"""
+		current_node = JSONRecord()
+		gc.disable()
+		try :
+			for line in lines:
 				if line.strip() == "" :
 					continue
 				data = json.loads(line)
 				if not current_node.is_record_appendable(data):
-					self._process_kythe_node(current_node)
+					with self._ingest_lock :
+						self._process_kythe_node(current_node)
 					current_node.clear()
 				current_node.append_record(data)
-			self._process_kythe_node(current_node)
+			if current_node.source is not None :
+				with self._ingest_lock :
+					self._process_kythe_node(current_node)
+		finally :
 			gc.enable()
 
 	def _process_kythe_node(self, node_content : JSONRecord):
+		if self._bulk_loader is not None :
+			self._bulk_loader.add_node(node_content)
+			return
 		if node_content.source.signature == "" and node_content.source.path == "" :
 			return
 		if node_content.is_file :
-			self._file_id_mapping[node_content.source.path] = self.add_file(node_content.source.path,node_content.facts["/kythe/text"])
+			path = node_content.source.path
+			content = node_content.facts["/kythe/text"]
+			fid = self.add_file(path,content)
+			self._file_id_mapping[path] = fid
+			# Keep the file object around so its line table is only built once during ingest, released at its end.
+			self._ingested_files[fid] = SQLFile(fid,path,content)
 			return
 		if node_content.is_anchor :
 			self._cache_file_id(self._file_id_mapping[node_content.source.path])
@@ -321,10 +1274,26 @@ class SQLIndexManager:
 				return
 		return
 
+	def _release_ingested_files(self, fids : T.Iterable[int]):
+		"""
+		Drop the files kept in memory while ingesting them, once done.
+		:param fids: IDs of the files
+		"""
+		fids = set(fids)
+		for fid in fids :
+			self._ingested_files.pop(fid,None)
+		if self._cached_file is not None and self._cached_file.id in fids :
+			self._cached_file = None
+
 	def _cache_file_path(self, file_path : str):
 		if self._cached_file is None or self._cached_file.path != file_path:
 			self._cached_file = self.get_file_by_path(file_path)
 
 	def _cache_file_id(self, file_id : int):
+		# Anchors coming back from the DB may carry the file ID as text.
+		file_id = int(file_id)
 		if self._cached_file is None or self._cached_file.id != file_id:
-			self._cached_file = self.get_file_by_id(file_id)
\ No newline at end of file
+			if file_id in self._ingested_files :
+				self._cached_file = self._ingested_files[file_id]
+			else :
+				self._cached_file = self.get_file_by_id(file_id)
\ No newline at end of file
@@ -1,2 +1,3 @@
 from .SQLDataTypes import SQLAnchor, SQLSymbol, SQLFile
+from .SQLBulkLoader import SQLBulkLoader
 from .SQLIndexManager import SQLIndexManager
\ No newline at end of file
@@ -1,3 +1,10 @@
+CREATE TABLE IF NOT EXISTS schema_version
+(
+	version INTEGER NOT NULL -- Number of migrations applied on top of this script
+);
+
+INSERT INTO schema_version(version) SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM schema_version);
+
 CREATE TABLE IF NOT EXISTS files
 (
 	id INTEGER PRIMARY KEY,
@@ -8,7 +15,7 @@ CREATE TABLE IF NOT EXISTS files
 CREATE TABLE IF NOT EXISTS anchors
 (
 	id integer primary key,
-	file text not null,
+	file INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
 	start_line integer not null,
 	start_char integer not null,
 	stop_line integer not null,
@@ -0,0 +1,39 @@
+-- Secondary indexes used by the index queries, and triggers keeping the search index in sync.
+-- This is the only definition of both : they are created after the schema migrations, and dropped
+-- during large bulk loads and created again afterwards, see SQLIndexManager.drop_query_indexes.
+
+-- get_symbol_references
+CREATE INDEX IF NOT EXISTS refs_by_symbol ON refs(symbol, anchor);
+-- get_definition_by_anchor
+CREATE INDEX IF NOT EXISTS refs_by_anchor ON refs(anchor, symbol);
+CREATE INDEX IF NOT EXISTS symbols_by_declaration ON symbols(declaration_anchor);
+-- get_symbols_by_name
+CREATE INDEX IF NOT EXISTS symbols_by_name ON symbols(name);
+-- get_symbol_childs
+CREATE INDEX IF NOT EXISTS relationships_by_parent ON relationships(parent, child);
+-- get_anchor_by_position
+CREATE INDEX IF NOT EXISTS anchors_by_position ON anchors(file, start_line, stop_line, start_char, stop_char);
+-- Resolution of symbols already in the index during partial loads
+CREATE INDEX IF NOT EXISTS symbols_by_signature ON symbols(signature_path, signature);
+-- Cleanup of the relationships of removed symbols
+CREATE INDEX IF NOT EXISTS relationships_by_child ON relationships(child);
+-- get_including_files
+CREATE INDEX IF NOT EXISTS includes_by_name ON includes(name);
+CREATE INDEX IF NOT EXISTS includes_by_file ON includes(file);
+-- get_instantiating_modules
+CREATE INDEX IF NOT EXISTS instances_by_module ON instances(module);
+-- search_symbols : the full text index is rebuilt at once, then kept in sync by triggers
+INSERT INTO symbols_search(symbols_search) VALUES ('rebuild');
+
+CREATE TRIGGER IF NOT EXISTS symbols_search_insert AFTER INSERT ON symbols BEGIN
+	INSERT INTO symbols_search(rowid, name, type) VALUES (new.id, new.name, new.type);
+END;
+
+CREATE TRIGGER IF NOT EXISTS symbols_search_delete AFTER DELETE ON symbols BEGIN
+	INSERT INTO symbols_search(symbols_search, rowid, name, type) VALUES ('delete', old.id, old.name, old.type);
+END;
+
+CREATE TRIGGER IF NOT EXISTS symbols_search_update AFTER UPDATE OF name, type ON symbols BEGIN
+	INSERT INTO symbols_search(symbols_search, rowid, name, type) VALUES ('delete', old.id, old.name, old.type);
+	INSERT INTO symbols_search(rowid, name, type) VALUES (new.id, new.name, new.type);
+END;
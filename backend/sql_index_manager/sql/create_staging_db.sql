@@ -0,0 +1,33 @@
+-- Temporary tables used by the bulk loader. They only live for the duration of a load.
+
+CREATE TEMP TABLE IF NOT EXISTS staging_nodes
+(
+	signature TEXT NOT NULL,
+	path TEXT NOT NULL,
+	id INTEGER NOT NULL, -- ID in anchors or symbols, depending on is_anchor
+	is_anchor INTEGER NOT NULL,
+	existing INTEGER NOT NULL DEFAULT 0, -- Node already in the index before this load
+	PRIMARY KEY (signature, path)
+) WITHOUT ROWID;
+
+CREATE TEMP TABLE IF NOT EXISTS staging_anchors
+(
+	id INTEGER PRIMARY KEY, -- Same as anchors(id)
+	text TEXT NOT NULL -- Source text covered by the anchor
+);
+
+CREATE TEMP TABLE IF NOT EXISTS staging_edges
+(
+	id INTEGER PRIMARY KEY, -- Keeps the order in which the edges were read
+	kind TEXT NOT NULL,
+	source_signature TEXT NOT NULL,
+	source_path TEXT NOT NULL,
+	target_signature TEXT NOT NULL,
+	target_path TEXT NOT NULL
+);
+
+CREATE TEMP TABLE IF NOT EXISTS staging_bindings
+(
+	symbol INTEGER PRIMARY KEY,
+	anchor INTEGER NOT NULL
+);
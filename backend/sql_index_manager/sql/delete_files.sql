@@ -0,0 +1,26 @@
+-- Remove everything attached to the files listed in temp.selected_files(path).
+-- Symbols are attached to a file through their declaration anchor or their Kythe path.
+
+CREATE TEMP TABLE IF NOT EXISTS removed_symbols (id INTEGER PRIMARY KEY);
+
+INSERT OR IGNORE INTO removed_symbols(id)
+SELECT symbols.id FROM symbols
+	INNER JOIN anchors ON anchors.id == symbols.declaration_anchor
+	INNER JOIN files ON files.id == anchors.file
+WHERE files.path IN (SELECT path FROM selected_files);
+
+INSERT OR IGNORE INTO removed_symbols(id)
+SELECT symbols.id FROM symbols WHERE signature_path IN (SELECT path FROM selected_files);
+
+DELETE FROM refs WHERE anchor IN
+	(SELECT anchors.id FROM anchors INNER JOIN files ON files.id == anchors.file WHERE files.path IN (SELECT path FROM selected_files));
+DELETE FROM refs WHERE symbol IN (SELECT id FROM removed_symbols);
+DELETE FROM relationships WHERE parent IN (SELECT id FROM removed_symbols);
+DELETE FROM relationships WHERE child IN (SELECT id FROM removed_symbols);
+DELETE FROM instances WHERE instance IN (SELECT id FROM removed_symbols) OR module IN (SELECT id FROM removed_symbols);
+DELETE FROM symbols WHERE id IN (SELECT id FROM removed_symbols);
+DELETE FROM includes WHERE file IN (SELECT id FROM files WHERE path IN (SELECT path FROM selected_files));
+DELETE FROM anchors WHERE file IN (SELECT id FROM files WHERE path IN (SELECT path FROM selected_files));
+DELETE FROM files WHERE path IN (SELECT path FROM selected_files);
+
+DROP TABLE temp.removed_symbols;
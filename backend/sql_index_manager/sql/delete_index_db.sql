@@ -2,4 +2,8 @@ DROP TABLE IF EXISTS anchors; -- Should delete all records
 DROP TABLE IF EXISTS symbols;
 DROP TABLE IF EXISTS refs;
 DROP TABLE IF EXISTS files;
-DROP TABLE IF EXISTS relationships;
\ No newline at end of file
+DROP TABLE IF EXISTS relationships;
+DROP TABLE IF EXISTS schema_version;
+DROP TABLE IF EXISTS includes;
+DROP TABLE IF EXISTS symbols_search;
+DROP TABLE IF EXISTS instances;
@@ -0,0 +1,4 @@
+DROP TABLE IF EXISTS temp.staging_nodes;
+DROP TABLE IF EXISTS temp.staging_anchors;
+DROP TABLE IF EXISTS temp.staging_edges;
+DROP TABLE IF EXISTS temp.staging_bindings;
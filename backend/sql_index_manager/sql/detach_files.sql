@@ -0,0 +1,25 @@
+-- Remove the content of the files listed in temp.selected_files(path) before loading them again.
+-- Unlike delete_files.sql, the symbols of those files are kept without declaration anchor,
+-- so that the references from other files remain valid once the symbols are bound again.
+
+CREATE TEMP TABLE IF NOT EXISTS detached_symbols (id INTEGER PRIMARY KEY);
+
+INSERT OR IGNORE INTO detached_symbols(id)
+SELECT symbols.id FROM symbols
+	INNER JOIN anchors ON anchors.id == symbols.declaration_anchor
+	INNER JOIN files ON files.id == anchors.file
+WHERE files.path IN (SELECT path FROM selected_files);
+
+INSERT OR IGNORE INTO detached_symbols(id)
+SELECT symbols.id FROM symbols WHERE signature_path IN (SELECT path FROM selected_files);
+
+DELETE FROM refs WHERE anchor IN
+	(SELECT anchors.id FROM anchors INNER JOIN files ON files.id == anchors.file WHERE files.path IN (SELECT path FROM selected_files));
+-- Relationships are emitted again along with the child symbol.
+DELETE FROM relationships WHERE child IN (SELECT id FROM detached_symbols);
+UPDATE symbols SET declaration_anchor = NULL WHERE id IN (SELECT id FROM detached_symbols);
+DELETE FROM includes WHERE file IN (SELECT id FROM files WHERE path IN (SELECT path FROM selected_files));
+DELETE FROM anchors WHERE file IN (SELECT id FROM files WHERE path IN (SELECT path FROM selected_files));
+DELETE FROM files WHERE path IN (SELECT path FROM selected_files);
+
+DROP TABLE temp.detached_symbols;
@@ -0,0 +1,2 @@
+-- Secondary indexes used by the index queries.
+-- Like all the secondary indexes, they are defined in create_query_indexes.sql, applied after the migrations.
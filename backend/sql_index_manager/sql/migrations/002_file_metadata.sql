@@ -0,0 +1,9 @@
+-- Metadata needed to update a persistent index in place.
+
+-- Content hash and modification time of the indexed version of each file.
+ALTER TABLE files ADD COLUMN hash TEXT;
+ALTER TABLE files ADD COLUMN mtime REAL;
+
+-- Kythe identity (signature and path) of each symbol, to link new references to existing symbols.
+ALTER TABLE symbols ADD COLUMN signature TEXT;
+ALTER TABLE symbols ADD COLUMN signature_path TEXT;
@@ -0,0 +1,7 @@
+-- Files included by each indexed file, to find the files to update when a header changes.
+
+CREATE TABLE IF NOT EXISTS includes
+(
+	file INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+	name TEXT NOT NULL -- File name of the included file, without directory
+);
@@ -0,0 +1,12 @@
+-- Full text index of the symbol names for workspace symbol search.
+-- The trigram tokenizer allows substring lookups. It is filled and kept in sync with the symbols table
+-- by create_query_indexes.sql.
+
+CREATE VIRTUAL TABLE IF NOT EXISTS symbols_search USING fts5
+(
+	name,
+	type UNINDEXED,
+	content = 'symbols',
+	content_rowid = 'id',
+	tokenize = 'trigram'
+);
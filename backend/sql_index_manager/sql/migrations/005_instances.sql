@@ -0,0 +1,8 @@
+-- Module (or interface) each instance symbol is an instance of, to navigate the design hierarchy.
+-- The extractor does not give the type of the instances, they are found by SQLIndexManager.resolve_instances.
+
+CREATE TABLE IF NOT EXISTS instances
+(
+	instance INTEGER PRIMARY KEY REFERENCES symbols(id) ON DELETE CASCADE,
+	module INTEGER NOT NULL REFERENCES symbols(id) ON DELETE CASCADE
+);
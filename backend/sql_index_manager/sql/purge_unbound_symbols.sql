@@ -0,0 +1,16 @@
+-- Remove the symbols of the files listed in temp.selected_files(path) which were not bound again
+-- after being detached, as they do not exist anymore.
+
+CREATE TEMP TABLE IF NOT EXISTS removed_symbols (id INTEGER PRIMARY KEY);
+
+INSERT OR IGNORE INTO removed_symbols(id)
+SELECT symbols.id FROM symbols
+WHERE signature_path IN (SELECT path FROM selected_files) AND declaration_anchor IS NULL;
+
+DELETE FROM refs WHERE symbol IN (SELECT id FROM removed_symbols);
+DELETE FROM relationships WHERE parent IN (SELECT id FROM removed_symbols);
+DELETE FROM relationships WHERE child IN (SELECT id FROM removed_symbols);
+DELETE FROM instances WHERE instance IN (SELECT id FROM removed_symbols) OR module IN (SELECT id FROM removed_symbols);
+DELETE FROM symbols WHERE id IN (SELECT id FROM removed_symbols);
+
+DROP TABLE temp.removed_symbols;
@@ -0,0 +1,33 @@
+-- Resolve the staged Kythe edges into the index tables.
+-- Run within the bulk load transaction, once all nodes and edges are staged.
+
+-- When a symbol is bound several times, the last binding wins as it would when applying edges one by one.
+INSERT OR REPLACE INTO staging_bindings(symbol, anchor)
+SELECT tgt.id, src.id FROM staging_edges AS e
+	INNER JOIN staging_nodes AS src ON src.signature == e.source_signature AND src.path == e.source_path
+	INNER JOIN staging_nodes AS tgt ON tgt.signature == e.target_signature AND tgt.path == e.target_path
+WHERE e.kind == '/defines/binding' AND src.is_anchor AND NOT tgt.is_anchor AND NOT tgt.existing
+ORDER BY e.id;
+
+UPDATE symbols SET
+	declaration_anchor = (SELECT anchor FROM staging_bindings WHERE symbol == symbols.id),
+	name = (SELECT text FROM staging_bindings
+				INNER JOIN staging_anchors ON staging_anchors.id == staging_bindings.anchor
+			WHERE symbol == symbols.id)
+WHERE id IN (SELECT symbol FROM staging_bindings);
+
+INSERT INTO refs(anchor, symbol)
+SELECT src.id, tgt.id FROM staging_edges AS e
+	INNER JOIN staging_nodes AS src ON src.signature == e.source_signature AND src.path == e.source_path
+	INNER JOIN staging_nodes AS tgt ON tgt.signature == e.target_signature AND tgt.path == e.target_path
+WHERE e.kind == '/ref' AND src.is_anchor AND NOT tgt.is_anchor
+ORDER BY e.id;
+
+-- Edges to nodes that are not symbols (files for instance) are dropped by the joins.
+-- Relationships of symbols already in the index are already there.
+INSERT INTO relationships(parent, child)
+SELECT tgt.id, src.id FROM staging_edges AS e
+	INNER JOIN staging_nodes AS src ON src.signature == e.source_signature AND src.path == e.source_path
+	INNER JOIN staging_nodes AS tgt ON tgt.signature == e.target_signature AND tgt.path == e.target_path
+WHERE e.kind == '/childof' AND NOT src.is_anchor AND NOT tgt.is_anchor AND NOT src.existing
+ORDER BY e.id;
@@ -0,0 +1,11 @@
+-- Used when loading on top of an existing index.
+-- Make the symbols already in the index available to the edge resolution when edges refer to them.
+
+INSERT OR IGNORE INTO staging_nodes(signature, path, id, is_anchor, existing)
+SELECT symbols.signature, symbols.signature_path, symbols.id, 0, 1 FROM staging_edges AS e
+	INNER JOIN symbols ON symbols.signature == e.target_signature AND symbols.signature_path == e.target_path;
+
+INSERT OR IGNORE INTO staging_nodes(signature, path, id, is_anchor, existing)
+SELECT symbols.signature, symbols.signature_path, symbols.id, 0, 1 FROM staging_edges AS e
+	INNER JOIN symbols ON symbols.signature == e.source_signature AND symbols.signature_path == e.source_path
+WHERE e.kind == '/childof';
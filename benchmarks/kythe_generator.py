@@ -0,0 +1,187 @@
+"""
+Generate a synthetic Kythe index, in the JSON format of verible-verilog-kythe-extractor,
+to run the benchmarks without Verible nor real sources.
+
+Each file holds one module, made of signal declarations, instances of the modules of the next
+hierarchy level, assignments referencing the signals and filler lines:
+
+	module m3;
+	  logic m3_s0;
+	  m7 u_m7();
+	  assign m3_s0 = m3_s4 & m3_s0;
+	  // filler
+	endmodule
+"""
+
+import argparse
+import base64
+import json
+import random
+import sys
+import typing as T
+
+
+class KytheGenerator:
+	def __init__(self, files : int = 50, lines : int = 400, symbols : int = 100, refs : int = 3,
+				 depth : int = 4, root : str = "/bench", seed : int = 1):
+		"""
+		:param files: Number of files, one module each
+		:param lines: Minimum number of lines of each file, completed by filler lines
+		:param symbols: Number of signals declared in each module
+		:param refs: Number of assignments per signal, each one holding three references
+		:param depth: Number of levels of the design hierarchy
+		:param root: Directory of the generated file paths
+		:param seed: Seed of the random generator
+		"""
+		self.files = files
+		self.lines = lines
+		self.symbols = symbols
+		self.refs = refs
+		self.depth = max(1,depth)
+		self.root = root
+		self.random = random.Random(seed)
+
+	def path(self, module : int) -> str:
+		return f"{self.root}/m{module}.sv"
+
+	def level_modules(self) -> T.List[T.List[int]]:
+		"""
+		:return: Modules of each hierarchy level, the top first
+		"""
+		levels = [list() for _ in range(min(self.depth, self.files))]
+		for m in range(self.files) :
+			levels[m * len(levels) // self.files].append(m)
+		return levels
+
+	def children(self, module : int) -> T.List[int]:
+		"""
+		:return: Modules instantiated by the given one, those of the next level spread across the modules of its level
+		"""
+		levels = self.level_modules()
+		for l, modules in enumerate(levels[:-1]) :
+			if module in modules :
+				i = modules.index(module)
+				return [c for j, c in enumerate(levels[l + 1]) if j % len(modules) == i]
+		return list()
+
+	@staticmethod
+	def _vname(signature : str, path : str) -> T.Dict[str,str]:
+		return {"signature" : signature, "path" : path, "language" : "verilog", "root" : "", "corpus" : "bench"}
+
+	@staticmethod
+	def _fact(source : T.Dict[str,str], name : str, value : str) -> str:
+		return json.dumps({"source" : source, "fact_name" : name,
+						   "fact_value" : base64.b64encode(value.encode("utf-8")).decode("ascii")})
+
+	@staticmethod
+	def _edge(source : T.Dict[str,str], kind : str, target : T.Dict[str,str]) -> str:
+		return json.dumps({"source" : source, "edge_kind" : f"/kythe/edge{kind}", "target" : target, "fact_name" : "/"})
+
+	def write(self, out : T.TextIO) -> int:
+		"""
+		Write the whole index.
+		:param out: Output stream
+		:return: Number of records written
+		"""
+		count = 0
+		for m in range(self.files) :
+			records = self.module_records(m)
+			out.write("\n".join(records))
+			out.write("\n")
+			count += len(records)
+		return count
+
+	def module_records(self, module : int) -> T.List[str]:
+		path = self.path(module)
+		name = f"m{module}"
+		signals = [f"{name}_s{i}" for i in range(self.symbols)]
+		children = self.children(module)
+
+		lines = [f"module {name};"]
+		lines.extend(f"  logic {s};" for s in signals)
+		lines.extend(f"  m{c} u_m{c}();" for c in children)
+		assignments = list()
+		for i in range(self.symbols) :
+			for _ in range(self.refs) :
+				j = self.random.randrange(self.symbols)
+				assignments.append((i,j))
+				lines.append(f"  assign {signals[i]} = {signals[j]} & {signals[i]};")
+		lines.extend("  // filler" for _ in range(self.lines - len(lines) - 1))
+		lines.append("endmodule")
+		text = "\n".join(lines) + "\n"
+		offsets = [0]
+		for l in lines :
+			offsets.append(offsets[-1] + len(l) + 1)
+
+		records = [self._fact(self._vname("", path), "/kythe/node/kind", "file"),
+				   self._fact(self._vname("", path), "/kythe/text", text)]
+		edges = list()
+
+		def anchor(line : int, column : int, length : int) -> T.Dict[str,str]:
+			start = offsets[line] + column
+			vname = self._vname(f"@{start}:{start + length}", path)
+			records.append(self._fact(vname, "/kythe/node/kind", "anchor"))
+			records.append(self._fact(vname, "/kythe/loc/start", str(start)))
+			records.append(self._fact(vname, "/kythe/loc/end", str(start + length)))
+			return vname
+
+		def symbol(signature : str, kind : str, subkind : T.Optional[str] = None) -> T.Dict[str,str]:
+			vname = self._vname(signature, path)
+			records.append(self._fact(vname, "/kythe/node/kind", kind))
+			if subkind is not None :
+				records.append(self._fact(vname, "/kythe/subkind", subkind))
+			return vname
+
+		module_vname = symbol(f"{name}#", "record", "module")
+		edges.append(self._edge(anchor(0, len("module "), len(name)), "/defines/binding", module_vname))
+
+		line = 1
+		signal_vnames = list()
+		for s in signals :
+			vname = symbol(f"{name}#{s}#", "variable")
+			signal_vnames.append(vname)
+			edges.append(self._edge(anchor(line, len("  logic "), len(s)), "/defines/binding", vname))
+			edges.append(self._edge(vname, "/childof", module_vname))
+			line += 1
+		for c in children :
+			child = f"m{c}"
+			vname = symbol(f"{name}#u_{child}#", "variable")
+			edges.append(self._edge(anchor(line, 2, len(child)), "/ref", self._vname(f"{child}#", self.path(c))))
+			edges.append(self._edge(anchor(line, 3 + len(child), len(child) + 2), "/defines/binding", vname))
+			edges.append(self._edge(vname, "/childof", module_vname))
+			line += 1
+		for i, j in assignments :
+			text_line = lines[line]
+			for target, column in ((i, len("  assign ")),
+								   (j, text_line.index("= ") + 2),
+								   (i, text_line.index("& ") + 2)) :
+				edges.append(self._edge(anchor(line, column, len(signals[target])), "/ref", signal_vnames[target]))
+			line += 1
+
+		records.extend(edges)
+		return records
+
+
+def process_args():
+	parser = argparse.ArgumentParser(description="Generate a synthetic Kythe index")
+	parser.add_argument("--output", type=str, default="-", help="Path to the JSON output, - for stdout")
+	parser.add_argument("--files", type=int, default=50, help="Number of files")
+	parser.add_argument("--lines", type=int, default=400, help="Minimum number of lines per file")
+	parser.add_argument("--symbols", type=int, default=100, help="Number of signals per file")
+	parser.add_argument("--refs", type=int, default=3, help="Number of assignments per signal")
+	parser.add_argument("--depth", type=int, default=4, help="Depth of the design hierarchy")
+	parser.add_argument("--seed", type=int, default=1, help="Random seed")
+	return parser.parse_args()
+
+
+def run():
+	args = process_args()
+	generator = KytheGenerator(args.files, args.lines, args.symbols, args.refs, args.depth, seed=args.seed)
+	if args.output == "-" :
+		generator.write(sys.stdout)
+	else :
+		with open(args.output, "w") as out :
+			generator.write(out)
+
+if __name__ == "__main__":
+	run()
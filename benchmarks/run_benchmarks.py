@@ -0,0 +1,207 @@
+"""
+Index benchmarks, run on a synthetic Kythe index so that neither Verible nor real sources are needed.
+
+	python -m benchmarks.run_benchmarks --save-baseline
+	python -m benchmarks.run_benchmarks
+
+Each scenario reports its throughput and its latency percentiles, and the peak memory of the process
+once it is done. The run fails when a result is worse than the stored baseline by more than the
+tolerance, or when a hot query of the index does not use an index.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import typing as T
+
+try :
+	import resource
+except ImportError :
+	resource = None
+
+from backend.sql_index_manager import SQLIndexManager
+from benchmarks.kythe_generator import KytheGenerator
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# Latency changes below this are noise, whatever the tolerance.
+LATENCY_SLACK_MS = 0.05
+
+Results = T.Dict[str,T.Dict[str,float]]
+
+
+def peak_rss_mb() -> T.Optional[float]:
+	if resource is None :
+		return None
+	# Kilobytes on Linux, bytes on macOS.
+	scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def percentile(values : T.List[float], p : float) -> float:
+	ordered = sorted(values)
+	return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def measure(function : T.Callable, calls : T.List[T.Tuple]) -> T.Dict[str,float]:
+	"""
+	Time each call of a function.
+	:param function: Function to benchmark
+	:param calls: Arguments of each call
+	:return: Throughput and latency percentiles
+	"""
+	durations = list()
+	begin = time.perf_counter()
+	for args in calls :
+		start = time.perf_counter()
+		function(*args)
+		durations.append(time.perf_counter() - start)
+	total = time.perf_counter() - begin
+	return {"ops_per_s" : len(calls) / total if total > 0 else 0.0,
+			"p50_ms" : percentile(durations, 50) * 1000,
+			"p99_ms" : percentile(durations, 99) * 1000}
+
+
+def run_benchmarks(generator : KytheGenerator, queries : int, seed : int = 1) -> Results:
+	"""
+	Run all the scenarios.
+	:param generator: Generator of the index to work on
+	:param queries: Number of calls of each query scenario
+	:param seed: Seed of the random choice of the query parameters
+	:return: Results of each scenario
+	"""
+	results : Results = dict()
+	rng = random.Random(seed)
+	with tempfile.TemporaryDirectory() as work_dir :
+		index_path = os.path.join(work_dir, "index.json")
+		with open(index_path, "w") as out :
+			records = generator.write(out)
+
+		index = SQLIndexManager()
+		start = time.perf_counter()
+		index.read_kythe_index(index_path)
+		duration = time.perf_counter() - start
+		results["ingest"] = {"seconds" : duration, "records_per_s" : records / duration}
+		results["ingest"]["peak_rss_mb"] = peak_rss_mb()
+
+	anchors = index.db.execute("SELECT file, start_line, start_char, stop_char FROM anchors").fetchall()
+	anchor_positions = [(a["file"], a["start_line"], rng.randint(a["start_char"], a["stop_char"]))
+						for a in rng.choices(anchors, k=queries)]
+	symbol_ids = [r[0] for r in index.db.execute("SELECT id FROM symbols WHERE declaration_anchor IS NOT NULL")]
+	symbols = [index.get_symbol_by_id(sid) for sid in rng.choices(symbol_ids, k=queries)]
+	modules = [r[0] for r in index.db.execute("SELECT name FROM symbols WHERE type == 'module'")]
+
+	scenarios : T.Dict[str,T.Tuple[T.Callable,T.List[T.Tuple]]] = {
+		"get_anchor_by_position" : (index.get_anchor_by_position, anchor_positions),
+		"get_anchor_at_position" : (index.get_anchor_at_position, anchor_positions),
+		"get_symbol_references" : (index.get_symbol_references, [(s,) for s in symbols]),
+		"get_symbols_by_name" : (index.get_symbols_by_name, [(s.name,) for s in symbols]),
+		"completion" : (index.get_member_names, [(m, f"{m}_s{rng.randrange(10)}") for m in rng.choices(modules, k=queries)]),
+	}
+	for name, (function, calls) in scenarios.items() :
+		results[name] = measure(function, calls)
+		results[name]["peak_rss_mb"] = peak_rss_mb()
+
+	# Each symbol is renamed once, as renames move the anchors.
+	renamed = [index.get_symbol_by_id(sid) for sid in rng.sample(symbol_ids, min(queries, len(symbol_ids)))]
+	results["rename"] = measure(index.rename_symbol, [(s, f"{s.name}_r") for s in renamed])
+	results["rename"]["peak_rss_mb"] = peak_rss_mb()
+
+	plans = index.check_query_plans()
+	if len(plans) > 0 :
+		results["query_plans"] = {"full_scans" : len(plans)}
+		for query, plan in plans.items() :
+			print(f"Query {query} scans a whole table :\n  " + "\n  ".join(plan))
+	return results
+
+
+def is_lower_better(metric : str) -> bool:
+	return not metric.endswith("_per_s")
+
+
+def find_regressions(results : Results, baseline : Results, tolerance : float) -> T.List[str]:
+	"""
+	:param results: Results of the current run
+	:param baseline: Reference results
+	:param tolerance: Relative degradation allowed
+	:return: Description of each result worse than the baseline
+	"""
+	ret = list()
+	for scenario, metrics in results.items() :
+		for metric, value in metrics.items() :
+			reference = baseline.get(scenario, dict()).get(metric)
+			if value is None or reference is None :
+				continue
+			if is_lower_better(metric) :
+				limit = reference * (1 + tolerance)
+				if metric.endswith("_ms") :
+					limit = max(limit, reference + LATENCY_SLACK_MS)
+				failed = value > limit
+			else :
+				failed = value < reference * (1 - tolerance)
+				if metric == "ops_per_s" and value > 0 :
+					failed = failed and 1000 / value - 1000 / reference > LATENCY_SLACK_MS
+			if failed :
+				ret.append(f"{scenario}.{metric} : {value:.4g} (baseline {reference:.4g})")
+	if "query_plans" in results :
+		ret.append(f"{results['query_plans']['full_scans']} hot queries scan a whole table")
+	return ret
+
+
+def print_results(results : Results):
+	for scenario, metrics in results.items() :
+		values = ", ".join(f"{m} {v:.4g}" for m, v in metrics.items() if v is not None)
+		print(f"{scenario:24s} {values}")
+
+
+def process_args():
+	parser = argparse.ArgumentParser(description="Benchmark the index on a synthetic workload")
+	parser.add_argument("--files", type=int, default=50, help="Number of files")
+	parser.add_argument("--lines", type=int, default=400, help="Minimum number of lines per file")
+	parser.add_argument("--symbols", type=int, default=100, help="Number of signals per file")
+	parser.add_argument("--refs", type=int, default=3, help="Number of assignments per signal")
+	parser.add_argument("--depth", type=int, default=4, help="Depth of the design hierarchy")
+	parser.add_argument("--queries", type=int, default=2000, help="Number of calls of each query scenario")
+	parser.add_argument("--seed", type=int, default=1, help="Random seed")
+	parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE, help="Path to the baseline results")
+	parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="Relative degradation allowed against the baseline")
+	parser.add_argument("--output", type=str, default=None, help="Path to write the results to, as JSON")
+	return parser.parse_args()
+
+
+def run():
+	args = process_args()
+	generator = KytheGenerator(args.files, args.lines, args.symbols, args.refs, args.depth, seed=args.seed)
+	results = run_benchmarks(generator, args.queries, args.seed)
+	print_results(results)
+	# Results are only comparable on the same workload.
+	workload = {k : getattr(args,k) for k in ["files", "lines", "symbols", "refs", "depth", "queries", "seed"]}
+
+	if args.output is not None :
+		with open(args.output, "w") as out :
+			json.dump({"workload" : workload, "results" : results}, out, indent=2)
+	if args.save_baseline :
+		with open(args.baseline, "w") as out :
+			json.dump({"workload" : workload, "results" : results}, out, indent=2)
+		print(f"Baseline stored in {args.baseline}")
+		return 0
+	if not os.path.exists(args.baseline) :
+		print(f"No baseline in {args.baseline}, nothing to compare to")
+		return 1 if "query_plans" in results else 0
+
+	with open(args.baseline) as f :
+		baseline = json.load(f)
+	if baseline["workload"] != workload :
+		print(f"The baseline was made on another workload : {baseline['workload']}")
+		return 1
+	regressions = find_regressions(results, baseline["results"], args.tolerance)
+	for r in regressions :
+		print(f"Regression : {r}")
+	return 1 if len(regressions) > 0 else 0
+
+if __name__ == "__main__":
+	sys.exit(run())
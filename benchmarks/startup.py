@@ -0,0 +1,146 @@
+"""
+Startup benchmark : time from the launch of the server to its response to the initialize request,
+and import time of the modules of the server.
+
+	python -m benchmarks.startup
+	python -m benchmarks.startup --budget-ms 50 --import-budget-ms 15
+
+Editors start a new server often, so the run fails when the median time to initialize, or the import time
+of the modules of the server itself, is over its budget. The import time of the dependencies is reported
+but not checked, as it does not depend on this code.
+Most of the time to initialize is spent by pygls importing its LSP models, about 350 ms with pygls 0.12,
+which is out of reach of this code. The budget is thus on the time over a bare pygls server, started the same way.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing as T
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Top level modules and packages of the server.
+OWN_MODULES = ("main", "backend", "frontend")
+# Server doing nothing but answering the initialize request, the lower bound of the time to initialize.
+BARE_SERVER = "from pygls.server import LanguageServer; LanguageServer().start_io()"
+
+
+def encode_message(content : T.Dict[str,T.Any]) -> bytes:
+	body = json.dumps(content).encode("utf-8")
+	return f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body
+
+
+def read_message(stream : T.BinaryIO) -> T.Dict[str,T.Any]:
+	length = None
+	while True :
+		line = stream.readline()
+		if line == b"" :
+			raise EOFError("The server closed its output")
+		line = line.strip()
+		if line == b"" :
+			break
+		name, _, value = line.partition(b":")
+		if name.strip().lower() == b"content-length" :
+			length = int(value)
+	if length is None :
+		raise ValueError("Message without Content-Length")
+	return json.loads(stream.read(length))
+
+
+def time_to_initialize(command : T.List[str], cwd : str) -> float:
+	"""
+	Start a server over stdio, and wait for its response to the initialize request.
+	:param command: Command starting the server
+	:param cwd: Working directory of the server, where it writes its logs
+	:return: Time from the launch to the response, in seconds
+	"""
+	start = time.perf_counter()
+	process = subprocess.Popen(command, cwd=cwd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+	try :
+		process.stdin.write(encode_message({"jsonrpc" : "2.0", "id" : 1, "method" : "initialize",
+											"params" : {"processId" : os.getpid(), "rootUri" : None, "capabilities" : {}}}))
+		process.stdin.flush()
+		while read_message(process.stdout).get("id") != 1 :
+			pass
+		duration = time.perf_counter() - start
+
+		process.stdin.write(encode_message({"jsonrpc" : "2.0", "id" : 2, "method" : "shutdown"}))
+		process.stdin.write(encode_message({"jsonrpc" : "2.0", "method" : "exit"}))
+		process.stdin.flush()
+		process.wait(timeout=5)
+	finally :
+		if process.poll() is None :
+			process.kill()
+			process.wait()
+	return duration
+
+
+def import_times(module : str = "main") -> T.List[T.Tuple[str,float,float]]:
+	"""
+	Import a module in a new interpreter, with the import time of each module it loads.
+	:param module: Module to import
+	:return: Name, own import time and cumulated import time of each module, in seconds
+	"""
+	result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+							cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+	ret = list()
+	for line in result.stderr.splitlines() :
+		if not line.startswith("import time:") or "self [us]" in line :
+			continue
+		own, cumulated, name = line[len("import time:"):].split("|")
+		ret.append((name.strip(), int(own) / 1e6, int(cumulated) / 1e6))
+	return ret
+
+
+def is_own_module(name : str) -> bool:
+	return name.split(".")[0] in OWN_MODULES
+
+
+def process_args():
+	parser = argparse.ArgumentParser(description="Measure the startup time of the server")
+	parser.add_argument("--runs", type=int, default=9, help="Number of launches of each server")
+	parser.add_argument("--budget-ms", type=float, default=50,
+						help="Budget of the median time to initialize over the one of a bare pygls server, in milliseconds")
+	parser.add_argument("--import-budget-ms", type=float, default=15, help="Budget of the import time of the modules of the server, in milliseconds")
+	parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to show")
+	return parser.parse_args()
+
+
+def run():
+	args = process_args()
+	failed = False
+
+	imports = import_times()
+	own = sum(t for name, t, _ in imports if is_own_module(name))
+	total = max((c for _, _, c in imports), default=0.0)
+	print(f"Import of the server : {total * 1000:.1f} ms, {own * 1000:.1f} ms of which in its own modules")
+	for name, t, _ in sorted(imports, key=lambda i : i[1], reverse=True)[:args.top] :
+		print(f"  {t * 1000:7.2f} ms  {name}")
+	if own * 1000 > args.import_budget_ms :
+		print(f"Over budget : the modules of the server take {own * 1000:.1f} ms to import (budget {args.import_budget_ms} ms)")
+		failed = True
+
+	durations = list()
+	bare_durations = list()
+	with tempfile.TemporaryDirectory() as work_dir :
+		# Interleaved, so that both see the same load of the machine.
+		for _ in range(args.runs) :
+			durations.append(time_to_initialize([sys.executable, ROOT], work_dir))
+			bare_durations.append(time_to_initialize([sys.executable, "-c", BARE_SERVER], work_dir))
+	median = statistics.median(durations)
+	overhead = median - statistics.median(bare_durations)
+	print(f"Time to initialize : median {median * 1000:.1f} ms, min {min(durations) * 1000:.1f} ms, max {max(durations) * 1000:.1f} ms")
+	print(f"Bare pygls server : median {statistics.median(bare_durations) * 1000:.1f} ms, "
+		  f"the server takes {overhead * 1000:.1f} ms more")
+	if overhead * 1000 > args.budget_ms :
+		print(f"Over budget : the server takes {overhead * 1000:.1f} ms more than a bare pygls server to initialize "
+			  f"(budget {args.budget_ms} ms)")
+		failed = True
+	return 1 if failed else 0
+
+if __name__ == "__main__":
+	sys.exit(run())
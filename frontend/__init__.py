@@ -1,2 +1,14 @@
-from .indexers.verible_indexer import VeribleIndexer
-from .checkers import VeribleSyntaxChecker
\ No newline at end of file
+import importlib
+
+from .generic_frontend import IndexingError, IndexingCancelled
+
+# Imported on first use : the checkers depend on pygls, which the tools only building an index do not need.
+_LAZY_EXPORTS = {
+	"VeribleIndexer" : ".indexers.verible_indexer",
+	"VeribleSyntaxChecker" : ".checkers",
+}
+
+def __getattr__(name : str):
+	if name in _LAZY_EXPORTS :
+		return getattr(importlib.import_module(_LAZY_EXPORTS[name], __name__), name)
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -8,6 +8,7 @@ class GenericChecker:
 		self.args : T.List[str] = list()
 		self.filelist : T.List[str] = list()
 
+		# Only the files with diagnostics are listed.
 		self.diagnostic_content : T.Dict[str,T.List[Diagnostic]] = dict()
 		self.nberrors : int = 0
 
@@ -15,11 +16,11 @@ class GenericChecker:
 		raise NotImplementedError
 
 	def clear_file(self,uri):
-		if uri in self.diagnostic_content :
-			self.nberrors -= len([d for d in self.diagnostic_content[uri] if d.severity == DiagnosticSeverity.Error])
-			self.diagnostic_content[uri].clear()
+		diagnostics = self.diagnostic_content.pop(uri,None)
+		if diagnostics is not None :
+			self.nberrors -= len([d for d in diagnostics if d.severity == DiagnosticSeverity.Error])
 
 	def clear(self):
-		for uri in self.diagnostic_content :
-			self.clear_file(uri)
+		self.diagnostic_content = dict()
+		self.nberrors = 0
 
@@ -1,12 +1,14 @@
-import tempfile
+import hashlib
 import logging
 import json
+import threading
 import typing as T
 
 from pygls.lsp.types import Position
 from pygls.lsp.types import Diagnostic, Range, DiagnosticSeverity
 from pygls.uris import from_fs_path, to_fs_path
 from subprocess import Popen, PIPE
+from concurrent.futures import ThreadPoolExecutor
 from .generic_checker import GenericChecker
 
 logger = logging.getLogger("myLogger")
@@ -15,43 +17,148 @@ class VeribleSyntaxChecker(GenericChecker):
 	def __init__(self):
 		super().__init__()
 		self.default_args = ["--export_json"]
+		# Number of syntax checker processes run at once.
+		self.workers = 1
+		# Path -> (content hash, diagnostics) of the last check of each file.
+		self._cache : T.Dict[str,T.Tuple[T.Optional[str],T.List[Diagnostic]]] = dict()
+		self._lock = threading.Lock()
+		# Path -> process checking an unsaved content of this file
+		self._content_processes : T.Dict[str,Popen] = dict()
 
 
 	def run(self):
-		self._run(incr=False)
+		self._run(list(self.filelist), incr=False)
 
 	def run_incremental(self,files : T.Optional[T.List[str]] = None):
 		for f in files :
 			if f not in self.filelist :
 				self.filelist.append(f)
-			self.clear_file(from_fs_path(f))
-		self._run(incr=True,force_fset = files)
-
-	def _run(self,incr = False, force_fset : T.Optional[T.List[str]] = None):
-		self.clear()
-		with tempfile.TemporaryDirectory() as work_dir:
-			filelist = self.filelist if force_fset is None else force_fset
+		self._run(files, incr=True)
+
+	def _run(self, files : T.List[str], incr = False):
+		"""
+		Check the given files, only parsing again the ones which changed since their last check.
+		The files to parse are split in up to self.workers chunks, each checked by its own process.
+		:param files: Files to check
+		:param incr: If False, the diagnostics of the files not given are dropped
+		"""
+		# The lock is only held to read and update the results : the checks can take a while,
+		# and the checks of unsaved contents must not wait for them.
+		hashes = {f : self._hash_file(f) for f in files}
+		with self._lock :
+			previous = {f : self._cache.get(f) for f in files}
+		stale = [f for f in files if hashes[f] is None or (previous[f] or (None,))[0] != hashes[f]]
+		logger.info(f"Syntax check of {len(files)} files, {len(stale)} changed")
+
+		chunks = [stale[i::self.workers] for i in range(min(max(1,self.workers), len(stale)))]
+		with ThreadPoolExecutor(max_workers=max(1,len(chunks))) as pool :
+			reports = list(pool.map(self._check_files, chunks))
+
+		with self._lock :
+			for chunk, report in zip(chunks, reports) :
+				# Files of a failed run keep their previous diagnostics.
+				if report is None :
+					continue
+				for f in chunk :
+					# Unless the unsaved content of the file was checked meanwhile, which is more recent.
+					if self._cache.get(f) is previous[f] :
+						self._cache[f] = (hashes[f], report.get(f, list()))
+
+			if not incr :
+				self.clear()
+				self._cache = {f : self._cache[f] for f in files if f in self._cache}
+			for f in files :
+				if f in self._cache :
+					uri = from_fs_path(f)
+					self.clear_file(uri)
+					for d in self._cache[f][1] :
+						self._register_diagnostic(uri, d)
+
+	def check_content(self, path : str, content : str) -> bool:
+		"""
+		Check the unsaved content of a file, given to the checker on its standard input.
+		The result is cached like for files on disk, so the check is not done again once the file is saved.
+		:param path: Path of the file
+		:param content: Content to check
+		:return: False if the check was cancelled or failed, in which case the diagnostics are left unchanged
+		"""
+		content_hash = hashlib.sha1(content.encode("utf-8")).hexdigest()
+		cached = self._cache.get(path)
+		if cached is None or cached[0] != content_hash :
 			command = [self.executable]
 			command.extend(self.default_args)
 			command.extend(self.args)
-			command.extend(filelist)
-
-			logger.info(f"Run syntax checker command {' '.join(command)}")
-
-			process = Popen(command, stdout=PIPE, stderr=PIPE)
-			(data, err) = process.communicate()
-			exit_code = process.wait()
-
-			if exit_code not in (0,1) or err != b"":
-				err_string = f"Error when running the syntax checker. Output code {exit_code}\n{err.decode('ascii')}"
-				for line in err_string.split("\n"):
-					logger.error(line)
-				return
-			if not incr:
-				self.clear()
-			# If no error found, will return 0
-			if exit_code == 1 :
-				self.process_error_report(data.decode('ascii'))
+			command.append("-")
+
+			logger.debug("Run syntax checker on the content of %s", path)
+			with Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE) as process :
+				self._content_processes[path] = process
+				try :
+					(data, err) = process.communicate(content.encode("utf-8"))
+				finally :
+					if self._content_processes.get(path) is process :
+						del self._content_processes[path]
+			if process.returncode < 0 :
+				logger.debug("Syntax check of %s cancelled", path)
+				return False
+			if process.returncode not in (0,1) or err != b"" :
+				logger.error(f"Error when running the syntax checker on {path}. Output code {process.returncode}\n"
+							 f"{err.decode('utf-8', errors='replace')}")
+				return False
+			report = self._parse_error_report(data.decode('utf-8')) if process.returncode == 1 else dict()
+			# Standard input is reported as "-".
+			cached = (content_hash, report.get("-", list()))
+
+		with self._lock :
+			self._cache[path] = cached
+			uri = from_fs_path(path)
+			self.clear_file(uri)
+			for d in cached[1] :
+				self._register_diagnostic(uri, d)
+		return True
+
+	def cancel_content_check(self, path : str):
+		"""
+		Stop the check of the unsaved content of a file, if one is running. Can be called from any thread.
+		"""
+		process = self._content_processes.get(path)
+		if process is not None :
+			process.kill()
+
+	@staticmethod
+	def _hash_file(path : str) -> T.Optional[str]:
+		try :
+			with open(path, "rb") as f :
+				return hashlib.sha1(f.read()).hexdigest()
+		except OSError :
+			return None
+
+	def _check_files(self, files : T.List[str]) -> T.Optional[T.Dict[str,T.List[Diagnostic]]]:
+		"""
+		Run the syntax checker over a set of files.
+		:param files: Files to check
+		:return: Diagnostics by file, or None if the checker failed
+		"""
+		command = [self.executable]
+		command.extend(self.default_args)
+		command.extend(self.args)
+		command.extend(files)
+
+		logger.info(f"Run syntax checker command {' '.join(command)}")
+
+		process = Popen(command, stdout=PIPE, stderr=PIPE)
+		(data, err) = process.communicate()
+		exit_code = process.wait()
+
+		if exit_code not in (0,1) or err != b"":
+			err_string = f"Error when running the syntax checker. Output code {exit_code}\n{err.decode('utf-8', errors='replace')}"
+			for line in err_string.split("\n"):
+				logger.error(line)
+			return None
+		# If no error found, will return 0
+		if exit_code == 1 :
+			return self._parse_error_report(data.decode('utf-8'))
+		return dict()
 
 	def _register_diagnostic(self, uri : str, d : Diagnostic):
 		if d.severity == DiagnosticSeverity.Error :
@@ -61,23 +168,35 @@ class VeribleSyntaxChecker(GenericChecker):
 		self.diagnostic_content[uri].append(d)
 
 	def process_error_report(self, jscontent : str):
+		for file, diagnostics in self._parse_error_report(jscontent).items() :
+			uri = from_fs_path(file)
+			for diagnostic in diagnostics :
+				logger.info(f"Register error {uri}:{diagnostic.range.start.line}")
+				self._register_diagnostic(uri, diagnostic)
+
+	@staticmethod
+	def _parse_error_report(jscontent : str) -> T.Dict[str,T.List[Diagnostic]]:
+		"""
+		:param jscontent: JSON output of the syntax checker
+		:return: Diagnostics by file path, as given to the checker
+		"""
+		ret : T.Dict[str,T.List[Diagnostic]] = dict()
 		data = json.loads(jscontent)
 		for file, content in data.items():
-			uri = from_fs_path(file)
 			if content is None :
 				continue
+			diagnostics = ret.setdefault(file, list())
 			for severity_label, record_list in content.items():
 				severity = DiagnosticSeverity.Error
 				# To change if we have something else than error
 				for r in record_list:
 					position = Position(line=r["line"], character=r["column"])
-					diagnostic = Diagnostic(range=Range(start=position, end=position),
-											message=f"Parse error : rejected token '{r['text']}'",
-											source="Verible Syntax",
-											code="syntax-error",
-											severity=severity)
-					logger.info(f"Register error {uri}:{r['line']}")
-					self._register_diagnostic(uri, diagnostic)
+					diagnostics.append(Diagnostic(range=Range(start=position, end=position),
+												  message=f"Parse error : rejected token '{r['text']}'",
+												  source="Verible Syntax",
+												  code="syntax-error",
+												  severity=severity))
+		return ret
 
 	def read_error_file(self,path : str):
 		with open(path,"r") as jsfile :
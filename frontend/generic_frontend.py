@@ -2,6 +2,18 @@ import typing as T
 from enum import Flag
 
 
+class IndexingError(Exception):
+	"""
+	Raised when the index could not be built.
+	"""
+	pass
+
+class IndexingCancelled(IndexingError):
+	"""
+	Raised when the index build was cancelled before completion.
+	"""
+	pass
+
 class Capabilities(Flag) :
 	VALIDATOR = 0
 	LINT = 1
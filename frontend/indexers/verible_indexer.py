@@ -2,42 +2,274 @@ import base64
 import json
 import typing as T
 
+from contextlib import contextmanager
 from subprocess import Popen, PIPE
+from concurrent.futures import ThreadPoolExecutor
 import tempfile
+import threading
+import re
 import gc
+import sqlite3
 import time
-import toml
 
 import os
 import logging
 
 # bfrom vunit.ui import VUnit
 
-from backend.sql_index_manager import SQLIndexManager
+from backend.sql_index_manager import SQLIndexManager, SQLFile
+from backend.instrumentation import metrics
+from frontend.generic_frontend import IndexingError, IndexingCancelled
 
 logger = logging.getLogger("myLogger")
 
 class VeribleIndexer :
+	PACKAGE_PATTERN = re.compile(r"^\s*package\s+\w+", re.MULTILINE)
+	# Design units which other files may instantiate or reference.
+	DESIGN_UNIT_PATTERN = re.compile(r"^\s*(?:module|macromodule|interface|program|checker|primitive|(?:virtual\s+)?class)"
+									 r"\s+(?:(?:automatic|static)\s+)?(\w+)", re.MULTILINE)
+	IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_]\w*")
+	SHARED_EXTENSIONS = [".svh", ".vh"]
+
 	def __init__(self, workspace_root):
 		self.workspace_root = workspace_root
 		self.command_path = "verible-verilog-kythe-extractor"
-		self.index = SQLIndexManager()
+		# Created on first use, as a persistent index usually replaces the in-memory one.
+		self._index : T.Optional[SQLIndexManager] = None
 		self.filelist : T.List[str] = list()
 		self.exec_root = ""
+		self.stream_index = True
+		self.workers = 1
+		self._shared_files_cache : T.Dict[str,T.Tuple[float,bool]] = dict()
+		# Each build is done on a separate snapshot which then replaces the index,
+		# so that queries never see a partially built index.
+		self.generation = 0
+		# Bumped whenever the index is replaced by one not derived from it, which lacks the changes made in place.
+		self.lineage = 0
+		self.persistent_path : T.Optional[str] = None
+		self._build_lock = threading.Lock()
+		self._swap_lock = threading.Lock()
+		# Extractors currently running, killed on cancellation.
+		self._processes : T.Set[Popen] = set()
+		self._process_lock = threading.Lock()
+		self._cancelled = threading.Event()
+
+	@property
+	def index(self) -> SQLIndexManager:
+		"""
+		Current index, an empty in-memory one until an index is opened or built.
+		"""
+		index = self._index
+		if index is None :
+			with self._swap_lock :
+				if self._index is None :
+					self._index = SQLIndexManager()
+				index = self._index
+		return index
+
+	@index.setter
+	def index(self, index : SQLIndexManager):
+		self._index = index
+
+	def cancel(self):
+		"""
+		Stop the index build in progress, if any. The build then raises IndexingCancelled
+		and the current index is kept as it is. The next builds are cancelled as well, until reset_cancel is called.
+		Can be called from any thread.
+		"""
+		with self._process_lock :
+			self._cancelled.set()
+			for process in self._processes :
+				process.kill()
+
+	@property
+	def is_building(self) -> bool:
+		"""
+		True while the index is being built or updated, and a persistent one is locked for writing.
+		"""
+		return self._build_lock.locked()
+
+	def reset_cancel(self):
+		"""
+		Forget the previous cancellations, before a new build. The builds do not do it themselves,
+		as a cancellation requested before a build starts has to be kept.
+		Can be called from any thread.
+		"""
+		with self._process_lock :
+			self._cancelled.clear()
+
+	def _check_cancelled(self):
+		if self._cancelled.is_set() :
+			raise IndexingCancelled("Index build cancelled")
+
+	def _register_process(self, process : Popen, running : bool = True):
+		with self._process_lock :
+			if not running :
+				self._processes.discard(process)
+				return
+			if self._cancelled.is_set() :
+				process.kill()
+			self._processes.add(process)
+
+	def open_index(self, db_path : str):
+		"""
+		Use a persistent index stored at the given path instead of the in-memory one.
+		The index is then kept across runs and only updated for the files which changed.
+		Snapshots are stored next to it, with their generation number added to the name.
+		:param db_path: Path to the SQLite database
+		"""
+		if self.persistent_path == db_path :
+			return
+		with self._build_lock :
+			self.persistent_path = db_path
+			generations = self._get_snapshot_generations()
+			generation = max(generations, default=0)
+			# Leftovers from an interrupted build or from snapshots still in use on exit.
+			for g in generations :
+				if g != generation :
+					self._remove_snapshot_files(g)
+			logger.info(f"Open persistent index {self._snapshot_path(generation)}")
+			self.index = SQLIndexManager(self._snapshot_path(generation))
+			self.index.generation = generation
+			self.generation = generation
+			self.lineage += 1
+
+	def open_artifact(self, path : str):
+		"""
+		Use a prebuilt index artifact, made by gen_sql.py, as the index. It is opened read-only and never modified :
+		a private copy of it is used instead once the index has to change.
+		:param path: Path to the artifact
+		"""
+		with self._build_lock :
+			logger.info(f"Open index artifact {path}")
+			try :
+				artifact = SQLIndexManager(path, read_only=True)
+			except sqlite3.DatabaseError as e :
+				raise IndexingError(f"Unable to open the index artifact {path} : {e}") from e
+			self._swap_snapshot(artifact)
+
+	@contextmanager
+	def private_index(self) -> T.Iterator[SQLIndexManager]:
+		"""
+		Hold the current index to modify it in place : no build can replace it until the block is left,
+		which would drop the changes. A read-only artifact is first replaced by a private copy.
+		:return: The current index
+		"""
+		with self._build_lock :
+			if self.index.read_only :
+				logger.info("Copy the index artifact to modify it")
+				# Not a build : cancelling the indexing jobs does not apply to it.
+				self._swap_snapshot(self._new_snapshot(copy_current=True), derived=True)
+			yield self.index
+
+	def _snapshot_path(self, generation : int) -> str:
+		base, ext = os.path.splitext(self.persistent_path)
+		return f"{base}.{generation}{ext}"
+
+	def _get_snapshot_generations(self) -> T.List[int]:
+		base, ext = os.path.splitext(os.path.basename(self.persistent_path))
+		pattern = re.compile(rf"^{re.escape(base)}\.(\d+){re.escape(ext)}$")
+		directory = os.path.dirname(self.persistent_path) or "."
+		if not os.path.isdir(directory) :
+			return []
+		return [int(m.group(1)) for m in map(pattern.match, os.listdir(directory)) if m is not None]
+
+	def _remove_snapshot_files(self, generation : int):
+		for suffix in ["", "-wal", "-shm"] :
+			try :
+				os.remove(f"{self._snapshot_path(generation)}{suffix}")
+			except OSError :
+				pass
+
+	@metrics.timed("indexing", "new_snapshot")
+	def _new_snapshot(self, copy_current : bool) -> SQLIndexManager:
+		"""
+		Create the index to build the next generation into.
+		:param copy_current: Start from a copy of the current index instead of an empty one
+		:return: The new index, not yet in use
+		"""
+		if self.persistent_path is None :
+			path = ":memory:"
+		else :
+			path = self._snapshot_path(self.generation + 1)
+			self._remove_snapshot_files(self.generation + 1)
+		return self.index.clone(path) if copy_current else SQLIndexManager(path)
+
+	@metrics.timed("indexing", "swap_snapshot")
+	def _swap_snapshot(self, snapshot : SQLIndexManager, derived : bool = False):
+		"""
+		Make a fully built snapshot the current index.
+		The previous index is left untouched for the queries still using it, and released with them.
+		:param snapshot: Index returned by _new_snapshot
+		:param derived: The snapshot started from a copy of the current index
+		"""
+		with self._swap_lock :
+			previous = self._index
+			snapshot.generation = self.generation + 1
+			self._index = snapshot
+			self.generation += 1
+			if not derived :
+				self.lineage += 1
+		if previous is not None :
+			previous.discard_on_close = True
+		logger.info(f"Switched to index generation {self.generation}")
+
+	def _build_snapshot(self, build : T.Callable[[SQLIndexManager],None], copy_current : bool):
+		"""
+		Build a new snapshot and make it the current index once done.
+		The snapshot is dropped if the build fails or is cancelled.
+		A persistent index is updated in place instead of copied, see _update_in_place.
+		:param build: Function filling the snapshot given as argument
+		:param copy_current: Start from a copy of the current index instead of an empty one
+		"""
+		if copy_current and self.index.is_persistent and not self.index.read_only :
+			self._update_in_place(build)
+			return
+		snapshot = self._new_snapshot(copy_current)
+		try :
+			build(snapshot)
+			self._check_cancelled()
+		except BaseException :
+			snapshot.discard_on_close = True
+			raise
+		self._swap_snapshot(snapshot, derived=copy_current)
+
+	@metrics.timed("indexing", "update_in_place")
+	def _update_in_place(self, build : T.Callable[[SQLIndexManager],None]):
+		"""
+		Apply a change to the persistent index in a single transaction, through a connection of its own.
+		Queries keep reading the previous state of the database until the transaction is committed,
+		after which the index counts as a new generation, its file keeping the generation it was created at.
+		Nothing is changed if the build fails or is cancelled.
+		:param build: Function changing the index given as argument
+		"""
+		index = self.index
+		writer = SQLIndexManager(index.db_path)
+		with writer.transaction() :
+			build(writer)
+			self._check_cancelled()
+		index.reload()
+		with self._swap_lock :
+			self.generation += 1
+			index.generation = self.generation
+		logger.info(f"Switched to index generation {self.generation}")
 
 	def clear(self):
 		self.index.clear()
 		#super().clear()
 		self.filelist.clear()
 
-	def dump_file_list(self, path):
+	def dump_file_list(self, path, files : T.Optional[T.List[str]] = None):
+		files = self.filelist if files is None else files
 		with open(path,"w") as file_handler :
-			logger.debug(self.filelist)
-			file_handler.write("\n".join(self.filelist))
+			logger.debug(files)
+			file_handler.write("\n".join(files))
 
 	def read_file_list(self,path):
 		if os.path.splitext(path)[1] == ".toml" :
 			logger.info(f"Reading TOML file {path}")
+			# Only needed for this file list format, so not loaded at startup.
+			import toml
 			toml_content = toml.load(path)
 			flist = toml_content["libraries"]["lib"]["files"]
 			valid_extension = [".sv",".v",".svh"]
@@ -60,23 +292,25 @@ class VeribleIndexer :
 				ret.append(os.path.join(self.workspace_root,p))
 		return ret
 
+	def _extractor_command(self, filelist_path : str, kind : str = "json") -> T.List[str]:
+		return [self.exec_root + self.command_path,
+				"--file_list_root",
+				"/",
+				# self.workspace_root,
+				"--print_kythe_facts",
+				kind,
+				"--include_dir_paths",
+				",".join(self.incdir_list),
+				"--file_list_path",
+				filelist_path]
+
 	def dump_json_index(self, path, kind = "json_debug"):
 		data = None
 		with tempfile.TemporaryDirectory() as work_dir:
 			filelist = f"{work_dir}/files.fls"
 			self.dump_file_list(filelist)
-			incdir_list = ",".join(self.incdir_list)
-
-			command = [self.exec_root + self.command_path,
-					   "--file_list_root",
-					   "/",
-					   # self.workspace_root,
-					   "--print_kythe_facts",
-					   kind,
-					   "--include_dir_paths",
-					   incdir_list,
-					   "--file_list_path",
-					   filelist]
+
+			command = self._extractor_command(filelist, kind)
 			logger.info(f"Run indexer command {' '.join(command)}")
 			index_path = path
 			with open(index_path, "w") as index_file:
@@ -91,43 +325,310 @@ class VeribleIndexer :
 					logger.error(line)
 				return
 
+	@property
+	def resolved_filelist(self) -> T.List[str]:
+		return [os.path.normpath(self._resolve_path(f.strip())) for f in self.filelist if f.strip() != ""]
+
 	def run_indexer(self):
+		with self._build_lock :
+			self._run_indexer()
+
+	@metrics.timed("indexing", "run_indexer")
+	def _run_indexer(self):
+		if self.index.is_persistent and not self.index.is_empty :
+			self._refresh_index()
+			return
+		if self.workers > 1 or self.stream_index :
+			files = self.resolved_filelist
+			self._build_snapshot(lambda snapshot : self._extract_into_index(snapshot, files), copy_current=False)
+			return
+
 		data = None
 		with tempfile.TemporaryDirectory() as work_dir :
 			filelist = f"{work_dir}/files.fls"
 			self.dump_file_list(filelist)
-			incdir_list = ",".join(self.incdir_list)
-
-			command = [self.exec_root+self.command_path,
-							 "--file_list_root",
-							 "/",
-							 #self.workspace_root,
-							 "--print_kythe_facts",
-							 "json",
-					        "--include_dir_paths",
-					        incdir_list,
-							 "--file_list_path",
-							 filelist]
+
+			command = self._extractor_command(filelist)
 			logger.info(f"Run indexer command {' '.join(command)}")
 			index_path = f"{work_dir}/index.json"
 			with open(index_path,"w") as index_file :
 				process = Popen(command, stdout=index_file, stderr=PIPE)
-				(t,err) = process.communicate()
-
-				exit_code = process.wait()
+				self._register_process(process)
+				try :
+					(t,err) = process.communicate()
+					exit_code = process.wait()
+				finally :
+					self._register_process(process, running=False)
 
+			self._check_cancelled()
 			if exit_code != 0 or err != b"":
 				err_string = f"Error when running the indexer. Output code {exit_code}\n{err.decode('ascii')}"
 				for line in err_string.split("\n") :
 					logger.error(line)
 				return
 
-			self.clear()
-			self.read_index_file(index_path)
+			self._read_index_file(index_path)
+
+	def refresh_index(self):
+		"""
+		Bring an existing index up to date with the file list, only reindexing the files which changed
+		since they were indexed, were added or were removed.
+		"""
+		with self._build_lock :
+			self._refresh_index()
+
+	@metrics.timed("indexing", "refresh_index")
+	def _refresh_index(self):
+		indexed = self.index.get_files_metadata()
+		current = self.resolved_filelist
+		outdated = set(self._get_orphan_files(indexed.keys()))
+		outdated.update(f for f in indexed if self._is_outdated(f,indexed[f]))
+		outdated.update(f for f in current if f not in indexed)
+		logger.info(f"Index refresh : {len(outdated)} outdated files out of {len(current)}")
+		if len(outdated) > 0 :
+			self._reindex_files(outdated)
+
+	def _get_orphan_files(self, paths : T.Iterable[str]) -> T.List[str]:
+		"""
+		Among the given files, list the ones which should not be in the index anymore :
+		the files neither in the file list nor included, and the deleted files.
+		"""
+		files = set(self.resolved_filelist)
+		included = self.index.get_included_names()
+		return [p for p in paths if not os.path.exists(p) or (p not in files and os.path.basename(p) not in included)]
+
+	def _is_outdated(self, path : str, metadata : T.Optional[T.Tuple[int,T.Optional[str],T.Optional[float]]]) -> bool:
+		if metadata is None :
+			return True
+		_, indexed_hash, indexed_mtime = metadata
+		try :
+			if indexed_mtime is not None and os.path.getmtime(path) == indexed_mtime :
+				return False
+			with open(path,"rb") as f :
+				return SQLFile.hash_content(f.read()) != indexed_hash
+		except OSError :
+			return True
+
+	def reindex_files(self, paths : T.Iterable[str]):
+		"""
+		Update the index for the given files only, leaving the rest of the index untouched.
+		Files including the given files are reindexed as well.
+		Files which are not in the file list anymore are only removed.
+		:param paths: Files to reindex
+		"""
+		with self._build_lock :
+			self._reindex_files(paths)
+
+	@metrics.timed("indexing", "reindex_files")
+	def _reindex_files(self, paths : T.Iterable[str]):
+		paths = {os.path.normpath(self._resolve_path(p)) for p in paths}
+		paths.update(self.index.get_including_files(paths))
+		files = self.resolved_filelist
+		to_extract = [f for f in files if f in paths]
+		removed = self._get_orphan_files(paths)
+		# Files declaring what the reindexed files were referencing are needed to resolve those references again.
+		context = set(self.index.get_referenced_files(paths))
+
+		logger.info(f"Reindex {len(to_extract)} files, remove {len(removed)} files")
+		detached = [p for p in paths if p not in removed]
+		# Shared and context files are given to the extractor for symbols resolution, but are not loaded again.
+		extracted = [f for f in files if f in paths or f in context or self.is_shared_file(f)] if len(to_extract) > 0 else []
+
+		def build(snapshot : SQLIndexManager):
+			snapshot.remove_files(removed)
+			snapshot.detach_files(detached)
+			if len(extracted) > 0 :
+				self._extract_into_index(snapshot, extracted)
+			snapshot.purge_unbound_symbols(detached)
+
+		self._build_snapshot(build, copy_current=True)
+
+	def _extract_into_index(self, index : SQLIndexManager, files : T.List[str]):
+		"""
+		Run the extractor over the given files and load the result in the index, on top of its current content.
+		The file list is split in up to self.workers shards, each handled by its own extractor.
+		Files depending on each other are kept in the same shard, see split_shards.
+		All outputs are merged in a single bulk load, which deduplicates the nodes emitted by
+		several shards (shared headers and packages).
+		Raise IndexingError if any extractor fails, in which case nothing is loaded.
+		:param index: Index to load into
+		:param files: Files to extract, in dependency order
+		"""
+		shards = self.split_shards(self.workers, files)
+		logger.info(f"Run indexer over {len(shards)} shards with {self.workers} workers")
+		with tempfile.TemporaryDirectory() as work_dir :
+			filelists = list()
+			for i, shard in enumerate(shards) :
+				filelists.append(f"{work_dir}/files_{i}.fls")
+				self.dump_file_list(filelists[-1],shard)
+
+			# Read before the extractors read the files, so that a file saved meanwhile is seen as outdated.
+			mtimes = {f : os.path.getmtime(f) for f in files if os.path.exists(f)}
+			index.begin_bulk_load(mtimes)
+			try :
+				logger.info(f"Processing index...")
+				# Leaving the pool waits for every shard, so no extractor is left running on failure.
+				with metrics.timer("indexing", "extract"), ThreadPoolExecutor(max_workers=max(1,self.workers)) as pool :
+					results = [pool.submit(self._stream_extractor, index, path) for path in filelists]
+				for r in results :
+					r.result()
+			except Exception :
+				index.abort_bulk_load()
+				raise
+			index.end_bulk_load()
+			logger.info(f"    Done.")
+
+	def _stream_extractor(self, index : SQLIndexManager, filelist_path : str):
+		"""
+		Run the extractor over a file list and feed its output to the index as it is produced.
+		Can be called from several threads at once on the same index.
+		Raise IndexingError if the extractor fails.
+		:param index: Index to load into
+		:param filelist_path: Path to the file list to give to the extractor
+		"""
+		command = self._extractor_command(filelist_path)
+		logger.info(f"Run streamed indexer command {' '.join(command)}")
+		with Popen(command, stdout=PIPE, stderr=PIPE, encoding="utf-8") as process :
+			self._register_process(process)
+			# Stderr is drained on the side so that the extractor never blocks on a full pipe.
+			err_output : T.List[str] = list()
+			err_reader = threading.Thread(target=lambda: err_output.append(process.stderr.read()), daemon=True)
+			err_reader.start()
+			try :
+				index.read_kythe_stream(process.stdout)
+			except Exception :
+				process.kill()
+				# A killed extractor may leave a truncated record behind.
+				self._check_cancelled()
+				raise
+			finally :
+				exit_code = process.wait()
+				err_reader.join()
+				self._register_process(process, running=False)
+
+		self._check_cancelled()
+		err = "".join(err_output)
+		if exit_code != 0 or err != "":
+			err_string = f"Error when running the indexer. Output code {exit_code}\n{err}"
+			for line in err_string.split("\n") :
+				logger.error(line)
+			raise IndexingError(f"Indexer exited with code {exit_code}")
+
+	def _resolve_path(self, path : str) -> str:
+		if os.path.isabs(path) or self.workspace_root is None :
+			return path
+		return os.path.join(self.workspace_root,path)
+
+	def is_shared_file(self, path : str) -> bool:
+		"""
+		Tell if a file is needed by every compilation unit, which is the case of headers and packages.
+		The result is cached until the file is modified.
+		:param path: Path to the file, as written in the file list
+		"""
+		if os.path.splitext(path)[1].lower() in self.SHARED_EXTENSIONS :
+			return True
+		path = self._resolve_path(path)
+		try :
+			mtime = os.path.getmtime(path)
+			if path in self._shared_files_cache and self._shared_files_cache[path][0] == mtime :
+				return self._shared_files_cache[path][1]
+			with open(path, "r", errors="replace") as f :
+				shared = self.PACKAGE_PATTERN.search(f.read()) is not None
+			self._shared_files_cache[path] = (mtime,shared)
+			return shared
+		except OSError :
+			return False
+
+	def split_shards(self, count : int, files : T.Optional[T.List[str]] = None) -> T.List[T.List[str]]:
+		"""
+		Split a file list in at most count file lists which can be extracted independently.
+		Shared files are put, in order, at the beginning of every shard.
+		An extractor only resolves the references to what is declared in its own file list, so the files
+		using the design units (modules, interfaces, classes...) declared by each other are kept in the same shard.
+		These groups are then spread in shards of similar size, each shard keeping the declaration order.
+		:param count: Maximum number of shards
+		:param files: File list to split, defaults to the indexer file list
+		:return: List of file lists
+		"""
+		files = [f.strip() for f in (self.filelist if files is None else files) if f.strip() != ""]
+		if count <= 1 :
+			return [files]
+		shared = [f for f in files if self.is_shared_file(f)]
+		units = [f for f in files if f not in shared]
+		if len(units) == 0 :
+			return [shared]
+
+		groups = self._dependency_groups(units)
+		count = max(1,min(count,len(groups)))
+		sizes = list()
+		for group in groups :
+			size = 0
+			for f in group :
+				try :
+					size += os.path.getsize(self._resolve_path(f))
+				except OSError :
+					pass
+			sizes.append(size)
+		shard_size = sum(sizes) / count
+
+		shards : T.List[T.List[str]] = [list()]
+		accumulated = 0
+		for group, size in zip(groups,sizes) :
+			if len(shards[-1]) > 0 and accumulated + size / 2 > shard_size * len(shards) and len(shards) < count :
+				shards.append(list())
+			shards[-1].extend(group)
+			accumulated += size
+		order = {f : i for i, f in enumerate(units)}
+		return [shared + sorted(shard, key=order.get) for shard in shards]
+
+	def _dependency_groups(self, files : T.List[str]) -> T.List[T.List[str]]:
+		"""
+		Group the files using the design units declared by each other, directly or not.
+		Any identifier named after a design unit of another file counts as a use, which may group more files than needed
+		but never splits an instantiation from the instantiated module.
+		:param files: Files to group
+		:return: Groups, in the order of their first file, each keeping the order of the files
+		"""
+		identifiers : T.List[T.Set[str]] = list()
+		declaring : T.Dict[str,int] = dict()
+		for i, f in enumerate(files) :
+			try :
+				with open(self._resolve_path(f), "r", errors="replace") as source :
+					content = source.read()
+			except OSError :
+				content = ""
+			identifiers.append(set(self.IDENTIFIER_PATTERN.findall(content)))
+			for name in self.DESIGN_UNIT_PATTERN.findall(content) :
+				declaring.setdefault(name, i)
+
+		# Union-find of the files, each group being named after its first file.
+		roots = list(range(len(files)))
+
+		def find(i : int) -> int:
+			while roots[i] != i :
+				roots[i] = roots[roots[i]]
+				i = roots[i]
+			return i
+
+		for i, names in enumerate(identifiers) :
+			for name in names & declaring.keys() :
+				a, b = find(i), find(declaring[name])
+				if a != b :
+					roots[max(a,b)] = min(a,b)
+
+		groups : T.Dict[int,T.List[str]] = dict()
+		for i, f in enumerate(files) :
+			groups.setdefault(find(i), list()).append(f)
+		return list(groups.values())
 
 	def read_index_file(self, index_path):
+		with self._build_lock :
+			self._read_index_file(index_path)
+
+	@metrics.timed("indexing", "read_index_file")
+	def _read_index_file(self, index_path):
 		logger.info(f"Processing index...")
-		self.index.read_kythe_index(index_path)
+		self._build_snapshot(lambda snapshot : snapshot.read_kythe_index(index_path), copy_current=False)
 		logger.info(f"    Done.")
 
 
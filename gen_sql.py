@@ -1,18 +1,58 @@
-from frontend import VeribleIndexer
+"""
+Build a prebuilt index artifact : a standalone SQLite database, opened read-only by the servers
+configured with usePrebuiltIndex and an indexFilePath pointing to it.
+
+	python gen_sql.py --input index.json --output index.db
+	python gen_sql.py --file-list files.fls --verible-root /opt/verible/bin --output index.db
+"""
+
 import argparse
+import os
+import sys
+
+from backend.sql_index_manager import SQLIndexManager
+from frontend.generic_frontend import IndexingError
 
 def process_args():
-	parser = argparse.ArgumentParser()
-	parser.add_argument("--input",type=str, help="json file to process")
-	parser.add_argument("--output",type=str, help="path to sql output", default=":memory:")
+	parser = argparse.ArgumentParser(description="Build a prebuilt index artifact")
+	source = parser.add_mutually_exclusive_group(required=True)
+	source.add_argument("--input",type=str, help="Kythe JSON index to load")
+	source.add_argument("--file-list",type=str, help="File list to run the extractor on")
+	parser.add_argument("--verible-root",type=str, default="", help="Directory of the Verible executables, for --file-list")
+	parser.add_argument("--workers",type=int, default=1, help="Number of extractors run in parallel, for --file-list")
+	parser.add_argument("--output",type=str, help="Path to the artifact", default="index.db")
 	return parser.parse_args()
 
 
+def build_index(args) -> SQLIndexManager:
+	if args.input is not None :
+		index = SQLIndexManager()
+		index.read_kythe_index(args.input)
+		return index
+
+	# Only needed to run the extractor.
+	from frontend.indexers.verible_indexer import VeribleIndexer
+	indexer = VeribleIndexer(os.path.dirname(os.path.abspath(args.file_list)))
+	indexer.exec_root = os.path.join(os.path.expanduser(args.verible_root), "") if args.verible_root != "" else ""
+	indexer.workers = args.workers if args.workers > 0 else os.cpu_count()
+	indexer.read_file_list(args.file_list)
+	indexer.run_indexer()
+	return indexer.index
+
+
 def run():
 	args = process_args()
-	indexer = VeribleIndexer(args.output)
-	indexer.tree.sql_clear()
-	indexer.read_index_file(args.input)
+	try :
+		index = build_index(args)
+	except IndexingError as e :
+		print(f"Indexing failed : {e}")
+		return 1
+	if index.is_empty :
+		print("Nothing was indexed")
+		return 1
+	index.export_artifact(args.output)
+	print(f"Index of {len(index.get_files_metadata())} files written to {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+	return 0
 
 if __name__ == "__main__":
-	run()
+	sys.exit(run())
@@ -18,19 +18,26 @@ import logging
 import os
 import typing as T
 from backend.language_server import DiplomatLanguageServer
-from pygls.lsp.methods import (TEXT_DOCUMENT_DID_OPEN,
+from pygls import uris
+from pygls.lsp.methods import (TEXT_DOCUMENT_DID_OPEN, TEXT_DOCUMENT_DID_CHANGE,
 							   TEXT_DOCUMENT_DID_CLOSE, TEXT_DOCUMENT_DID_SAVE, REFERENCES, DEFINITION,
 							   WORKSPACE_DID_CHANGE_CONFIGURATION, INITIALIZED, PREPARE_RENAME, RENAME,
-							   COMPLETION)
-from pygls.lsp.types import (DidOpenTextDocumentParams,
+							   COMPLETION, WORKSPACE_SYMBOL,
+							   TEXT_DOCUMENT_CALL_HIERARCHY_PREPARE, TEXT_DOCUMENT_CALL_HIERARCHY_INCOMING_CALLS,
+							   TEXT_DOCUMENT_CALL_HIERARCHY_OUTGOING_CALLS)
+from pygls.lsp.types import (DidOpenTextDocumentParams, DidChangeTextDocumentParams,
 							 ReferenceParams,
 							 DidCloseTextDocumentParams,
 							 Range, Location, DeclarationParams, DidSaveTextDocumentParams, InitializedParams,
 							 PrepareRenameParams, RenameParams,
-							 TextEdit, WorkspaceEdit,
-							 CompletionList, CompletionParams, Position, CompletionItem)
+							 WorkspaceEdit,
+							 CompletionList, CompletionParams, Position, CompletionItem,
+							 WorkspaceSymbolParams, SymbolInformation,
+							 CallHierarchyPrepareParams, CallHierarchyIncomingCallsParams, CallHierarchyOutgoingCallsParams,
+							 CallHierarchyItem, CallHierarchyIncomingCall, CallHierarchyOutgoingCall)
 
 from backend.sql_index_manager import SQLAnchor
+from backend.instrumentation import metrics, profiler
 
 from frontend import IndexingError
 logger = logging.getLogger("myLogger")
@@ -61,14 +68,14 @@ def on_initialized(ls : DiplomatLanguageServer,params : InitializedParams) :
 @diplomat_server.thread()
 @diplomat_server.feature(PREPARE_RENAME)
 def prepare_rename(ls : DiplomatLanguageServer, params : PrepareRenameParams) -> Range:
-	if not ls.indexed :
-		reindex_all(ls)
+	ensure_indexed(ls)
+	index = ls.svindexer.index
 	selected_loc = Location(uri=params.text_document.uri,range=Range(start=params.position, end= params.position))
-	symbol = ls.get_symbol_from_location(selected_loc)
+	symbol = ls.get_symbol_from_location(selected_loc, index)
 	if symbol is None :
 		return None
 	else:
-		return ls.anchor_to_location(symbol.declaration_anchor).range
+		return ls.anchor_to_location(symbol.declaration_anchor, index).range
 
 @diplomat_server.thread()
 @diplomat_server.feature(RENAME)
@@ -85,37 +92,15 @@ def perform_rename(ls : DiplomatLanguageServer, params : RenameParams) -> Worksp
 		return None
 
 	selected_loc = Location(uri=params.text_document.uri, range=Range(start=params.position, end=params.position))
-	symbol = ls.get_symbol_from_location(selected_loc)
-
-	delta_name_len = len(new_name) - len(symbol.name)
-
-	anchor_list = [symbol.declaration_anchor]
-	anchor_list.extend(ls.svindexer.index.get_symbol_references(symbol))
-
-	# Client-side preparation
-	locations_list : T.List[Location] = [ls.anchor_to_location(a) for a in anchor_list]
-	files_list = {l.uri for l in locations_list}
-
-	edits = dict()
-	for f_uri in files_list :
-		edits[f_uri] = [TextEdit(range=x.range,new_text=new_name) for x in locations_list if x.uri == f_uri]
-
-	ret = WorkspaceEdit(changes=edits)
-
-	# Server-side, SQL db update
-	# This will change the anchor objects, all action taken on original anchor location shall be done before.
-	files_id = {x.file for x in anchor_list}
-	for fid in files_id :
-		per_file_anchor_list = {x.start_line : sorted([j for j in anchor_list if j.file == fid and j.start_line == x.start_line],key=lambda x : x.start_char) for x in anchor_list if x.file == fid}
-		alist : T.List[SQLAnchor]
-		for line, alist in per_file_anchor_list.items():
-			for i in range(len(alist)) :
-				alist[i].start_char += i * delta_name_len
-				alist[i].end_char += (i+1) * delta_name_len
-
-	ls.svindexer.index.bulk_update_anchors(anchor_list)
-
-	logger.debug(f"Reply for edit : {ret}")
+	# The index is renamed along with the sources, so that it matches them without a reindexing.
+	# It is held meanwhile, so that no build replaces it with one lacking the rename.
+	with ls.svindexer.private_index() as index :
+		symbol = ls.get_symbol_from_location(selected_loc, index)
+		if symbol is None :
+			return None
+		ret = ls.rename_symbol(symbol, new_name, index)
+
+	logger.debug("Reply for edit : %s", ret)
 	return ret
 
 
@@ -123,53 +108,112 @@ def perform_rename(ls : DiplomatLanguageServer, params : RenameParams) -> Worksp
 @diplomat_server.thread()
 @diplomat_server.feature(DEFINITION)
 def definition(ls : DiplomatLanguageServer, params : DeclarationParams) -> Location :
-	if not ls.indexed :
-		reindex_all(ls)
+	ensure_indexed(ls)
 
+	index = ls.svindexer.index
 	selected_loc = Location(uri=params.text_document.uri,range=Range(start=params.position, end= params.position))
-	symbol = ls.get_symbol_from_location(selected_loc)
-	if symbol is None :
-		logger.info("Symbol not found")
-		return None
 
-	anchor = symbol.declaration_anchor
-	ret = ls.anchor_to_location(anchor)
-	return ret
+	def compute() -> T.Optional[Location] :
+		symbol = ls.get_symbol_from_location(selected_loc, index)
+		if symbol is None :
+			logger.info("Symbol not found")
+			return None
+		anchor = symbol.declaration_anchor
+		return ls.anchor_to_location(anchor, index)
+
+	return ls.cached_request("definition", selected_loc, index, compute)
 
 
 @diplomat_server.thread()
 @diplomat_server.feature(REFERENCES)
 def references(ls : DiplomatLanguageServer ,params : ReferenceParams) -> T.List[Location]:
 	"""Returns references to the currently selected item."""
-	if not ls.indexed :
-		reindex_all(ls)
+	ensure_indexed(ls)
 
+	index = ls.svindexer.index
 	selected_loc = Location(uri=params.text_document.uri, range=Range(start=params.position, end=params.position))
-	symbol = ls.get_symbol_from_location(selected_loc)
-	if symbol is None :
-		logger.info("Symbol not found")
+
+	def compute() -> T.Optional[T.List[Location]] :
+		symbol = ls.get_symbol_from_location(selected_loc, index)
+		if symbol is None :
+			logger.info("Symbol not found")
+			return None
+		logger.debug("Requested references for symbol %s", symbol.name)
+		refs  : T.List[SQLAnchor] = index.get_symbol_references(symbol)
+		ret = ls.anchors_to_locations(refs, index)
+		logger.debug("References found is %s", ret)
+		return ret
+
+	return ls.cached_request("references", selected_loc, index, compute)
+
+
+@diplomat_server.thread()
+@diplomat_server.feature(WORKSPACE_SYMBOL)
+def workspace_symbol(ls : DiplomatLanguageServer, params : WorkspaceSymbolParams) -> T.List[SymbolInformation]:
+	"""Returns the symbols matching the query, best matches first."""
+	ensure_indexed(ls)
+	return ls.get_workspace_symbols(params.query)
+
+
+@diplomat_server.thread()
+@diplomat_server.feature(TEXT_DOCUMENT_CALL_HIERARCHY_PREPARE)
+def prepare_call_hierarchy(ls : DiplomatLanguageServer, params : CallHierarchyPrepareParams) -> T.Optional[T.List[CallHierarchyItem]]:
+	"""Returns the module at the position, or the module of the instance at the position."""
+	ensure_indexed(ls)
+
+	index = ls.svindexer.index
+	selected_loc = Location(uri=params.text_document.uri, range=Range(start=params.position, end=params.position))
+	module = ls.get_hierarchy_module(selected_loc, index)
+	if module is None :
 		return None
-	logger.debug(f"Requested references for symbol {symbol.name}")
-	refs  : T.List[SQLAnchor] = ls.svindexer.index.get_symbol_references(symbol)
-	ret = [ls.anchor_to_location(r) for r in refs]
-	logger.debug(f"References found is {ret}")
-	return ret
+	return ls.symbols_to_hierarchy_items([module], index)
+
+
+@diplomat_server.thread()
+@diplomat_server.feature(TEXT_DOCUMENT_CALL_HIERARCHY_INCOMING_CALLS)
+def call_hierarchy_incoming(ls : DiplomatLanguageServer, params : CallHierarchyIncomingCallsParams) -> T.List[CallHierarchyIncomingCall]:
+	"""Returns the modules instantiating the given one."""
+	ensure_indexed(ls)
+	return ls.get_incoming_instances(params.item, ls.svindexer.index)
+
+
+@diplomat_server.thread()
+@diplomat_server.feature(TEXT_DOCUMENT_CALL_HIERARCHY_OUTGOING_CALLS)
+def call_hierarchy_outgoing(ls : DiplomatLanguageServer, params : CallHierarchyOutgoingCallsParams) -> T.List[CallHierarchyOutgoingCall]:
+	"""Returns the modules instantiated by the given one."""
+	ensure_indexed(ls)
+	return ls.get_outgoing_instances(params.item, ls.svindexer.index)
 
 
 @diplomat_server.feature(TEXT_DOCUMENT_DID_SAVE)
 def did_save(ls: DiplomatLanguageServer, params: DidSaveTextDocumentParams):
 	"""Text document did change notification."""
-	ls.indexed = False
 	if ls.check_syntax :
 		ls.syntax_check(params.text_document.uri)
 	if ls.syntaxchecker.nberrors == 0 :
-		reindex_all(ls)
+		# Saves are debounced and coalesced by the scheduler, which runs the indexing in the background.
+		if ls.indexed :
+			ls.indexing_scheduler.request([uris.to_fs_path(params.text_document.uri)])
+		elif ls.configured :
+			ls.indexing_scheduler.request()
+
+
+@diplomat_server.feature(TEXT_DOCUMENT_DID_CHANGE)
+def did_change(ls : DiplomatLanguageServer, params : DidChangeTextDocumentParams):
+	"""Text document did change notification."""
+	if ls.configured :
+		document = ls.workspace.get_document(params.text_document.uri)
+		if ls.indexed :
+			# Anchors follow the edits, so that navigation stays accurate until the document is saved and reindexed.
+			ls.shift_document_anchors(params.text_document.uri, params.content_changes, document.source)
+		# Checks are debounced per document and run in the background on the unsaved content.
+		ls.document_check_scheduler.request(params.text_document.uri, document.source)
 
 
 @diplomat_server.feature(TEXT_DOCUMENT_DID_CLOSE)
 def did_close(server: DiplomatLanguageServer, params: DidCloseTextDocumentParams):
 	"""Text document did close notification."""
-	pass
+	server.document_check_scheduler.discard(params.text_document.uri)
 
 @diplomat_server.thread()
 @diplomat_server.feature(TEXT_DOCUMENT_DID_OPEN)
@@ -187,6 +231,33 @@ def dump_index(ls: DiplomatLanguageServer, *args):
 	ls.svindexer.dump_json_index("index_dump_debug.json","json_debug")
 	ls.svindexer.dump_json_index("index_dump.json", "json")
 
+@diplomat_server.command(DiplomatLanguageServer.CMD_DBG_RESULT_CACHE_STATS)
+def result_cache_stats(ls: DiplomatLanguageServer, *args):
+	stats = ls.result_cache.stats
+	logger.info(f"Result cache : {stats}")
+	return stats
+
+@diplomat_server.command(DiplomatLanguageServer.CMD_DBG_METRICS)
+def get_metrics(ls: DiplomatLanguageServer, *args):
+	"""Returns the durations recorded by family and name, and writes the metrics file if one is configured."""
+	ls.export_metrics()
+	return metrics.snapshot()
+
+@diplomat_server.command(DiplomatLanguageServer.CMD_DBG_PROFILE)
+def set_profiling(ls: DiplomatLanguageServer, *args):
+	"""
+	Enable or disable the profiling, as the --profile option does.
+	Arguments are [enabled, output directory, threshold in milliseconds, aggregate], all optional.
+	Without argument, toggle the profiling.
+	"""
+	params = list(args[0]) if len(args) > 0 and args[0] is not None else list()
+	enabled = bool(params[0]) if len(params) > 0 else not profiler.enabled
+	if enabled :
+		profiler.enable(*params[1:4])
+	else :
+		profiler.disable()
+	return profiler.status
+
 @diplomat_server.thread()
 @diplomat_server.command(DiplomatLanguageServer.CMD_GET_CONFIGURATION)
 def get_client_config(ls: DiplomatLanguageServer, *args):
@@ -204,27 +275,20 @@ def reindex_all(ls : DiplomatLanguageServer, *args):
 		ls.show_message_log(f"Trying to update the configuration")
 		get_client_config(ls)
 	else :
-		ls.show_message_log(f"  Clear index.")
-		ls.svindexer.clear()
-		ls.show_message_log(f"  Clear diagnostics.")
-		ls.clear_diagnostics()
-		ls.indexed = False
-		try :
-			if not ls.skip_index :
-				ls.show_message_log(f"  Reindex using file {os.path.abspath(ls.flist_path)}")
-				ls.svindexer.read_file_list(ls.flist_path)
-				ls.show_message_log(f"  Running indexer")
-				ls.svindexer.run_indexer()
-			else :
-				ls.show_message_log(f"  Reindex using file {os.path.abspath(ls.index_path)}")
-				ls.svindexer.read_index_file(ls.index_path)
-		except IndexingError :
-			ls.show_message_log(f"  Reindex failed")
-			ls.syntax_check()
-			ls.indexed = False
-		else :
-			ls.indexed = True
-			ls.show_message_log("  Indexing done")
+		ls.indexing_scheduler.request(delay=0)
+		ls.indexing_scheduler.wait()
+
+def ensure_indexed(ls : DiplomatLanguageServer):
+	"""
+	Make sure that an index is available before answering a request.
+	Wait for the indexing in progress rather than restarting it.
+	"""
+	if ls.indexed :
+		return
+	if ls.indexing_scheduler.is_busy :
+		ls.indexing_scheduler.wait()
+	else :
+		reindex_all(ls)
 
 @diplomat_server.thread()
 @diplomat_server.feature(COMPLETION)
@@ -233,9 +297,10 @@ def provide_completion(ls : DiplomatLanguageServer, params : CompletionParams )
 	document = ls.workspace.get_document(params.text_document.uri)
 	position = params.position
 
-	complete_items = ls.get_completion(document, position)
-	logger.debug(f"Found completion items : {complete_items}")
-	return CompletionList(is_incomplete = False, items=[CompletionItem(label=x) for x in complete_items])
+	complete_items, is_incomplete = ls.get_completion(document, position)
+	logger.debug("Found completion items : %s", complete_items)
+	# When cut, the client asks again as the user types, with a longer prefix.
+	return CompletionList(is_incomplete = is_incomplete, items=[CompletionItem(label=x) for x in complete_items])
 
 # As we don't have type resolution from Verible, that's useless.
 # @diplomat_server.thread()
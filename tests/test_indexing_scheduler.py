@@ -0,0 +1,47 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from backend.language_server.IndexingScheduler import IndexingScheduler
+from frontend.indexers.verible_indexer import VeribleIndexer
+
+
+class TestIndexingScheduler(unittest.TestCase):
+	def setUp(self):
+		self.work_dir = tempfile.TemporaryDirectory()
+		self.index_path = os.path.join(self.work_dir.name, "index.json")
+		with open(self.index_path, "w") as f :
+			f.write("")
+		self.indexer = VeribleIndexer(self.work_dir.name)
+
+	def tearDown(self):
+		del self.indexer
+		self.work_dir.cleanup()
+
+	def test_cancel_before_job_start_is_kept(self):
+		jobs = list()
+		dequeued = threading.Event()
+		resume = threading.Event()
+
+		def run_job(files):
+			jobs.append(files)
+			if len(jobs) == 1 :
+				# Dequeued, but the build is not started yet.
+				dequeued.set()
+				resume.wait(5)
+			self.indexer.read_index_file(self.index_path)
+
+		scheduler = IndexingScheduler(run_job, self.indexer.cancel, self.indexer.reset_cancel, delay=0)
+		scheduler.request(["a.sv"])
+		self.assertTrue(dequeued.wait(5))
+		scheduler.request(["b.sv"])
+		resume.set()
+		self.assertTrue(scheduler.wait(5))
+		self.assertEqual(jobs, [["a.sv"], ["a.sv", "b.sv"]])
+		# Only the second job built an index.
+		self.assertEqual(self.indexer.generation, 1)
+
+
+if __name__ == "__main__":
+	unittest.main()
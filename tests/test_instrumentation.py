@@ -0,0 +1,116 @@
+import os
+import pstats
+import tempfile
+import unittest
+
+from backend.instrumentation import Metrics, Histogram, Profiler
+
+
+class TestPrometheus(unittest.TestCase):
+	def setUp(self):
+		self.metrics = Metrics()
+		self.metrics.observe("sql_query", "get_symbols_by_name", 0.0007)
+		self.metrics.observe("sql_query", "get_symbols_by_name", 0.0007)
+		self.metrics.observe("sql_query", "get_symbols_by_name", 100.0)
+		self.metrics.observe("lsp_request", 'odd "name"\\\n', 0.02)
+
+	def samples(self, text : str):
+		"""
+		:return: Value of each sample line, by metric and labels
+		"""
+		ret = dict()
+		for line in text.splitlines() :
+			if not line.startswith("#") :
+				key, value = line.rsplit(" ", 1)
+				ret[key] = float(value)
+		return ret
+
+	def test_format(self):
+		text = self.metrics.to_prometheus()
+		self.assertTrue(text.endswith("\n"))
+		lines = text.splitlines()
+		# Families sorted by name, each declared once.
+		self.assertEqual([l for l in lines if l.startswith("#")],
+						 ["# TYPE diplomat_lsp_request_seconds histogram", "# TYPE diplomat_sql_query_seconds histogram"])
+		self.assertEqual(len(lines), 2 * (len(Histogram.BOUNDS) + 4))
+
+	def test_buckets(self):
+		samples = self.samples(self.metrics.to_prometheus())
+		metric = "diplomat_sql_query_seconds"
+		label = 'name="get_symbols_by_name"'
+		buckets = [samples[f'{metric}_bucket{{{label},le="{bound}"}}'] for bound in Histogram.BOUNDS]
+		# Cumulated counts.
+		self.assertEqual(buckets[0], 0)
+		self.assertEqual(buckets[1:], [2] * (len(Histogram.BOUNDS) - 1))
+		self.assertEqual(samples[f'{metric}_bucket{{{label},le="+Inf"}}'], 3)
+		self.assertEqual(samples[f'{metric}_count{{{label}}}'], 3)
+		self.assertAlmostEqual(samples[f'{metric}_sum{{{label}}}'], 100.0014)
+
+	def test_label_escaping(self):
+		samples = self.samples(self.metrics.to_prometheus())
+		self.assertEqual(samples['diplomat_lsp_request_seconds_count{name="odd \\"name\\"\\\\\\n"}'], 1)
+
+	def test_write(self):
+		with tempfile.TemporaryDirectory() as work_dir :
+			path = os.path.join(work_dir, "metrics.prom")
+			self.metrics.write_prometheus(path)
+			with open(path) as f :
+				self.assertEqual(f.read(), self.metrics.to_prometheus())
+			self.assertEqual(os.listdir(work_dir), ["metrics.prom"])
+
+
+class TestProfiler(unittest.TestCase):
+	def setUp(self):
+		self.work_dir = tempfile.TemporaryDirectory()
+		self.profiler = Profiler()
+
+	def tearDown(self):
+		self.work_dir.cleanup()
+
+	def work(self):
+		return sum(range(1000))
+
+	def run_operation(self, name : str = "hover"):
+		with self.profiler.profile("lsp_request", name) :
+			self.work()
+
+	def test_profiled_families(self):
+		self.assertFalse(self.profiler.is_profiled("lsp_request"))
+		self.profiler.enable(self.work_dir.name)
+		self.assertTrue(self.profiler.is_profiled("lsp_request"))
+		self.assertFalse(self.profiler.is_profiled("sql_query"))
+
+	def test_threshold(self):
+		self.profiler.enable(self.work_dir.name, threshold_ms=60000)
+		self.run_operation()
+		self.assertEqual(os.listdir(self.work_dir.name), [])
+		self.profiler.threshold_ms = 0
+		self.run_operation()
+		files = os.listdir(self.work_dir.name)
+		self.assertEqual(len(files), 1)
+		self.assertRegex(files[0], r"_lsp_request_hover_\d+ms\.prof$")
+
+	def test_nested_operations_are_part_of_the_outer_one(self):
+		self.profiler.enable(self.work_dir.name, threshold_ms=0)
+		with self.profiler.profile("indexing", "run_indexer") :
+			self.run_operation()
+		files = os.listdir(self.work_dir.name)
+		self.assertEqual(len(files), 1)
+		self.assertIn("_indexing_run_indexer_", files[0])
+
+	def test_aggregate(self):
+		self.profiler.enable(self.work_dir.name, threshold_ms=0, aggregate=True)
+		self.run_operation()
+		self.run_operation()
+		self.run_operation("definition")
+		# Only written when flushed.
+		self.assertEqual(os.listdir(self.work_dir.name), [])
+		self.profiler.disable()
+		self.assertEqual(sorted(os.listdir(self.work_dir.name)), ["lsp_request_definition.prof", "lsp_request_hover.prof"])
+		stats = pstats.Stats(os.path.join(self.work_dir.name, "lsp_request_hover.prof"))
+		calls = [v[1] for k, v in stats.stats.items() if k[2] == "work"]
+		self.assertEqual(calls, [2])
+
+
+if __name__ == "__main__":
+	unittest.main()
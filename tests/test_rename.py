@@ -0,0 +1,96 @@
+import os
+import tempfile
+import threading
+import unittest
+
+from pygls import uris
+from pygls.lsp.types import Position, Range, TextDocumentContentChangeEvent
+
+from backend.language_server import DiplomatLanguageServer
+from backend.sql_index_manager import SQLAnchor
+
+
+class TestRenameDuringBuild(unittest.TestCase):
+	CONTENT = "logic foo;\nassign foo = 1;\n"
+	RENAMED = "logic counter;\nassign counter = 1;\n"
+
+	def setUp(self):
+		self.work_dir = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.work_dir.name, "a.sv")
+		self.uri = uris.from_fs_path(self.path)
+		self.ls = DiplomatLanguageServer()
+		index = self.ls.svindexer.index
+		index.add_file(self.path, self.CONTENT)
+		fid = index.get_file_id(self.path)
+		# Anchor characters start at 1.
+		declaration = index.add_anchor(SQLAnchor(None, fid, (0, 7), (0, 10)))
+		self.sid = index.add_symbol("foo", "variable", declaration)
+		index.add_ref(index.add_anchor(SQLAnchor(None, fid, (1, 8), (1, 11))), self.sid)
+		self.symbol = index.get_symbol_by_id(self.sid)
+
+	def tearDown(self):
+		del self.ls
+		self.work_dir.cleanup()
+
+	def build(self, function, copy_current : bool):
+		with self.ls.svindexer._build_lock :
+			self.ls.svindexer._build_snapshot(function, copy_current)
+
+	def rename_changes(self):
+		return [TextDocumentContentChangeEvent(range=Range(start=Position(line=line, character=start),
+														   end=Position(line=line, character=start + 3)), text="counter")
+				for line, start in [(1, 7), (0, 6)]]
+
+	def get_anchors(self):
+		index = self.ls.svindexer.index
+		return index.db.execute("SELECT start_line, start_char, stop_line, stop_char FROM anchors ORDER BY id").fetchall()
+
+	def test_rename_waits_for_build(self):
+		started = threading.Event()
+		release = threading.Event()
+
+		def build(snapshot):
+			started.set()
+			release.wait(5)
+
+		builder = threading.Thread(target=self.build, args=(build, True))
+		builder.start()
+		started.wait(5)
+		renamer = threading.Thread(target=self.ls.rename_symbol, args=(self.symbol, "counter"))
+		renamer.start()
+		renamer.join(0.2)
+		self.assertTrue(renamer.is_alive())
+		release.set()
+		builder.join()
+		renamer.join()
+
+		index = self.ls.svindexer.index
+		self.assertEqual(index.get_symbol_by_id(self.sid).name, "counter")
+		self.assertEqual(index.get_file_by_path(self.path).content, self.RENAMED)
+
+	def test_rename_edit_is_not_shifted_again(self):
+		self.ls.rename_symbol(self.symbol, "counter")
+		renamed = self.get_anchors()
+		# The rename is kept by an incremental build.
+		self.build(lambda snapshot : None, copy_current=True)
+		self.ls.shift_document_anchors(self.uri, self.rename_changes(), self.RENAMED)
+		self.assertEqual(self.get_anchors(), renamed)
+
+	def test_rename_edit_is_shifted_after_rebuild(self):
+		self.ls.rename_symbol(self.symbol, "counter")
+		renamed = self.get_anchors()
+
+		def rebuild(snapshot):
+			# Content of the sources, not saved since the rename.
+			snapshot.add_file(self.path, self.CONTENT)
+			fid = snapshot.get_file_id(self.path)
+			snapshot.add_anchor(SQLAnchor(None, fid, (0, 7), (0, 10)))
+			snapshot.add_anchor(SQLAnchor(None, fid, (1, 8), (1, 11)))
+
+		self.build(rebuild, copy_current=False)
+		self.ls.shift_document_anchors(self.uri, self.rename_changes(), self.RENAMED)
+		self.assertEqual(self.get_anchors(), renamed)
+
+
+if __name__ == "__main__":
+	unittest.main()
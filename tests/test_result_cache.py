@@ -0,0 +1,77 @@
+import unittest
+
+from pygls.lsp.types import Location, Position, Range
+
+from backend.language_server import DiplomatLanguageServer
+from backend.language_server.ResultCache import ResultCache
+
+
+class TestResultCache(unittest.TestCase):
+	def test_least_recently_used_is_evicted(self):
+		cache = ResultCache(maxsize=2)
+		cache.put("a", 1, ["a.sv"])
+		cache.put("b", 2, ["b.sv"])
+		self.assertEqual(cache.get("a"), 1)
+		cache.put("c", 3, ["c.sv"])
+		self.assertIs(cache.get("b"), ResultCache.MISSING)
+		self.assertEqual((cache.get("a"), cache.get("c")), (1, 3))
+		self.assertEqual(cache.stats["evictions"], 1)
+		# The evicted entry is not tracked by its file anymore.
+		self.assertNotIn("b.sv", cache._by_file)
+
+	def test_none_is_cached(self):
+		cache = ResultCache()
+		cache.put("a", None, [])
+		self.assertIsNone(cache.get("a"))
+		self.assertEqual((cache.stats["hits"], cache.stats["misses"]), (1, 0))
+
+	def test_invalidate_files(self):
+		cache = ResultCache()
+		cache.put("a", 1, ["a.sv"])
+		cache.put("ab", 2, ["a.sv", "b.sv"])
+		cache.put("b", 3, ["b.sv"])
+		cache.invalidate_files(["a.sv"])
+		self.assertIs(cache.get("a"), ResultCache.MISSING)
+		self.assertIs(cache.get("ab"), ResultCache.MISSING)
+		self.assertEqual(cache.get("b"), 3)
+		self.assertEqual(cache._by_file, {"b.sv" : {"b"}})
+
+
+class TestCachedRequest(unittest.TestCase):
+	def setUp(self):
+		self.ls = DiplomatLanguageServer()
+		self.index = self.ls.svindexer.index
+		self.location = Location(uri="file:///a.sv", range=Range(start=Position(line=1, character=2),
+																 end=Position(line=1, character=2)))
+		self.computed = 0
+
+	def compute(self):
+		self.computed += 1
+		return Location(uri="file:///b.sv", range=self.location.range)
+
+	def request(self):
+		return self.ls.cached_request("definition", self.location, self.index, self.compute)
+
+	def test_result_is_reused(self):
+		self.assertEqual(self.request(), self.request())
+		self.assertEqual(self.computed, 1)
+
+	def test_file_change_invalidates(self):
+		self.request()
+		# Results depend on the requested file and the files they point to.
+		self.ls.result_cache.invalidate_files(["file:///b.sv"])
+		self.request()
+		self.assertEqual(self.computed, 2)
+
+	def test_new_generation_invalidates(self):
+		self.request()
+		self.index.generation += 1
+		self.request()
+		self.assertEqual(self.computed, 2)
+		self.assertEqual(len(self.ls.result_cache), 1)
+		self.request()
+		self.assertEqual(self.computed, 2)
+
+
+if __name__ == "__main__":
+	unittest.main()
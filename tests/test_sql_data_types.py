@@ -0,0 +1,103 @@
+import typing as T
+import unittest
+
+from backend.sql_index_manager import SQLIndexManager, SQLAnchor, SQLFile
+from backend.sql_index_manager.SQLDataTypes import SQLAnchorIntervals
+
+
+class TestSQLFile(unittest.TestCase):
+	def test_line_breaks(self):
+		for content in ["a\nbc\nd", "a\rbc\rd", "a\r\nbc\r\nd", "a\rbc\r\nd"] :
+			with self.subTest(content=content) :
+				file = SQLFile(1, "a.sv", content)
+				self.assertEqual(len(file.line_starts), 3)
+				offset = file.offset_from_position(1, 2)
+				self.assertEqual(content[offset], "c")
+				self.assertEqual(file.position_from_offset(offset), (1, 2))
+				self.assertEqual(content[file.offset_from_position(2, 1)], "d")
+
+	def test_shifted_anchors_match_line_table(self):
+		content = "foo\rbar\r\n"
+		index = SQLIndexManager()
+		fid = index.add_file("a.sv", content)
+		file = SQLFile(fid, "a.sv", content)
+		start = file.position_from_offset(content.index("bar"))
+		aid = index.add_anchor(SQLAnchor(None, fid, start, (start[0], start[1] + 3)))
+
+		content = "x\ry\rfoo\rbar\r\n"
+		index.shift_anchors(fid, [((0, 0), (0, 0), "x\ry\r")], content)
+		anchor = index.get_anchor_by_id(aid)
+		file = SQLFile(fid, "a.sv", content)
+		offset = file.offset_from_position(anchor.start_line, anchor.start_char)
+		self.assertEqual(content[offset:offset + 3], "bar")
+
+
+class TestSQLAnchorIntervals(unittest.TestCase):
+	def setUp(self):
+		self.index = SQLIndexManager()
+		self.fid = self.index.add_file("a.sv", "assign foo = bar.baz[qux];\nassign a = b;\n")
+
+	def add_anchors(self, spans : T.List[T.Tuple[int,int]]) -> T.List[int]:
+		# Single line anchors, as get_anchor_by_position does not compare lines and characters together.
+		return [self.index.add_anchor(SQLAnchor(None, self.fid, (0, start), (0, end))) for start, end in spans]
+
+	def check_positions(self):
+		for char in range(0, 30) :
+			with self.subTest(char=char) :
+				covering = self.index.get_anchor_by_position(self.fid, 0, char)
+				found = self.index.get_anchor_at_position(self.fid, 0, char)
+				if len(covering) == 0 :
+					self.assertIsNone(found)
+				else :
+					# The innermost anchor is the last one to start.
+					expected = max(covering, key=lambda a : (a.start_char, -a.end_char))
+					self.assertEqual((found.id, found.start_char, found.end_char),
+									 (expected.id, expected.start_char, expected.end_char))
+
+	def check_rebuilt(self):
+		rows = self.index.db.execute("SELECT id, start_line, start_char, stop_line, stop_char FROM anchors WHERE file == ?",
+									 [self.fid]).fetchall()
+		rebuilt = SQLAnchorIntervals(self.fid, rows)
+		intervals = self.index.get_anchor_intervals(self.fid)
+		for line in range(3) :
+			for char in range(0, 30) :
+				found, expected = intervals.find(line, char), rebuilt.find(line, char)
+				self.assertEqual(None if found is None else found.db_record, None if expected is None else expected.db_record)
+
+	def test_nested_anchors(self):
+		self.add_anchors([(14, 25), (14, 16), (18, 20), (22, 24), (22, 22)])
+		self.check_positions()
+
+	def test_adjacent_anchors(self):
+		self.add_anchors([(1, 6), (8, 10), (10, 12), (12, 14), (16, 17)])
+		self.check_positions()
+
+	def test_overlapping_anchors(self):
+		self.add_anchors([(2, 10), (5, 15), (6, 8), (12, 20), (14, 16)])
+		self.check_positions()
+
+	def test_updated_with_anchors(self):
+		foo, bar, baz = self.add_anchors([(8, 10), (14, 16), (18, 20)])
+		self.index.get_anchor_intervals(self.fid)
+		self.add_anchors([(14, 25)])
+		self.check_positions()
+		self.index.shift_anchors(self.fid, [((0, 7), (0, 10), "counter"), ((0, 0), (0, 0), "\n")],
+								 "\nassign counter = bar.baz[qux];\nassign a = b;\n")
+		self.check_rebuilt()
+		sid = self.index.add_symbol("bar", "variable", bar)
+		self.index.add_ref(baz, sid)
+		self.index.rename_symbol(self.index.get_symbol_by_id(sid), "b")
+		self.check_rebuilt()
+
+	def test_shared_with_clone(self):
+		self.add_anchors([(8, 10), (14, 16)])
+		intervals = self.index.get_anchor_intervals(self.fid)
+		clone = self.index.clone()
+		clone.shift_anchors(self.fid, [((0, 0), (0, 0), "\n")], "\nassign foo = bar.baz[qux];\nassign a = b;\n")
+		self.assertIs(self.index.get_anchor_intervals(self.fid), intervals)
+		self.assertEqual(intervals.find(0, 9).start_line, 0)
+		self.assertEqual(clone.get_anchor_at_position(self.fid, 1, 9).start_line, 1)
+
+
+if __name__ == "__main__":
+	unittest.main()
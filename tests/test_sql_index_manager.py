@@ -0,0 +1,303 @@
+import os
+import tempfile
+import unittest
+
+from backend.sql_index_manager import SQLIndexManager, SQLAnchor, SQLFile
+from frontend.indexers.verible_indexer import VeribleIndexer
+from benchmarks.kythe_generator import KytheGenerator
+
+
+class TestShiftAnchors(unittest.TestCase):
+	def setUp(self):
+		self.work_dir = tempfile.TemporaryDirectory()
+		self.path = os.path.join(self.work_dir.name, "a.sv")
+		with open(self.path, "w") as f :
+			f.write("foo = bar;\n")
+		with open(self.path, "rb") as f :
+			content_hash = SQLFile.hash_content(f.read())
+		self.index = SQLIndexManager(os.path.join(self.work_dir.name, "index.db"))
+		with self.index.db :
+			self.index.db.execute("INSERT INTO files(id,path,content,hash,mtime) VALUES (1,?,?,?,?)",
+								  [self.path, "foo = bar;\n", content_hash, os.path.getmtime(self.path)])
+
+	def tearDown(self):
+		del self.index
+		self.work_dir.cleanup()
+
+	def add_anchor(self, line : int, start : int, end : int) -> int:
+		# LSP positions, stored with 1-based characters.
+		return self.index.add_anchor(SQLAnchor(None, 1, (line, start + 1), (line, end + 1)))
+
+	def get_anchor(self, aid : int):
+		return tuple(self.index.db.execute("SELECT start_line, start_char - 1, stop_line, stop_char - 1 FROM anchors WHERE id == ?", [aid]).fetchone())
+
+	def test_anchors_follow_edits(self):
+		foo = self.add_anchor(0, 0, 3)
+		bar = self.add_anchor(0, 6, 9)
+		self.index.shift_anchors(1, [((0, 1), (0, 1), "X")], "fXoo = bar;\n")
+		self.assertEqual(self.get_anchor(foo), (0, 0, 0, 4))
+		self.assertEqual(self.get_anchor(bar), (0, 7, 0, 10))
+		self.index.shift_anchors(1, [((0, 5), (0, 5), "\n  ")], "fXoo \n  = bar;\n")
+		self.assertEqual(self.get_anchor(foo), (0, 0, 0, 4))
+		self.assertEqual(self.get_anchor(bar), (1, 4, 1, 7))
+
+	def test_shifted_file_is_outdated(self):
+		indexer = VeribleIndexer(self.work_dir.name)
+		self.assertFalse(indexer._is_outdated(self.path, self.index.get_files_metadata()[self.path]))
+		self.add_anchor(0, 6, 9)
+		self.index.shift_anchors(1, [((0, 0), (0, 0), "X")], "Xfoo = bar;\n")
+		self.assertTrue(indexer._is_outdated(self.path, self.index.get_files_metadata()[self.path]))
+
+
+class TestInPlaceUpdate(unittest.TestCase):
+	def setUp(self):
+		self.work_dir = tempfile.TemporaryDirectory()
+		self.indexer = VeribleIndexer(self.work_dir.name)
+		self.indexer.open_index(os.path.join(self.work_dir.name, "index.db"))
+		with self.indexer.index.db :
+			self.indexer.index.db.execute("INSERT INTO files(id,path,content) VALUES (1,'a.sv','')")
+
+	def tearDown(self):
+		del self.indexer
+		self.work_dir.cleanup()
+
+	def file_count(self) -> int:
+		return self.indexer.index.db.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+	def test_update_is_one_transaction(self):
+		seen = list()
+
+		def build(writer : SQLIndexManager):
+			with writer.db :
+				writer.db.execute("INSERT INTO files(id,path,content) VALUES (2,'b.sv','')")
+			# Scripts and blocks do not commit, so the index still reads the previous state.
+			writer.drop_query_indexes()
+			writer.create_query_indexes()
+			seen.append(self.file_count())
+
+		index = self.indexer.index
+		self.indexer._build_snapshot(build, copy_current=True)
+		self.assertEqual(seen, [1])
+		self.assertIs(self.indexer.index, index)
+		self.assertEqual(self.file_count(), 2)
+		self.assertEqual(index.get_file_id("b.sv"), 2)
+		self.assertEqual(index.generation, 1)
+		self.assertEqual(sorted(f for f in os.listdir(self.work_dir.name) if f.endswith(".db")), ["index.0.db"])
+
+	def test_failed_update_is_rolled_back(self):
+		def build(writer : SQLIndexManager):
+			with writer.db :
+				writer.db.execute("INSERT INTO files(id,path,content) VALUES (2,'b.sv','')")
+			raise RuntimeError("build failed")
+
+		with self.assertRaises(RuntimeError) :
+			self.indexer._build_snapshot(build, copy_current=True)
+		self.assertEqual(self.file_count(), 1)
+		self.assertEqual(self.indexer.generation, 0)
+
+
+class TestQueryIndexes(unittest.TestCase):
+	def setUp(self):
+		with open(f"{SQLIndexManager.SQL_ROOT_PATH}/create_query_indexes.sql") as script :
+			self.defined = {name for _, name in SQLIndexManager.QUERY_INDEX_PATTERN.findall(script.read())}
+
+	def get_objects(self, index : SQLIndexManager):
+		return {r[0] for r in index.db.execute("SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger') "
+											   "AND name NOT LIKE 'sqlite_%'")}
+
+	def test_new_index_has_query_indexes(self):
+		index = SQLIndexManager()
+		self.assertEqual(self.get_objects(index), self.defined)
+		self.assertEqual(index.check_query_plans(), dict())
+
+	def test_drop_and_create(self):
+		index = SQLIndexManager()
+		index.drop_query_indexes()
+		self.assertEqual(self.get_objects(index), set())
+		index.create_query_indexes()
+		self.assertEqual(self.get_objects(index), self.defined)
+
+	def test_migrated_index_has_query_indexes(self):
+		with tempfile.TemporaryDirectory() as work_dir :
+			path = os.path.join(work_dir, "index.db")
+			index = SQLIndexManager(path)
+			# Back to schema version 2 : the tables of the next migrations and the query indexes are removed.
+			index.drop_query_indexes()
+			with index.db :
+				for table in ["symbols_search", "instances", "includes"] :
+					index.db.execute(f"DROP TABLE {table}")
+				index.db.execute("UPDATE schema_version SET version = 2")
+			del index
+			index = SQLIndexManager(path)
+			self.assertEqual(index.schema_version, len(SQLIndexManager.MIGRATIONS))
+			self.assertEqual(self.get_objects(index), self.defined)
+			del index
+
+class TestIngest(unittest.TestCase):
+	def setUp(self):
+		self.work_dir = tempfile.TemporaryDirectory()
+		self.index_path = os.path.join(self.work_dir.name, "index.json")
+		self.generator = KytheGenerator(files=3, lines=20, symbols=5, depth=1)
+		with open(self.index_path, "w") as out :
+			self.generator.write(out)
+
+	def tearDown(self):
+		self.work_dir.cleanup()
+
+	def test_bulk_load_releases_file_contents(self):
+		index = SQLIndexManager()
+		index.read_kythe_index(self.index_path)
+		self.assertEqual(len(index.get_files_metadata()), 3)
+		self.assertEqual(index._ingested_files, dict())
+		self.assertIsNone(index._cached_file)
+
+	def test_bulk_load_uses_given_mtimes(self):
+		index = SQLIndexManager()
+		paths = [self.generator.path(i) for i in range(3)]
+		index.begin_bulk_load({paths[0] : 123.0})
+		with open(self.index_path) as f :
+			index.read_kythe_stream(f)
+		index.end_bulk_load()
+		metadata = index.get_files_metadata()
+		self.assertEqual(metadata[paths[0]][2], 123.0)
+		self.assertEqual({metadata[p][2] for p in paths[1:]}, {None})
+
+	def test_row_by_row_load_releases_file_contents(self):
+		index = SQLIndexManager()
+		index.bulk_load = False
+		index.read_kythe_index(self.index_path)
+		self.assertEqual(len(index.get_files_metadata()), 3)
+		self.assertEqual(index._ingested_files, dict())
+		self.assertIsNone(index._cached_file)
+
+
+class TestFileMetadata(unittest.TestCase):
+	def test_removed_files_are_forgotten(self):
+		index = SQLIndexManager()
+		a = index.add_file("a.sv", "module a; endmodule\n")
+		b = index.add_file("b.sv", "module b; endmodule\n")
+		self.assertEqual((index.get_file_id("a.sv"), index.get_file_path(b)), (a, "b.sv"))
+		index.remove_files(["a.sv"])
+		self.assertIsNone(index.get_file_id("a.sv"))
+		self.assertIsNone(index.get_file_path(a))
+		self.assertEqual((index.get_file_id("b.sv"), index.get_file_path(b)), (b, "b.sv"))
+		c = index.add_file("c.sv", "module c; endmodule\n")
+		self.assertEqual((index.get_file_id("c.sv"), index.get_file_path(c)), (c, "c.sv"))
+
+
+class TestSymbolSearch(unittest.TestCase):
+	def setUp(self):
+		self.index = SQLIndexManager()
+		self.fid = self.index.add_file("a.sv", "")
+
+	def add_symbol(self, name : str, declared : bool = True) -> int:
+		anchor = self.index.add_anchor(SQLAnchor(None, self.fid, (0, 1), (0, 2))) if declared else None
+		return self.index.add_symbol(name, "variable", anchor)
+
+	def search(self, query : str, limit : int = 100, offset : int = 0):
+		return [s.name for s in self.index.search_symbols(query, limit, offset)]
+
+	def test_tiers(self):
+		for name in ["my_counter_q", "c_n_t", "counter", "Counter_en", "cnt"] :
+			self.add_symbol(name)
+		self.add_symbol("m0#count#", declared=False)
+		# Prefix, then substring (from the trigram index, case-insensitive), then subsequence.
+		self.assertEqual(self.search("count"), ["counter", "my_counter_q", "Counter_en"])
+		self.assertEqual(self.search("cnt"), ["cnt", "my_counter_q", "c_n_t", "counter", "Counter_en"])
+		self.assertEqual(self.search("cnt", limit=2, offset=1), ["my_counter_q", "c_n_t"])
+		# Too short for the trigram index, found as subsequences.
+		self.assertEqual(self.search("NT"), ["my_counter_q", "c_n_t", "counter", "Counter_en", "cnt"])
+
+	def test_fuzzy_misses_reset_on_write(self):
+		self.add_symbol("counter")
+		self.assertEqual(self.search("zxq"), [])
+		self.assertTrue(self.index._is_fuzzy_miss("zxqw"))
+		self.add_symbol("z_x_q_w")
+		self.assertFalse(self.index._is_fuzzy_miss("zxqw"))
+		self.assertEqual(self.search("zxqw"), ["z_x_q_w"])
+		self.assertEqual(self.search("zxq"), ["z_x_q_w"])
+
+
+class TestHierarchy(unittest.TestCase):
+	def setUp(self):
+		self.index = SQLIndexManager()
+		self.fid = self.index.add_file("a.sv", "")
+		self.sids = dict()
+		# top instantiates core, which instantiates alu.
+		for module, members in [("top", ["u_core", "top_sig"]), ("core", ["u_alu", "core_sig"]), ("alu", ["sum"])] :
+			self.add_symbol(module)
+			for m in members :
+				self.index.add_symbol_relationship(self.sids[module], self.add_symbol(m))
+		self.add_instance("u_core", "core")
+		self.add_instance("u_alu", "alu")
+
+	def add_symbol(self, name : str) -> int:
+		self.sids[name] = self.index.add_symbol(name, "variable", self.index.add_anchor(SQLAnchor(None, self.fid, (0, 1), (0, 2))))
+		return self.sids[name]
+
+	def add_instance(self, instance : str, module : str):
+		with self.index.db :
+			self.index.db.execute("INSERT INTO instances(instance,module) VALUES (?,?)", [self.sids[instance], self.sids[module]])
+
+	def symbol(self, name : str):
+		return self.index.get_symbol_by_id(self.sids[name])
+
+	def names(self, symbols):
+		return [s.name for s in symbols]
+
+	def test_ancestors(self):
+		self.assertEqual(self.names(self.index.get_symbol_ancestors(self.symbol("sum"))), ["alu"])
+		self.index.add_symbol_relationship(self.sids["top"], self.sids["core"])
+		self.assertEqual(self.names(self.index.get_symbol_ancestors(self.symbol("u_alu"))), ["core", "top"])
+		self.assertEqual(self.names(self.index.get_symbol_ancestors(self.symbol("u_alu"), max_depth=1)), ["core"])
+
+	def test_descendants(self):
+		top = self.symbol("top")
+		self.assertEqual(self.names(self.index.get_symbol_descendants(top)),
+						 ["top_sig", "u_core", "core_sig", "u_alu", "sum"])
+		self.assertEqual(self.names(self.index.get_symbol_descendants(top, max_depth=2)),
+						 ["top_sig", "u_core", "core_sig", "u_alu"])
+		self.assertEqual(self.names(self.index.get_symbol_descendants(top, through_instances=False)), ["top_sig", "u_core"])
+
+	def test_resolve_hierarchical_path(self):
+		self.assertEqual(self.names(self.index.resolve_hierarchical_path("top.u_core.u_alu.sum")), ["sum"])
+		self.assertEqual(self.names(self.index.resolve_hierarchical_path("top . u_core.core_sig")), ["core_sig"])
+		self.assertEqual(self.index.resolve_hierarchical_path("top.core_sig"), [])
+		self.assertEqual(self.index.resolve_hierarchical_path("top..u_core"), [])
+
+	def test_cycles_end(self):
+		# An instance of top within alu, and a parent loop.
+		self.index.add_symbol_relationship(self.sids["alu"], self.add_symbol("u_top"))
+		self.add_instance("u_top", "top")
+		self.index.add_symbol_relationship(self.sids["sum"], self.sids["alu"])
+		descendants = self.names(self.index.get_symbol_descendants(self.symbol("top")))
+		self.assertEqual(sorted(descendants), sorted(["top_sig", "u_core", "core_sig", "u_alu", "sum", "u_top", "alu"]))
+		ancestors = self.names(self.index.get_symbol_ancestors(self.symbol("sum")))
+		self.assertEqual(ancestors, ["alu", "sum"])
+		path = "top" + ".u_core.u_alu.u_top" * 20 + ".top_sig"
+		self.assertEqual(self.names(self.index.resolve_hierarchical_path(path)), ["top_sig"])
+
+
+class TestMemberNames(unittest.TestCase):
+	def setUp(self):
+		self.index = SQLIndexManager()
+		self.index.add_file("a.sv", "module top(input clk, input rst);\nendmodule\n")
+		self.fid = self.index.get_file_id("a.sv")
+
+	def add_symbol(self, name : str, declared : bool = True) -> int:
+		anchor = self.index.add_anchor(SQLAnchor(None, self.fid, (0, 1), (0, 4))) if declared else None
+		return self.index.add_symbol(name, "variable", anchor)
+
+	def test_undeclared_symbols_are_not_members(self):
+		top = self.add_symbol("top")
+		self.index.add_symbol_relationship(top, self.add_symbol("clk"))
+		# Referenced but never declared, named after its signature.
+		self.index.add_symbol_relationship(top, self.add_symbol("top#rst#", declared=False))
+		undeclared_top = self.add_symbol("top", declared=False)
+		self.index.add_symbol_relationship(undeclared_top, self.add_symbol("data"))
+		self.assertEqual(self.index.get_member_names("top"), (["clk"], False))
+		self.assertEqual(self.index.get_member_names("top", "t"), ([], False))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,65 @@
+import base64
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from frontend.indexers.verible_indexer import VeribleIndexer
+from benchmarks.kythe_generator import KytheGenerator
+
+
+class TestShards(unittest.TestCase):
+	def setUp(self):
+		self.work_dir = tempfile.TemporaryDirectory()
+		# m0 instantiates m2 and m1 instantiates m3.
+		generator = KytheGenerator(files=4, lines=20, symbols=2, depth=2, root=self.work_dir.name)
+		self.records = dict()
+		for m in range(4) :
+			path = generator.path(m)
+			self.records[path] = generator.module_records(m)
+			text = next(json.loads(r) for r in self.records[path] if '"/kythe/text"' in r)
+			with open(path, "w") as f :
+				f.write(base64.b64decode(text["fact_value"]).decode("utf-8"))
+		self.indexer = VeribleIndexer(self.work_dir.name)
+		self.indexer.filelist = list(self.records)
+		self.indexer.workers = 2
+
+	def tearDown(self):
+		self.work_dir.cleanup()
+
+	def extract(self, index, filelist_path : str):
+		# As the extractor, only resolve the references to what is declared in the file list.
+		with open(filelist_path) as f :
+			paths = f.read().split("\n")
+		lines = list()
+		for path in paths :
+			for r in self.records[path] :
+				record = json.loads(r)
+				if record.get("edge_kind") == "/kythe/edge/ref" and record["target"]["path"] not in paths :
+					continue
+				lines.append(r)
+		index.read_kythe_stream(lines)
+
+	def test_instantiated_module_in_same_shard(self):
+		shards = self.indexer.split_shards(2)
+		self.assertEqual(len(shards), 2)
+		for parent, child in [(0, 2), (1, 3)] :
+			self.assertTrue(any(self.indexer.filelist[parent] in shard and self.indexer.filelist[child] in shard
+								for shard in shards))
+
+	def test_cross_file_instances_are_kept(self):
+		with mock.patch.object(self.indexer, "_stream_extractor", side_effect=self.extract) as extractor :
+			self.indexer.run_indexer()
+		self.assertEqual(extractor.call_count, 2)
+		index = self.indexer.index
+		for parent, child in [(0, 2), (1, 3)] :
+			module = index.get_symbols_by_name(f"m{child}")[0]
+			references = index.get_symbol_references(module)
+			self.assertEqual([index.get_file_path(a.file) for a in references], [self.indexer.filelist[parent]])
+			instance = index.get_symbols_by_name(f"u_m{child}")[0]
+			self.assertEqual(index.get_instance_module(instance).name, f"m{child}")
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,85 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from backend.language_server import DiplomatLanguageServer
+from frontend.checkers import VeribleSyntaxChecker
+
+
+class TestSyntaxCheckCache(unittest.TestCase):
+	def setUp(self):
+		self.work_dir = tempfile.TemporaryDirectory()
+		self.files = list()
+		for i in range(3) :
+			path = os.path.join(self.work_dir.name, f"m{i}.sv")
+			with open(path, "w") as f :
+				f.write(f"module m{i}; endmodule\n")
+			self.files.append(path)
+
+	def tearDown(self):
+		self.work_dir.cleanup()
+
+	def test_unchanged_files_are_not_checked_again(self):
+		checker = VeribleSyntaxChecker()
+		with mock.patch.object(checker, "_check_files", return_value=dict()) as check :
+			checker._run(self.files, incr=True)
+			self.assertEqual(sorted(f for call in check.call_args_list for f in call.args[0]), sorted(self.files))
+			check.reset_mock()
+			checker._run(self.files, incr=True)
+			check.assert_not_called()
+
+	def test_changed_file_is_checked_again(self):
+		checker = VeribleSyntaxChecker()
+		with mock.patch.object(checker, "_check_files", return_value=dict()) as check :
+			checker._run(self.files, incr=True)
+			check.reset_mock()
+			with open(self.files[1], "a") as f :
+				f.write("// changed\n")
+			checker._run(self.files, incr=True)
+			check.assert_called_once_with([self.files[1]])
+
+	def test_lock_is_free_during_check(self):
+		checker = VeribleSyntaxChecker()
+		acquired = list()
+
+		def check(files):
+			acquired.append(checker._lock.acquire(timeout=1))
+			if acquired[-1] :
+				checker._lock.release()
+			return dict()
+
+		with mock.patch.object(checker, "_check_files", side_effect=check) :
+			checker._run(self.files, incr=True)
+		self.assertEqual(acquired, [True])
+
+	def test_content_checked_meanwhile_is_kept(self):
+		checker = VeribleSyntaxChecker()
+
+		def check(files):
+			# Unsaved content of the first file, checked while the files on disk are.
+			if checker._lock.acquire(timeout=1) :
+				checker._cache[self.files[0]] = ("unsaved", list())
+				checker._lock.release()
+			return dict()
+
+		with mock.patch.object(checker, "_check_files", side_effect=check) :
+			checker._run(self.files, incr=True)
+		self.assertEqual(checker._cache[self.files[0]][0], "unsaved")
+		self.assertNotEqual(checker._cache[self.files[1]][0], "unsaved")
+
+	def test_workspace_check_uses_resolved_file_list(self):
+		ls = DiplomatLanguageServer()
+		ls.svindexer.workspace_root = self.work_dir.name
+		# Lines of a file list, relative to the workspace and with their line ends.
+		ls.svindexer.filelist = [f"{os.path.basename(f)}\n" for f in self.files]
+		with mock.patch.object(ls.syntaxchecker, "_check_files", return_value=dict()) as check :
+			ls.syntax_check()
+			self.assertEqual(sorted(f for call in check.call_args_list for f in call.args[0]), sorted(self.files))
+			check.reset_mock()
+			ls.syntax_check()
+			check.assert_not_called()
+
+
+if __name__ == "__main__":
+	unittest.main()